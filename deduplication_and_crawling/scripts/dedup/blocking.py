@@ -0,0 +1,329 @@
+# dedup/blocking.py
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Multi-pass blocking.
+# Each pass proposes candidate pairs cheaply; the union of the passes is compared.
+# A record with a noisy postcode is still found by the name, DOB or address passes.
+#
+# Candidate pairs are int64 codes i * n + j (row positions, i < j), sorted and unique,
+# so the union of passes is a sorted merge instead of a set of tuples.
+#
+# Every pass costs O(n log n) plus the pairs it emits:
+#   - key blocking (postcode, phonetic surname) skips blocks larger than max_block,
+#     reported as oversized, so one common key cannot make it quadratic;
+#   - sorted neighbourhood pairs each record with the next window - 1 records in key order;
+#   - MinHash-LSH pairs the records sharing any band of their address signature.
+
+
+def _is_missing(value: Any) -> bool:
+    """None, NaN, NaT or pd.NA (pandas need not be installed to check)."""
+    if value is None:
+        return True
+    try:
+        return bool(value != value)
+    except TypeError: # pd.NA: comparisons give NA, which has no truth value
+        return True
+
+
+def _text_column(records: Any, column: str) -> List[str]:
+    """records[column] as stripped lowercase strings; missing values (None/NaN/NA) become ''."""
+    return ["" if _is_missing(value) else str(value).strip().lower() for value in records[column]]
+
+
+def _labels(keys: Sequence[str]) -> np.ndarray:
+    """Dense int label per key; -1 for an empty key (the record is in no block)."""
+    uniques, labels = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+    labels = labels.astype(np.int64)
+    if len(uniques) and uniques[0] == "": # '' sorts first
+        labels -= 1
+    return labels
+
+
+def _encode(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    return np.minimum(a, b).astype(np.int64) * n + np.maximum(a, b)
+
+
+def _sorted_unique(codes: np.ndarray) -> np.ndarray:
+    """Sorted distinct codes (sort + adjacent compare: cheaper than np.unique on large int arrays)."""
+    codes = np.sort(codes)
+    return codes[np.r_[True, codes[1:] != codes[:-1]]] if len(codes) else codes
+
+
+def _union(chunks: List[np.ndarray]) -> np.ndarray:
+    return _sorted_unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+
+
+def pairs_within_groups(labels: np.ndarray, max_block: Optional[int] = None) -> Tuple[np.ndarray, int]:
+    """
+    Every pair of records with the same label (>= 0), as sorted pair codes (each pair
+    once), and the number of groups skipped for having more than max_block records.
+    Work is proportional to the pairs emitted, not to n * max_block.
+    """
+    n = len(labels)
+    members = np.flatnonzero(labels >= 0)
+    order = members[np.argsort(labels[members], kind="stable")]
+    if len(order) < 2:
+        return np.empty(0, dtype=np.int64), 0
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    oversized = int(np.count_nonzero(sizes > max_block)) if max_block is not None else 0
+    kept = (sizes >= 2) if max_block is None else (sizes >= 2) & (sizes <= max_block)
+    ends = np.repeat(starts + sizes, sizes)
+    pos = np.flatnonzero(np.repeat(kept, sizes))
+    chunks = []
+    d = 1
+    while pos.size:
+        pos = pos[pos + d < ends[pos]]
+        if pos.size:
+            chunks.append(_encode(order[pos], order[pos + d], n))
+        d += 1
+    return _union(chunks), oversized
+
+
+def decode_pairs(pairs: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pair codes -> (first row positions, second row positions)."""
+    return pairs // n, pairs % n
+
+
+# ----------------------
+# Passes
+# ----------------------
+@dataclass(frozen=True)
+class ExactPass:
+    """Records with the same non-empty value of column (recordlinkage's Index().block(column))."""
+    column: str
+    max_block: Optional[int] = 1000
+
+    @property
+    def name(self) -> str:
+        return f"exact({self.column})"
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def pairs(self, records: Any, n: int) -> Tuple[np.ndarray, int]:
+        return pairs_within_groups(_labels(_text_column(records, self.column)), self.max_block)
+
+
+@dataclass(frozen=True)
+class PhoneticPass:
+    """Records whose column encodes alike with a jellyfish phonetic encoder (soundex, metaphone, nysiis...)."""
+    column: str
+    encoder: str = "soundex"
+    max_block: Optional[int] = 1000
+
+    @property
+    def name(self) -> str:
+        return f"{self.encoder}({self.column})"
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def pairs(self, records: Any, n: int) -> Tuple[np.ndarray, int]:
+        import jellyfish
+        encode = getattr(jellyfish, self.encoder)
+        keys = [encode(value) if value else "" for value in _text_column(records, self.column)]
+        return pairs_within_groups(_labels(keys), self.max_block)
+
+
+@dataclass(frozen=True)
+class SortedNeighbourhoodPass:
+    """
+    Records sorted on the concatenated columns; each is paired with the next window - 1.
+    Records with an empty key are left out (they would all sort together).
+    """
+    columns: Tuple[str, ...]
+    window: int = 5
+
+    @property
+    def name(self) -> str:
+        return f"sorted({'+'.join(self.columns)}, w={self.window})"
+
+    def pairs(self, records: Any, n: int) -> Tuple[np.ndarray, int]:
+        keys = np.asarray([" ".join(parts) for parts in zip(*(_text_column(records, c) for c in self.columns))])
+        members = np.flatnonzero(np.char.str_len(np.char.strip(keys)) > 0) if len(keys) else np.empty(0, dtype=np.int64)
+        order = members[np.argsort(keys[members], kind="stable")]
+        chunks = [_encode(order[:-d], order[d:], n) for d in range(1, min(self.window, len(order)))]
+        return _union(chunks), 0
+
+
+# Universal hashing (a * x + b) mod MINHASH_PRIME with a, b, x < 2^32: exact in uint64
+MINHASH_PRIME = np.uint64(4294967311) # smallest prime above 2^32
+SHINGLE_BASE = np.uint64(257)
+
+
+@dataclass(frozen=True)
+class MinHashLSHPass:
+    """
+    Records whose column shares a band of its MinHash signature over character shingles.
+    bands * rows hash functions; a pair with Jaccard similarity s collides in at least
+    one band with probability 1 - (1 - s^rows)^bands (0.5 around s = (1/bands)^(1/rows)).
+    """
+    column: str
+    shingle: int = 3
+    bands: int = 16
+    rows: int = 4
+    max_block: Optional[int] = 1000
+    seed: int = 0
+    chunk: int = 100_000 # records hashed at a time (memory: ~8 bytes * 3 per shingle of a chunk)
+
+    @property
+    def name(self) -> str:
+        return f"minhash({self.column}, k={self.shingle}, b={self.bands}, r={self.rows})"
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def _shingle_ids(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (32-bit id of every k-byte shingle of " text " (padded to k bytes), offset of each
+        text's first shingle). A shingle id is its bytes in base 257 mod 2^32.
+        """
+        k = self.shingle
+        encoded = [f" {text} ".encode("utf-8").ljust(k) for text in texts]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        buf = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        ids = np.zeros(len(buf) - k + 1, dtype=np.uint64)
+        for j in range(k):
+            ids = ids * SHINGLE_BASE + buf[j:len(buf) - k + 1 + j]
+        ids &= np.uint64(0xFFFFFFFF)
+        # Keep the shingles lying within one text: the first len - k + 1 of each
+        counts = lengths - k + 1
+        local = np.arange(len(buf)) - np.repeat(np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        keep = (local < np.repeat(counts, lengths))[:len(ids)]
+        return ids[keep], np.r_[0, np.cumsum(counts)[:-1]]
+
+    def signatures(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(row positions with a non-empty text, their signatures: uint64 array of shape (len, bands * rows))."""
+        rng = np.random.default_rng(self.seed)
+        num_hashes = self.bands * self.rows
+        a = rng.integers(1, 1 << 32, size=num_hashes, dtype=np.uint64)
+        b = rng.integers(0, 1 << 32, size=num_hashes, dtype=np.uint64)
+        rows = np.asarray([i for i, text in enumerate(texts) if text], dtype=np.int64)
+        signatures = np.empty((len(rows), num_hashes), dtype=np.uint64)
+        for start in range(0, len(rows), self.chunk):
+            chunk_rows = rows[start:start + self.chunk]
+            x, offsets = self._shingle_ids([texts[i] for i in chunk_rows])
+            for h in range(num_hashes): # one hash function at a time: memory O(shingles)
+                signatures[start:start + len(chunk_rows), h] = np.minimum.reduceat((a[h] * x + b[h]) % MINHASH_PRIME, offsets)
+        return rows, signatures
+
+    def pairs(self, records: Any, n: int) -> Tuple[np.ndarray, int]:
+        rows, signatures = self.signatures(_text_column(records, self.column))
+        # A band's rows are folded into one 63-bit key (a collision only adds a candidate)
+        rng = np.random.default_rng(self.seed + 1)
+        mix = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        chunks, oversized = [], 0
+        for band in range(self.bands):
+            band_signatures = signatures[:, band * self.rows:(band + 1) * self.rows]
+            keys = (band_signatures * mix).sum(axis=1, dtype=np.uint64) >> np.uint64(1)
+            labels = np.full(n, -1, dtype=np.int64)
+            labels[rows] = keys.astype(np.int64)
+            band_pairs, band_oversized = pairs_within_groups(labels, self.max_block)
+            chunks.append(band_pairs)
+            oversized += band_oversized
+        return _union(chunks), oversized
+
+
+# Passes for the cleaned person records of dedup_pipeline.ipynb
+DEFAULT_PASSES = (
+    ExactPass("postcode"),
+    PhoneticPass("surname", "soundex"),
+    PhoneticPass("surname", "metaphone"),
+    SortedNeighbourhoodPass(("surname", "given_name", "date_of_birth")),
+    SortedNeighbourhoodPass(("date_of_birth", "given_name", "surname")),
+    MinHashLSHPass("full_address"),
+)
+
+
+# ----------------------
+# Blocker
+# ----------------------
+@dataclass
+class BlockingResult:
+    """Candidate pairs of n records (sorted unique codes i * n + j, i < j) and per-pass stats."""
+    n: int
+    pairs: np.ndarray
+    passes: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def total_pairs(self) -> int:
+        return self.n * (self.n - 1) // 2
+
+    @property
+    def reduction_ratio(self) -> float:
+        """Share of all n * (n - 1) / 2 pairs that are not compared."""
+        return 1.0 - len(self.pairs) / self.total_pairs if self.total_pairs else 0.0
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        return decode_pairs(self.pairs, self.n)
+
+    def to_multiindex(self, index: Any):
+        """pandas MultiIndex of index labels, as recordlinkage's Index().index(df) returns (for Compare.compute)."""
+        import pandas as pd
+        first, second = self.positions()
+        labels = np.asarray(index)
+        return pd.MultiIndex.from_arrays([labels[first], labels[second]])
+
+    def pair_completeness(self, true_labels: Sequence[Any]) -> Dict[str, Any]:
+        """Share of the true duplicate pairs (records with the same true label) among the candidates, overall and per pass."""
+        truth, _ = pairs_within_groups(_labels([str(label) for label in true_labels]))
+        found = np.isin(truth, self.pairs, assume_unique=True)
+        completeness = {"true_pairs": len(truth), "found": int(found.sum()),
+                        "pair_completeness": float(found.mean()) if len(truth) else 1.0, "by_pass": {}}
+        for stats in self.passes:
+            completeness["by_pass"][stats["pass"]] = float(np.isin(truth, stats["pair_codes"]).mean()) if len(truth) else 1.0
+        return completeness
+
+    def describe(self) -> str:
+        lines = [f"{'pass':52s} {'pairs':>10s} {'new':>10s} {'oversized':>9s} {'seconds':>8s}"]
+        for stats in self.passes:
+            lines.append(f"{stats['pass']:52s} {stats['pairs']:>10d} {stats['new_pairs']:>10d} "
+                         f"{stats['oversized_blocks']:>9d} {stats['seconds']:>8.2f}")
+        lines.append(f"{len(self.pairs)} candidate pairs out of {self.total_pairs} for {self.n} records "
+                     f"(reduction ratio {self.reduction_ratio:.4%})")
+        return "\n".join(lines)
+
+
+class MultiPassBlocker:
+    """
+    Union of blocking passes over a table of records (a DataFrame, or a dict of equally
+    long columns); pairs refer to row positions. A pass has a name, the columns it reads
+    and pairs(records, n) -> (sorted unique pair codes, oversized blocks skipped).
+
+        blocker = MultiPassBlocker()                   # DEFAULT_PASSES
+        result = blocker.block(df_clean)
+        print(result.describe())                       # pairs / new pairs per pass, reduction ratio
+        candidate_pairs = result.to_multiindex(df_clean.index)
+        result.pair_completeness(df_clean['soc_sec_id'])
+    """
+
+    def __init__(self, passes: Sequence[Any] = DEFAULT_PASSES):
+        if not passes:
+            raise ValueError("At least one blocking pass is needed")
+        self.passes = list(passes)
+
+    def block(self, records: Any) -> BlockingResult:
+        n = len(records[self.passes[0].columns[0]])
+        result = BlockingResult(n, np.empty(0, dtype=np.int64))
+        for blocking_pass in self.passes:
+            start = time.perf_counter()
+            pass_pairs, oversized = blocking_pass.pairs(records, n)
+            before = len(result.pairs)
+            result.pairs = _union([result.pairs, pass_pairs])
+            result.passes.append({"pass": blocking_pass.name, "pairs": len(pass_pairs),
+                                  "new_pairs": len(result.pairs) - before, "oversized_blocks": oversized,
+                                  "seconds": time.perf_counter() - start, "pair_codes": pass_pairs})
+        return result
@@ -0,0 +1,7 @@
+from bench.corpus import QUERY_CLASSES, NewsCorpus, SyntheticCorpus, make_queries
+from bench.runner import compare, measure, run_suite
+from bench.variants import VARIANTS, Variant, select_variants
+
+__all__ = ["QUERY_CLASSES", "NewsCorpus", "SyntheticCorpus", "make_queries",
+           "compare", "measure", "run_suite",
+           "VARIANTS", "Variant", "select_variants"]
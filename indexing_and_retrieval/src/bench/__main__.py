@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+
+from bench.corpus import NewsCorpus, SyntheticCorpus
+from bench.runner import compare, run_suite
+from bench.variants import VARIANTS, select_variants
+
+# Usage (from indexing_and_retrieval/src):
+#   python -m bench list
+#   python -m bench run --docs 2000 20000 --variants compact block sqlite-blob --out run.json
+#   python -m bench run --corpus news --news-dir ../data/news --docs 10000 --out news.json
+#   python -m bench run --docs 100000 --variants compact sharded-1 sharded-2 sharded-4 sharded-8 --out shards.json
+#   python -m bench compare base.json run.json --threshold 1.15   # exit code 1 on regressions
+
+
+def _run(args) -> int:
+    if args.corpus == "news":
+        specs = [NewsCorpus(args.news_dir, limit).spec() for limit in (args.docs or [None])]
+    else:
+        specs = [SyntheticCorpus(n, args.vocab, args.doc_len, args.zipf, args.phrases, args.phrase_rate,
+                                 args.seed).spec() for n in (args.docs or [10_000])]
+    variants = select_variants(args.variants, with_redis=args.redis is not None)
+    report = run_suite(variants, specs, per_class=args.queries_per_class, repeat=args.repeat,
+                       top_k=args.top_k or None, seed=args.seed, in_process=args.in_process,
+                       redis_url=args.redis, log=lambda line: print(line, file=sys.stderr))
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(report['runs'])} runs to {args.out}", file=sys.stderr)
+    return 1 if any(run.get("error") for run in report["runs"]) else 0
+
+
+def _compare(args) -> int:
+    with open(args.old) as f: old = json.load(f)
+    with open(args.new) as f: new = json.load(f)
+    rows = compare(old, new, args.threshold)
+    for row in rows:
+        print(f"REGRESSION {row['variant']:18s} {row['metric']:24s} {row['old']:>12} -> {row['new']:>12} (x{row['ratio']})")
+    print(f"{len(rows)} regressions (threshold x{args.threshold})")
+    return 1 if rows else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="SelfIndex benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="list the index variants")
+
+    run = sub.add_parser("run", help="build, load and query variants, write a JSON report")
+    run.add_argument("--corpus", choices=("synthetic", "news"), default="synthetic")
+    run.add_argument("--docs", type=int, nargs="+", help="corpus sizes (news: article limits)")
+    run.add_argument("--news-dir", default="../data/news")
+    run.add_argument("--vocab", type=int, default=50_000)
+    run.add_argument("--doc-len", type=int, default=150)
+    run.add_argument("--zipf", type=float, default=1.05)
+    run.add_argument("--phrases", type=int, default=2_000)
+    run.add_argument("--phrase-rate", type=float, default=0.02)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--variants", nargs="+", help="variant names (default: all)")
+    run.add_argument("--queries-per-class", type=int, default=50)
+    run.add_argument("--repeat", type=int, default=3, help="timed passes over the query set")
+    run.add_argument("--top-k", type=int, default=10, help="0 ranks every match")
+    run.add_argument("--redis", metavar="HOST:PORT", help="also run the Redis variants against this server")
+    run.add_argument("--in-process", action="store_true", help="no subprocess per variant (debugging)")
+    run.add_argument("--out", default="bench_results.json")
+
+    cmp = sub.add_parser("compare", help="report metrics that regressed between two reports")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=1.10)
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for v in VARIANTS:
+            print(f"{v.name:18s} {v.cls:20s} info={v.info} dstore={v.dstore} compr={v.compr} optim={v.optim}"
+                  + (" (needs --redis)" if v.needs_redis else ""))
+        return 0
+    return _run(args) if args.command == "run" else _compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
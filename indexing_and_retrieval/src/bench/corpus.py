@@ -0,0 +1,162 @@
+import json
+import os
+import random
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# ----------------------
+# Benchmark corpora and query sets
+# ----------------------
+# Everything is derived from a seed with random.Random, so the same spec gives the same
+# documents and queries on every machine and in every benchmark subprocess.
+
+Doc = Tuple[str, str]
+
+_SYLLABLES = ["ka", "lo", "mi", "ner", "tu", "sa", "ve", "ron", "di", "pa", "qu", "el",
+              "in", "or", "ba", "te", "zu", "fi", "gan", "ho", "je", "wy", "ch", "st"]
+
+
+def _word(rank: int) -> str:
+    """Deterministic pseudo-word for a vocabulary rank; frequent ranks get short words."""
+    syllables = []
+    rank += 1
+    while rank:
+        rank, r = divmod(rank - 1, len(_SYLLABLES))
+        syllables.append(_SYLLABLES[r])
+    return "".join(syllables)
+
+
+class SyntheticCorpus:
+    """
+    Seeded corpus with a Zipfian vocabulary and phrase structure.
+    - words are drawn with P(rank) ~ 1 / (rank + 1)^zipf_s
+    - `phrases` fixed collocations of 2-3 mid-frequency words ("kalo mine") are planted
+      with probability phrase_rate per position; their own popularity is Zipfian too, so
+      phrase queries range from rare to common
+    - document lengths vary uniformly within +-50% of doc_len
+    """
+
+    def __init__(self, num_docs: int, vocab_size: int = 50_000, doc_len: int = 150, zipf_s: float = 1.05,
+                 phrases: int = 2_000, phrase_rate: float = 0.02, seed: int = 0):
+        self.num_docs, self.vocab_size, self.doc_len, self.zipf_s = num_docs, vocab_size, doc_len, zipf_s
+        self.num_phrases, self.phrase_rate, self.seed = phrases, phrase_rate, seed
+        self.vocab = [_word(rank) for rank in range(vocab_size)]
+        self._cum_weights = list(accumulate(1.0 / (rank + 1) ** zipf_s for rank in range(vocab_size)))
+
+        rng = random.Random(seed)
+        mid = range(min(50, vocab_size - 1), min(5_000, vocab_size))
+        self.phrases = [" ".join(self.vocab[rng.choice(mid)] for _ in range(rng.choice((2, 2, 3))))
+                        for _ in range(phrases)]
+        self._phrase_cum = list(accumulate(1.0 / (i + 1) for i in range(phrases)))
+
+    def spec(self) -> Dict[str, Any]:
+        return {"kind": "synthetic", "num_docs": self.num_docs, "vocab_size": self.vocab_size,
+                "doc_len": self.doc_len, "zipf_s": self.zipf_s, "phrases": self.num_phrases,
+                "phrase_rate": self.phrase_rate, "seed": self.seed}
+
+    def _pick(self, rng: random.Random, cum: List[float], items: List[str]) -> str:
+        return items[bisect_left(cum, rng.random() * cum[-1])]
+
+    def __iter__(self) -> Iterator[Doc]:
+        rng = random.Random(self.seed + 1)
+        for i in range(self.num_docs):
+            n = rng.randint(max(1, self.doc_len // 2), self.doc_len * 3 // 2)
+            words: List[str] = []
+            while len(words) < n:
+                if self.phrases and rng.random() < self.phrase_rate:
+                    words.append(self._pick(rng, self._phrase_cum, self.phrases))
+                else:
+                    words.append(self._pick(rng, self._cum_weights, self.vocab))
+            yield f"doc{i:07d}", " ".join(words)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+
+class NewsCorpus:
+    """The news JSON dump used by es.ipynb: uuid -> title + " " + text, first `limit` articles."""
+
+    def __init__(self, folder: str, limit: Optional[int] = None):
+        self.folder, self.limit = folder, limit
+
+    def spec(self) -> Dict[str, Any]:
+        return {"kind": "news", "folder": os.path.abspath(self.folder), "limit": self.limit}
+
+    def __iter__(self) -> Iterator[Doc]:
+        seen = set()
+        for dirpath, _, filenames in sorted(os.walk(self.folder)):
+            for file_name in sorted(filenames):
+                if not file_name.endswith(".json"): continue
+                try:
+                    with open(os.path.join(dirpath, file_name), encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                doc_id, text = data.get("uuid"), data.get("text")
+                if not doc_id or not text or doc_id in seen: continue
+                seen.add(doc_id)
+                yield doc_id, (data.get("title") or "") + " " + text
+                if self.limit is not None and len(seen) >= self.limit: return
+
+
+def corpus_from_spec(spec: Dict[str, Any]):
+    if spec["kind"] == "synthetic":
+        return SyntheticCorpus(spec["num_docs"], spec["vocab_size"], spec["doc_len"], spec["zipf_s"],
+                               spec["phrases"], spec["phrase_rate"], spec["seed"])
+    if spec["kind"] == "news":
+        return NewsCorpus(spec["folder"], spec["limit"])
+    raise ValueError(f"Unknown corpus kind: {spec['kind']}")
+
+
+# ----------------------
+# Queries
+# ----------------------
+QUERY_CLASSES = ("term", "and", "or", "not", "phrase")
+
+
+def make_queries(docs: List[Doc], tokenize, per_class: int = 50, seed: int = 0) -> Dict[str, List[str]]:
+    """
+    per_class queries of each class, built from the corpus itself so they match something:
+    terms are drawn from the top 2% .. 50% of the vocabulary by df (neither stopword-like
+    nor hapax); AND pairs and the positive side of AND NOT co-occur in a sampled doc;
+    phrases are adjacent token pairs of sampled docs.
+    """
+    rng = random.Random(seed + 2)
+    df: Dict[str, int] = {}
+    sample = docs if len(docs) <= 5_000 else rng.sample(docs, 5_000)
+    tokenized = [tokenize(text) for _, text in sample]
+    for tokens in tokenized:
+        for term in set(tokens):
+            df[term] = df.get(term, 0) + 1
+    by_df = sorted(df, key=lambda t: (-df[t], t))
+    band = by_df[len(by_df) // 50: max(len(by_df) // 2, len(by_df) // 50 + 1)] or by_df
+    in_band = set(band)
+
+    def term() -> str:
+        return f'"{rng.choice(band)}"'
+
+    def pair() -> Tuple[str, str]:
+        for _ in range(100):
+            terms = sorted(in_band.intersection(rng.choice(tokenized)))
+            if len(terms) >= 2:
+                a, b = rng.sample(terms, 2)
+                return f'"{a}"', f'"{b}"'
+        return term(), term()
+
+    def phrase() -> str:
+        for _ in range(100):
+            tokens = rng.choice(tokenized)
+            if len(tokens) >= 2:
+                i = rng.randrange(len(tokens) - 1)
+                if tokens[i] in df and tokens[i + 1] in df:
+                    return f'"{tokens[i]} {tokens[i + 1]}"'
+        return term()
+
+    return {
+        "term": [term() for _ in range(per_class)],
+        "and": [" AND ".join(pair()) for _ in range(per_class)],
+        "or": [f"{term()} OR {term()}" for _ in range(per_class)],
+        "not": [f"{pair()[0]} AND NOT {term()}" for _ in range(per_class)],
+        "phrase": [phrase() for _ in range(per_class)],
+    }
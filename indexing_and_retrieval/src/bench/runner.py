@@ -0,0 +1,222 @@
+import contextlib
+import datetime
+import gc
+import inspect
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bench.corpus import QUERY_CLASSES, corpus_from_spec, make_queries
+from bench.variants import VARIANTS_BY_NAME, Variant
+
+# ----------------------
+# Measurement
+# ----------------------
+# Each (variant, corpus) runs in a fresh spawned process, so resident memory is not
+# polluted by the previous variant and import/warm-up effects are the same for all.
+# Per run: build time, index bytes on disk, peak RSS, RSS added by load_index, load time,
+# and per query class p50/p95/p99/mean latency, throughput and mean result count
+# (capped at top_k by the variants whose query() takes it).
+
+INDEX_ID = "bench"
+
+
+def rss_bytes() -> int:
+    """Current resident set size (psutil if installed, else /proc, else 0)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError: # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # bytes on macOS, KiB elsewhere
+
+
+def dir_bytes(path: Path) -> int:
+    """Bytes of every file under path, the registry excepted."""
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file() and p.name != "index_registry.json")
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "mean_ms": round(float(ms.mean()), 4),
+        "qps": round(len(ms) / (ms.sum() / 1000), 1) if ms.sum() else 0.0,
+    }
+
+
+def _time_queries(index, queries: List[str], repeat: int, top_k: Optional[int]) -> Dict[str, Any]:
+    kwargs = {"top_k": top_k} if top_k and "top_k" in inspect.signature(index.query).parameters else {}
+    hits = [json.loads(index.query(q, **kwargs))["count"] for q in queries] # Also the warm-up pass
+    seconds = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            index.query(q, **kwargs)
+            seconds.append(time.perf_counter() - start)
+    return {**latency_summary(seconds), "mean_hits": round(sum(hits) / len(hits), 2) if hits else 0.0}
+
+
+def measure(variant_name: str, corpus_spec: Dict[str, Any], queries: Dict[str, List[str]],
+            repeat: int = 3, top_k: Optional[int] = 10, redis_url: Optional[str] = None) -> Dict[str, Any]:
+    """Build, load and query one variant on one corpus; runs in the calling process."""
+    from self_index import SelfIndex
+
+    variant: Variant = VARIANTS_BY_NAME[variant_name]
+    result: Dict[str, Any] = {"variant": variant.describe(), "corpus": corpus_spec}
+    docs = list(corpus_from_spec(corpus_spec))
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp, contextlib.redirect_stdout(io.StringIO()):
+        storage = Path(tmp) / variant.name
+        index = variant.build(SelfIndex._tokenize, str(storage), redis_url)
+        gc.collect()
+        start = time.perf_counter()
+        index.create_index(INDEX_ID, docs, **variant.create_kwargs)
+        result["build_s"] = round(time.perf_counter() - start, 4)
+        result["peak_rss_bytes"] = peak_rss_bytes()
+        result["disk_bytes"] = None if variant.needs_redis else dir_bytes(storage)
+        del index, docs
+        gc.collect()
+
+        before = rss_bytes()
+        index = variant.build(SelfIndex._tokenize, str(storage), redis_url)
+        start = time.perf_counter()
+        index.load_index(INDEX_ID)
+        result["load_s"] = round(time.perf_counter() - start, 4)
+        gc.collect()
+        result["resident_bytes"] = rss_bytes() - before
+
+        result["queries"] = {cls: _time_queries(index, queries[cls], repeat, top_k) for cls in QUERY_CLASSES}
+        if variant.needs_redis:
+            index.delete_index(INDEX_ID)
+    return result
+
+
+def _measure_safely(*args, **kwargs) -> Dict[str, Any]:
+    try:
+        return measure(*args, **kwargs)
+    except Exception:
+        return {"variant": VARIANTS_BY_NAME[args[0]].describe(), "corpus": args[1], "error": traceback.format_exc()}
+
+
+# ----------------------
+# Suite
+# ----------------------
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(variants: List[Variant], corpus_specs: List[Dict[str, Any]], per_class: int = 50,
+              repeat: int = 3, top_k: Optional[int] = 10, seed: int = 0, in_process: bool = False,
+              redis_url: Optional[str] = None, log=print) -> Dict[str, Any]:
+    """Every variant on every corpus; returns the JSON-ready report."""
+    from self_index import SelfIndex
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "argv": sys.argv,
+        },
+        "options": {"per_class": per_class, "repeat": repeat, "top_k": top_k, "seed": seed, "in_process": in_process},
+        "queries": [],
+        "runs": [],
+    }
+    for spec in corpus_specs:
+        docs = list(corpus_from_spec(spec))
+        queries = make_queries(docs, SelfIndex._tokenize, per_class, seed)
+        report["queries"].append({"corpus": spec, "queries": queries})
+        log(f"corpus {json.dumps(spec)}: {len(docs)} docs")
+        del docs
+        for variant in variants:
+            args = (variant.name, spec, queries, repeat, top_k, redis_url)
+            if in_process:
+                run = _measure_safely(*args)
+            else:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    run = pool.submit(_measure_safely, *args).result()
+            report["runs"].append(run)
+            log(format_run(run))
+    return report
+
+
+def format_run(run: Dict[str, Any]) -> str:
+    name = run["variant"]["name"]
+    if run.get("error"):
+        return f"  {name:18s} ERROR {run['error'].strip().splitlines()[-1]}"
+    q = run["queries"]
+    lat = " ".join(f"{cls} {q[cls]['p50_ms']:.2f}/{q[cls]['p99_ms']:.2f}" for cls in QUERY_CLASSES)
+    disk = f"{run['disk_bytes'] / 1e6:7.1f} MB" if run["disk_bytes"] is not None else "      - MB"
+    return (f"  {name:18s} build {run['build_s']:7.2f} s  disk {disk}  load {run['load_s']:6.3f} s  "
+            f"rss +{run['resident_bytes'] / 1e6:6.1f} MB  p50/p99 ms: {lat}")
+
+
+# ----------------------
+# Regression check
+# ----------------------
+# (metric path, higher is better)
+_METRICS = [(("build_s",), False), (("load_s",), False), (("disk_bytes",), False), (("resident_bytes",), False)]
+_METRICS += [(("queries", cls, m), m == "qps") for cls in QUERY_CLASSES for m in ("p50_ms", "p95_ms", "p99_ms", "qps")]
+
+
+def _get(run: Dict[str, Any], path) -> Optional[float]:
+    for key in path:
+        if not isinstance(run, dict) or key not in run: return None
+        run = run[key]
+    return run
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 1.10) -> List[Dict[str, Any]]:
+    """
+    Runs matched by (variant name, corpus spec). Returns one row per metric that got worse
+    by more than `threshold` (1.10 = 10%), lower-is-better and higher-is-better alike.
+    """
+    key = lambda run: (run["variant"]["name"], json.dumps(run["corpus"], sort_keys=True))
+    old_runs = {key(run): run for run in old["runs"] if not run.get("error")}
+    rows = []
+    for run in new["runs"]:
+        base = old_runs.get(key(run))
+        if base is None or run.get("error"): continue
+        for path, higher_is_better in _METRICS:
+            before, after = _get(base, path), _get(run, path)
+            if not before or after is None: continue
+            ratio = after / before
+            worse = ratio < 1 / threshold if higher_is_better else ratio > threshold
+            if worse:
+                rows.append({"variant": run["variant"]["name"], "corpus": run["corpus"], "metric": ".".join(path),
+                             "old": before, "new": after, "ratio": round(ratio, 3)})
+    return rows
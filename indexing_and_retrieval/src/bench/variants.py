@@ -0,0 +1,79 @@
+import importlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# ----------------------
+# Index variants under benchmark
+# ----------------------
+# One entry per SelfIndex* class and the compression/optimization settings it honours.
+# Classes are imported only when a variant runs, so a missing optional dependency
+# (redis) only affects the variants that need it.
+
+
+@dataclass(frozen=True)
+class Variant:
+    name: str
+    module: str
+    cls: str
+    info: str = "TFIDF"
+    dstore: str = "CUSTOM"
+    qproc: str = "TERMatat"
+    compr: str = "NONE"
+    optim: str = "Null"
+    init_kwargs: Dict[str, Any] = field(default_factory=dict)
+    create_kwargs: Dict[str, Any] = field(default_factory=dict)
+    needs_redis: bool = False
+
+    def build(self, preprocess_fn, storage_path: str, redis_url: Optional[str] = None):
+        index_cls = getattr(importlib.import_module(self.module), self.cls)
+        kwargs = dict(self.init_kwargs)
+        if self.needs_redis:
+            host, _, port = (redis_url or "localhost:6379").partition(":")
+            kwargs.update(redis_host=host, redis_port=int(port or 6379))
+        return index_cls("SelfIndex", self.info, self.dstore, self.qproc, self.compr, self.optim,
+                         preprocess_fn, storage_path=storage_path, **kwargs)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "class": self.cls, "info": self.info, "dstore": self.dstore,
+                "qproc": self.qproc, "compr": self.compr, "optim": self.optim,
+                "init_kwargs": self.init_kwargs, "create_kwargs": self.create_kwargs}
+
+
+VARIANTS: List[Variant] = [
+    Variant("boolean", "self_index", "SelfIndex", info="BOOLEAN"),
+    Variant("boolean-bitmap", "self_index", "SelfIndex", info="BOOLEAN", optim="Bitmap"),
+    Variant("wordcount", "self_index", "SelfIndexRanked", info="WORDCOUNT"),
+    Variant("tfidf", "self_index", "SelfIndexTFIDF"),
+    Variant("compressed-simple", "compressed_index", "SelfIndexCompressedSimple", compr="CODE"),
+    Variant("compressed-lib", "compressed_index", "SelfIndexCompressedLib", compr="CLIB"),
+    Variant("skipping", "skipping_index", "SelfIndexSkipping", optim="Skipping"),
+    Variant("compact", "compact_index", "SelfIndexCompact"),
+    Variant("compact-wand", "compact_index", "SelfIndexCompact", optim="Thresholding"),
+    Variant("compact-maxscore", "compact_index", "SelfIndexCompact", optim="EarlyStopping"),
+    Variant("compact-nextword", "compact_index", "SelfIndexCompact", create_kwargs={"next_word_min_df": 50}),
+    Variant("block", "block_index", "SelfIndexBlock", compr="CODE", optim="Thresholding"),
+    Variant("daat", "daat_index", "SelfIndexDaaT", qproc="DOCatat"),
+    Variant("taat", "taat_index", "SelfIndexTaaT"),
+    Variant("segment", "segment_store", "SelfIndexSegment", dstore="SEGMENT"),
+    Variant("spimi", "spimi", "SelfIndexSPIMI", dstore="SEGMENT"),
+    Variant("lsm", "lsm_index", "SelfIndexLSM", dstore="SEGMENT", init_kwargs={"background_compaction": False}),
+    # Latency against shard count: --variants compact sharded-1 sharded-2 sharded-4 sharded-8
+    # (resident/peak memory are those of the coordinator process, not of the shard processes)
+    *(Variant(f"sharded-{n}", "sharded_index", "SelfIndexSharded", init_kwargs={"num_shards": n}) for n in (1, 2, 4, 8)),
+    Variant("sqlite", "sqlite_index", "SelfIndexSQLite", dstore="DB1"),
+    Variant("sqlite-blob", "sqlite_index", "SelfIndexSQLiteBlob", dstore="DB1"),
+    Variant("redis", "redis_index", "SelfIndexRedis", dstore="DB2", needs_redis=True),
+    Variant("redis-blob", "redis_index", "SelfIndexRedisBlob", dstore="DB2", needs_redis=True),
+]
+
+VARIANTS_BY_NAME: Dict[str, Variant] = {v.name: v for v in VARIANTS}
+
+
+def select_variants(names: Optional[List[str]], with_redis: bool) -> List[Variant]:
+    """Named variants in the given order, or every variant (Redis ones only with a server)."""
+    if not names or names == ["all"]:
+        return [v for v in VARIANTS if with_redis or not v.needs_redis]
+    unknown = [name for name in names if name not in VARIANTS_BY_NAME]
+    if unknown:
+        raise ValueError(f"Unknown variants: {', '.join(unknown)} (see `python -m bench list`)")
+    return [VARIANTS_BY_NAME[name] for name in names]
@@ -0,0 +1,223 @@
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Union
+
+import numpy as np
+
+from query_planner import EMPTY, NOT, OR, TERM, PlanNode
+
+# ----------------------
+# Adaptive doc-set containers for boolean evaluation (Optimizations.Bitmap)
+# ----------------------
+# Doc sets are kept over dense internal doc ids 0..N-1, one container per term, in the
+# style of Roaring:
+# - ArrayContainer:  sorted uint32 doc ids, for sparse terms (4 bytes per doc)
+# - BitmapContainer: N bits, for dense terms (N / 8 bytes whatever the df)
+# A set goes into a bitmap once it holds more than N / DENSE_RATIO docs, the point where
+# the array would be larger. AND/OR/difference work on the containers directly (NumPy
+# bitwise ops, searchsorted, bit probes) and pick the container of the result the same
+# way. NOT is a difference from the universe bitmap, which is N set bits and costs
+# N / 8 bytes instead of a set of N doc id strings.
+
+DENSE_RATIO = 32
+
+
+def _popcount(bits: np.ndarray) -> int:
+    if hasattr(np, "bitwise_count"): # NumPy >= 2.0
+        return int(np.bitwise_count(bits).sum())
+    return int(np.unpackbits(bits).sum())
+
+
+def _to_bits(docs: np.ndarray, n: int) -> np.ndarray:
+    mask = np.zeros(n, dtype=bool)
+    mask[docs] = True
+    return np.packbits(mask, bitorder="little")
+
+
+class ArrayContainer:
+    __slots__ = ("docs", "n")
+
+    def __init__(self, docs: np.ndarray, n: int):
+        self.docs = docs
+        self.n = n
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def to_array(self) -> np.ndarray:
+        return self.docs
+
+    def to_bits(self) -> np.ndarray:
+        return _to_bits(self.docs, self.n)
+
+
+class BitmapContainer:
+    __slots__ = ("bits", "n", "card")
+
+    def __init__(self, bits: np.ndarray, n: int, card: Optional[int] = None):
+        self.bits = bits # packbits(bitorder="little"): doc d is bit d & 7 of byte d >> 3
+        self.n = n
+        self.card = _popcount(bits) if card is None else card
+
+    def __len__(self) -> int:
+        return self.card
+
+    def to_array(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.n, bitorder="little")).astype(np.uint32)
+
+    def to_bits(self) -> np.ndarray:
+        return self.bits
+
+    def contains(self, docs: np.ndarray) -> np.ndarray:
+        """Bool mask: which of docs are set."""
+        return ((self.bits[docs >> 3] >> (docs & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+Container = Union[ArrayContainer, BitmapContainer]
+
+
+def from_array(docs: np.ndarray, n: int) -> Container:
+    """Container for sorted unique doc ids, bitmap if dense."""
+    if len(docs) * DENSE_RATIO > n:
+        return BitmapContainer(_to_bits(docs, n), n, len(docs))
+    return ArrayContainer(docs.astype(np.uint32, copy=False), n)
+
+
+def _from_bits(bits: np.ndarray, n: int) -> Container:
+    result = BitmapContainer(bits, n)
+    if result.card * DENSE_RATIO > n:
+        return result
+    return ArrayContainer(result.to_array(), n)
+
+
+def _in_sorted(docs: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Bool mask: which of docs occur in the sorted array other (binary search)."""
+    if not len(other):
+        return np.zeros(len(docs), dtype=bool)
+    idx = np.searchsorted(other, docs)
+    idx[idx == len(other)] = 0
+    return other[idx] == docs
+
+
+def intersect(a: Container, b: Container) -> Container:
+    if isinstance(a, BitmapContainer) and isinstance(b, BitmapContainer):
+        return _from_bits(a.bits & b.bits, a.n)
+    if isinstance(a, BitmapContainer):
+        a, b = b, a
+    # a is an array: probe its docs in b, the result is never larger than a
+    if isinstance(b, BitmapContainer):
+        return ArrayContainer(a.docs[b.contains(a.docs)], a.n)
+    if len(a) > len(b):
+        a, b = b, a
+    return ArrayContainer(a.docs[_in_sorted(a.docs, b.docs)], a.n)
+
+
+def union(a: Container, b: Container) -> Container:
+    if not len(a):
+        return b
+    if not len(b):
+        return a
+    if isinstance(a, ArrayContainer) and isinstance(b, ArrayContainer):
+        return from_array(np.union1d(a.docs, b.docs), a.n)
+    return _from_bits(a.to_bits() | b.to_bits(), a.n)
+
+
+def difference(a: Container, b: Container) -> Container:
+    """a minus b."""
+    if not len(b):
+        return a
+    if isinstance(a, ArrayContainer):
+        keep = b.contains(a.docs) if isinstance(b, BitmapContainer) else _in_sorted(a.docs, b.docs)
+        return ArrayContainer(a.docs[~keep], a.n)
+    return _from_bits(a.bits & ~b.to_bits(), a.n)
+
+
+class BitmapPostings:
+    """
+    Per-term containers over internal doc ids (position in doc_ids), built from any
+    {term: {doc_id: ...}} inverted index. Only doc_ids and the containers are pickled.
+    """
+
+    def __init__(self, doc_ids: List[str], sets: Dict[str, Container]):
+        self.doc_ids = doc_ids
+        self.sets = sets
+        self._build_lookups()
+
+    @classmethod
+    def build(cls, inverted_index: Mapping[str, Mapping[str, object]], doc_ids: Iterable[str]) -> "BitmapPostings":
+        doc_ids = list(doc_ids)
+        doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        n = len(doc_ids)
+        sets = {}
+        for term, postings in inverted_index.items():
+            docs = np.fromiter((doc_index[d] for d in postings), dtype=np.uint32, count=len(postings))
+            docs.sort()
+            sets[term] = from_array(docs, n)
+        return cls(doc_ids, sets)
+
+    def _build_lookups(self):
+        n = len(self.doc_ids)
+        self.doc_index: Dict[str, int] = {d: i for i, d in enumerate(self.doc_ids)}
+        full = np.packbits(np.ones(n, dtype=bool), bitorder="little")
+        self.universe = BitmapContainer(full, n, n)
+        self.empty = ArrayContainer(np.zeros(0, dtype=np.uint32), n)
+        self._by_name: Optional[np.ndarray] = None
+        self._sorted_ids: List[str] = []
+
+    def __getstate__(self):
+        return {"doc_ids": self.doc_ids, "sets": self.sets}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_lookups()
+
+    def get(self, term: str) -> Container:
+        return self.sets.get(term, self.empty)
+
+    def from_doc_ids(self, doc_ids: Iterable[str]) -> Container:
+        docs = np.array(sorted(self.doc_index[d] for d in doc_ids), dtype=np.uint32)
+        return from_array(docs, len(self.doc_ids))
+
+    def to_doc_ids(self, container: Container) -> Set[str]:
+        doc_ids = self.doc_ids
+        return {doc_ids[d] for d in container.to_array().tolist()}
+
+    def to_sorted_doc_ids(self, container: Container) -> List[str]:
+        """Doc ids of container in string order, without building and sorting a set."""
+        if self._by_name is None:
+            # Internal doc ids in doc id string order, computed on first use
+            self._by_name = np.array(sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__), dtype=np.int64)
+            self._sorted_ids = [self.doc_ids[d] for d in self._by_name.tolist()]
+        mask = np.zeros(len(self.doc_ids), dtype=bool)
+        mask[container.to_array()] = True
+        sorted_ids = self._sorted_ids
+        return [sorted_ids[i] for i in np.flatnonzero(mask[self._by_name]).tolist()]
+
+    def memory_bytes(self) -> int:
+        return sum(c.docs.nbytes if isinstance(c, ArrayContainer) else c.bits.nbytes for c in self.sets.values())
+
+
+def evaluate(node: Optional[PlanNode], fetch: Callable[[str], Container], bitmaps: BitmapPostings) -> Container:
+    """Evaluate a planned tree (query_planner) over containers; fetch(operand) -> Container."""
+    if node is None or node.op == EMPTY:
+        return bitmaps.empty
+    if node.op == TERM:
+        return fetch(node.operand)
+    if node.op == NOT:
+        return difference(bitmaps.universe, evaluate(node.children[0], fetch, bitmaps))
+    if node.op == OR:
+        result = bitmaps.empty
+        for child in node.children:
+            result = union(result, evaluate(child, fetch, bitmaps))
+        return result
+
+    # AND: rarest operands first, NOT operands subtracted, stop once empty
+    result = None
+    for child in node.exec_order:
+        if child.op == NOT:
+            result = difference(bitmaps.universe if result is None else result,
+                                evaluate(child.children[0], fetch, bitmaps))
+        else:
+            docs = evaluate(child, fetch, bitmaps)
+            result = docs if result is None else intersect(result, docs)
+        if not len(result):
+            return bitmaps.empty
+    return result
@@ -0,0 +1,80 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from block_postings import BlockPostings
+from compact_index import CompactPostings, SelfIndexCompact
+from query_planner import AND, TERM
+from query_trace import count as trace_count
+from topk import TopKHeap, block_max_wand_top_k
+
+
+class SelfIndexBlock(SelfIndexCompact):
+    """
+    TF-IDF index (x=3) over block-compressed postings (z=1, Compression.CODE), see
+    block_postings.py: doc id gaps, tfs and positions bit-packed in blocks of 128 with
+    per-block skip headers.
+    - conjunctions of terms decode only the rarest list, the others are probed block by block
+    - phrases decode positions only for the blocks that hold a candidate
+    - query(q, top_k=k) ranks disjunctive queries with block-max WAND
+    Same results and scores as SelfIndexCompact.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_block"):
+        # Explicitly set compressor to CODE
+        SelfIndexCompact.__init__(self, core, info, dstore, qproc, 'CODE', optim, preprocess_fn, storage_path)
+
+    def _encode_postings(self, postings: CompactPostings) -> BlockPostings:
+        return BlockPostings.from_compact(postings)
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates a single term or phrase, returning {doc_id: tfidf_score}."""
+        postings: BlockPostings = self._postings()
+        doc_ids = postings.doc_ids
+
+        if " " not in operand: # Single term
+            idf = self._calculate_idf(operand)
+            if idf == 0: return {}
+            docs = postings.term_docs(operand).tolist()
+            scores = (postings.term_tfs(operand) * idf).tolist()
+            return {doc_ids[d]: s for d, s in zip(docs, scores)}
+
+        # Phrase: sum of TF-IDF of the phrase terms in each matching doc, in phrase order
+        phrase_tokens = operand.split(" ")
+        matches = self._phrase_matches(phrase_tokens)
+        if not matches: return {}
+        docs = np.array(sorted(matches), dtype=np.int64)
+        scores = np.zeros(len(docs))
+        for term in phrase_tokens:
+            scores += postings.tfs_at(term, docs) * self._calculate_idf(term)
+        return {doc_ids[d]: s for d, s in zip(docs.tolist(), scores.tolist())}
+
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Dict[str, float]:
+        """A plain conjunction of terms is intersected with block skipping, the rest as usual."""
+        plan = self._plan(rpn_tokens)
+        if plan is None or plan.op != AND or any(c.op != TERM or " " in c.operand for c in plan.children):
+            return super()._evaluate_rpn(rpn_tokens)
+
+        terms = [c.operand for c in plan.children]
+        idfs = [self._calculate_idf(term) for term in terms]
+        if 0 in idfs: return {} # df = N scores nothing, as in the dict engine
+        postings: BlockPostings = self._postings()
+        docs = postings.intersect(terms)
+        # Summed in query order, as execute() does
+        scores = np.zeros(len(docs))
+        for term, idf in zip(terms, idfs):
+            scores += postings.tfs_at(term, docs) * idf
+        doc_ids = postings.doc_ids
+        return {doc_ids[d]: s for d, s in zip(docs.tolist(), scores.tolist())}
+
+    # --- Top-k ---
+    def _explain_top_k(self, terms: Dict[str, int], top_k: int) -> str:
+        operands = ", ".join(f'"{term}"~{self._doc_freq(term)}' for term in terms)
+        return f"BlockMaxWAND-top{top_k}({operands})"
+
+    def _top_k_disjunctive(self, terms: Dict[str, int], top_k: int) -> List[Tuple[str, float]]:
+        """Exact top-k of an OR of terms with block-max WAND (both top-k optimizations)."""
+        weights = {term: count * self._calculate_idf(term) for term, count in terms.items()}
+        heap = TopKHeap(top_k)
+        trace_count("candidates", block_max_wand_top_k(self._postings(), weights, heap))
+        return heap.results()
@@ -0,0 +1,388 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from phrase_match import phrase_count
+from query_trace import count as trace_count
+
+# ----------------------
+# Block-compressed positional postings (Compression.CODE)
+# ----------------------
+# Each term's postings are cut into blocks of BLOCK_SIZE docs. A block stores three
+# bit-packed sections, each with one bit width (that of its largest value):
+# - doc id gaps: the first one relative to the last doc of the previous block of the
+#   term (0 for the first block), so a block decodes on its own
+# - tf - 1: a block of tf = 1 postings packs to width 0, i.e. no bytes at all
+# - position gaps of all its postings, doc after doc (the first position of each doc
+#   is absolute); only decoded for phrase checks
+# Per block header (plain NumPy arrays): last doc id, max tf, posting count, the three
+# widths and the byte offsets of the three sections in the shared data buffer.
+# blk_last lets intersection find the only block that can hold a doc (searchsorted)
+# and skip the others undecoded; blk_max_tf gives block-max WAND its per-block bound.
+# Decoding is NumPy throughout: a section is unpackbits plus one vector shift-or per
+# bit column; whole terms decode their full blocks one width at a time.
+
+BLOCK_SIZE = 128
+
+# Section indices in blk_widths / blk_offsets
+DOCS, TFS, POS = 0, 1, 2
+
+
+def _width(values: np.ndarray) -> int:
+    return int(values.max()).bit_length() if len(values) else 0
+
+
+def _nbytes(count: int, width: int) -> int:
+    return (count * width + 7) // 8
+
+
+def pack(values: np.ndarray, width: int) -> bytes:
+    """values (< 2**width) as width-bit big-endian fields, zero padded to a byte."""
+    if width == 0 or not len(values):
+        return b""
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint32)
+    bits = ((values.astype(np.uint32)[:, None] >> shifts) & 1).astype(np.uint8)
+    return np.packbits(bits.ravel()).tobytes()
+
+
+def _fields_to_uint32(bits: np.ndarray, count: int, width: int) -> np.ndarray:
+    """bits (at least count * width of them) -> count uint32 values, one shift-or per bit column."""
+    fields = bits[:count * width].reshape(count, width)
+    values = fields[:, 0].astype(np.uint32)
+    for k in range(1, width):
+        values <<= 1
+        values |= fields[:, k]
+    return values
+
+
+def unpack(data: np.ndarray, offset: int, count: int, width: int) -> np.ndarray:
+    """Inverse of pack: count width-bit values starting at data[offset]."""
+    if width == 0:
+        return np.zeros(count, dtype=np.uint32)
+    trace_count("bytes_decoded", _nbytes(count, width))
+    bits = np.unpackbits(data[offset:offset + _nbytes(count, width)])
+    return _fields_to_uint32(bits, count, width)
+
+
+def vb_size(values: np.ndarray) -> int:
+    """Bytes the same values take as variable-byte codes (7 bits per byte)."""
+    values = np.asarray(values, dtype=np.uint64)
+    return len(values) + sum(int((values >= (1 << (7 * k))).sum()) for k in range(1, 10))
+
+
+class BlockPostings:
+    """
+    Block-compressed positional postings for a whole index, converted from a
+    CompactPostings. Same internal doc ids (position in doc_ids) and sorted terms;
+    term t owns blocks [term_blocks[t], term_blocks[t+1]).
+    """
+
+    def __init__(self, doc_ids: List[str], terms: List[str], term_blocks: np.ndarray, term_dfs: np.ndarray,
+                 blk_last: np.ndarray, blk_max_tf: np.ndarray, blk_count: np.ndarray,
+                 blk_widths: np.ndarray, blk_offsets: np.ndarray, data: np.ndarray):
+        self.doc_ids = doc_ids
+        self.terms = terms
+        self.term_blocks = term_blocks
+        self.term_dfs = term_dfs
+        self.blk_last = blk_last
+        self.blk_max_tf = blk_max_tf
+        self.blk_count = blk_count
+        self.blk_widths = blk_widths
+        self.blk_offsets = blk_offsets
+        self.data = data
+        self._build_lookups()
+
+    def _build_lookups(self):
+        self.term_ids: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+        self.doc_index: Dict[str, int] = {d: i for i, d in enumerate(self.doc_ids)}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["term_ids"]
+        del state["doc_index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_lookups()
+
+    @classmethod
+    def from_compact(cls, postings) -> "BlockPostings":
+        """Encode a CompactPostings (compact_index), term by term."""
+        post_docs = np.asarray(postings.post_docs, dtype=np.int64)
+        post_tfs = np.asarray(postings.post_tfs, dtype=np.int64)
+        pos_offsets = np.asarray(postings.pos_offsets, dtype=np.int64)
+        positions = np.asarray(postings.positions, dtype=np.int64)
+
+        term_blocks = [0]
+        last, max_tf, count, widths, offsets = [], [], [], [], []
+        chunks: List[bytes] = []
+        size = 0
+        for t in range(len(postings.terms)):
+            start, end = postings.term_offsets[t], postings.term_offsets[t + 1]
+            prev_doc = 0
+            for b in range(start, end, BLOCK_SIZE):
+                e = min(b + BLOCK_SIZE, end)
+                docs = post_docs[b:e]
+                tfs = post_tfs[b:e]
+                pos = positions[pos_offsets[b]:pos_offsets[e]]
+                # Position gaps, restarting at every doc of the block
+                pos_gaps = np.diff(pos, prepend=0)
+                doc_starts = pos_offsets[b:e] - pos_offsets[b]
+                pos_gaps[doc_starts] = pos[doc_starts]
+
+                sections = (np.diff(docs, prepend=prev_doc), tfs - 1, pos_gaps)
+                block_widths = [_width(values) for values in sections]
+                block_offsets = []
+                for values, width in zip(sections, block_widths):
+                    packed = pack(values, width)
+                    block_offsets.append(size)
+                    chunks.append(packed)
+                    size += len(packed)
+
+                prev_doc = int(docs[-1])
+                last.append(prev_doc)
+                max_tf.append(int(tfs.max()))
+                count.append(e - b)
+                widths.append(block_widths)
+                offsets.append(block_offsets)
+            term_blocks.append(len(last))
+
+        term_offsets = np.asarray(postings.term_offsets, dtype=np.int64)
+        return cls(list(postings.doc_ids), list(postings.terms),
+                   np.array(term_blocks, dtype=np.int64), np.diff(term_offsets),
+                   np.array(last, dtype=np.uint32), np.array(max_tf, dtype=np.uint32),
+                   np.array(count, dtype=np.uint16), np.array(widths, dtype=np.uint8).reshape(-1, 3),
+                   np.array(offsets, dtype=np.uint64).reshape(-1, 3), np.frombuffer(b"".join(chunks), dtype=np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.term_ids
+
+    # ----------------------
+    # Per-term metadata (headers only, nothing decoded)
+    # ----------------------
+    def block_range(self, term: str) -> Optional[Tuple[int, int]]:
+        """(first, end) block indices of term, or None if the term is unknown."""
+        tid = self.term_ids.get(term)
+        if tid is None:
+            return None
+        return int(self.term_blocks[tid]), int(self.term_blocks[tid + 1])
+
+    def doc_freq(self, term: str) -> int:
+        tid = self.term_ids.get(term)
+        return 0 if tid is None else int(self.term_dfs[tid])
+
+    def max_tf(self, term: str) -> int:
+        rng = self.block_range(term)
+        return int(self.blk_max_tf[rng[0]:rng[1]].max()) if rng and rng[0] < rng[1] else 0
+
+    # ----------------------
+    # Block decoding
+    # ----------------------
+    def _section(self, block: int, section: int, count: int) -> np.ndarray:
+        return unpack(self.data, int(self.blk_offsets[block, section]), count, int(self.blk_widths[block, section]))
+
+    def block_docs(self, block: int) -> np.ndarray:
+        """Sorted internal doc ids of one block."""
+        docs = np.cumsum(self._section(block, DOCS, int(self.blk_count[block])), dtype=np.int64)
+        if not self._first_blocks(np.array([block]))[0]:
+            docs += int(self.blk_last[block - 1])
+        return docs
+
+    def block_tfs(self, block: int) -> np.ndarray:
+        return self._section(block, TFS, int(self.blk_count[block])).astype(np.int64) + 1
+
+    def block_positions(self, block: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions, offsets): posting i of the block has positions[offsets[i]:offsets[i+1]]."""
+        tfs = self.block_tfs(block)
+        offsets = np.zeros(len(tfs) + 1, dtype=np.int64)
+        np.cumsum(tfs, out=offsets[1:])
+        gaps = self._section(block, POS, int(offsets[-1])).astype(np.int64)
+        running = np.cumsum(gaps)
+        # Undo the running sum at every doc boundary (first positions are absolute)
+        base = running[offsets[:-1]] - gaps[offsets[:-1]]
+        return running - np.repeat(base, tfs), offsets
+
+    def _decode_blocks(self, blocks: np.ndarray, section: int) -> np.ndarray:
+        """
+        Raw section values of the given blocks (ascending), concatenated. Full blocks of
+        one width are exactly 16 * width bytes, so each width unpacks as a single run.
+        """
+        counts = self.blk_count[blocks].astype(np.int64)
+        starts = np.zeros(len(blocks) + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        out = np.empty(int(starts[-1]), dtype=np.uint32)
+        trace_count("postings_decoded", len(out))
+        full = counts == BLOCK_SIZE
+        widths = self.blk_widths[blocks, section]
+        for width in np.unique(widths[full]).tolist():
+            sel = np.flatnonzero(full & (widths == width))
+            dest = (starts[sel][:, None] + np.arange(BLOCK_SIZE)).ravel()
+            if width == 0:
+                out[dest] = 0
+                continue
+            nbytes = BLOCK_SIZE * width // 8
+            offsets = self.blk_offsets[blocks[sel], section].astype(np.int64)
+            raw = self.data[(offsets[:, None] + np.arange(nbytes)).ravel()]
+            trace_count("bytes_decoded", raw.size)
+            out[dest] = _fields_to_uint32(np.unpackbits(raw), len(sel) * BLOCK_SIZE, width)
+        for i in np.flatnonzero(~full).tolist(): # the last block of a term
+            out[starts[i]:starts[i + 1]] = self._section(int(blocks[i]), section, int(counts[i]))
+        return out
+
+    def _decode_docs(self, blocks: np.ndarray) -> np.ndarray:
+        """Doc ids of the given blocks (ascending, all of one term), concatenated and sorted."""
+        gaps = self._decode_blocks(blocks, DOCS)
+        running = np.cumsum(gaps, dtype=np.int64)
+        # Restart the running sum at every block: base = last doc of the previous block
+        counts = self.blk_count[blocks].astype(np.int64)
+        first = np.zeros(len(blocks), dtype=np.int64)
+        np.cumsum(counts[:-1], out=first[1:])
+        prev = np.where(self._first_blocks(blocks), 0, self.blk_last[np.maximum(blocks - 1, 0)].astype(np.int64))
+        return running + np.repeat(prev - (running[first] - gaps[first]), counts)
+
+    def _first_blocks(self, blocks: np.ndarray) -> np.ndarray:
+        """Bool mask: which blocks are the first block of their term."""
+        tids = np.searchsorted(self.term_blocks, blocks, side="right") - 1
+        return self.term_blocks[tids] == blocks
+
+    def term_docs(self, term: str) -> np.ndarray:
+        """All internal doc ids of term (int64, sorted)."""
+        rng = self.block_range(term)
+        if not rng or rng[0] == rng[1]:
+            return np.zeros(0, dtype=np.int64)
+        # Gaps chain across the blocks of a term, so one running sum decodes them all
+        return np.cumsum(self._decode_blocks(np.arange(*rng), DOCS), dtype=np.int64)
+
+    def term_tfs(self, term: str) -> np.ndarray:
+        rng = self.block_range(term)
+        if not rng or rng[0] == rng[1]:
+            return np.zeros(0, dtype=np.int64)
+        return self._decode_blocks(np.arange(*rng), TFS).astype(np.int64) + 1
+
+    # --- CompactPostings-style access (used by SelfIndexCompact code paths) ---
+    def docs(self, term: str) -> List[int]:
+        return self.term_docs(term).tolist()
+
+    def postings(self, term: str) -> Iterator[Tuple[int, int]]:
+        """(internal_doc_id, tf) pairs for term."""
+        return zip(self.term_docs(term).tolist(), self.term_tfs(term).tolist())
+
+    def iter_term_postings(self, term: str) -> Iterator[Tuple[int, List[int]]]:
+        """Yield (internal_doc_id, positions) for term."""
+        rng = self.block_range(term)
+        for block in range(*rng) if rng else ():
+            positions, offsets = self.block_positions(block)
+            positions = positions.tolist()
+            offsets = offsets.tolist()
+            for i, docnum in enumerate(self.block_docs(block).tolist()):
+                yield docnum, positions[offsets[i]:offsets[i + 1]]
+
+    # ----------------------
+    # Block-skipping lookups
+    # ----------------------
+    def locate(self, term: str, docnums: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        For sorted docnums: (found mask, block, index in block) of term's postings.
+        Only the blocks whose [previous last, last] range holds a query doc are decoded.
+        """
+        n = len(docnums)
+        found = np.zeros(n, dtype=bool)
+        blocks = np.full(n, -1, dtype=np.int64)
+        index = np.zeros(n, dtype=np.int64)
+        rng = self.block_range(term)
+        if not rng or not n:
+            return found, blocks, index
+        b0, b1 = rng
+        # First block whose last doc is >= the doc: the only one that can hold it
+        blocks[:] = b0 + np.searchsorted(self.blk_last[b0:b1], docnums)
+        inside = blocks < b1
+        touched = np.unique(blocks[inside])
+        if not len(touched):
+            return found, blocks, index
+        docs = self._decode_docs(touched)
+        # The touched blocks are consecutive runs of one term: docs is sorted as a whole
+        j = np.minimum(np.searchsorted(docs, docnums), len(docs) - 1)
+        found[:] = inside & (docs[j] == docnums)
+        starts = np.zeros(len(touched), dtype=np.int64)
+        np.cumsum(self.blk_count[touched[:-1]].astype(np.int64), out=starts[1:])
+        index[inside] = j[inside] - starts[np.searchsorted(touched, blocks[inside])]
+        return found, blocks, index
+
+    def intersect(self, terms: List[str]) -> np.ndarray:
+        """Sorted docs containing every term: the rarest is decoded, the others only probed."""
+        if not terms or any(t not in self for t in terms):
+            return np.zeros(0, dtype=np.int64)
+        terms = sorted(set(terms), key=self.doc_freq)
+        docs = self.term_docs(terms[0])
+        for term in terms[1:]:
+            if not len(docs):
+                break
+            docs = docs[self.locate(term, docs)[0]]
+        return docs
+
+    def tfs_at(self, term: str, docnums: np.ndarray) -> np.ndarray:
+        """tf of term in each of the sorted docnums (0 where absent)."""
+        found, blocks, index = self.locate(term, docnums)
+        tfs = np.zeros(len(docnums), dtype=np.int64)
+        touched = np.unique(blocks[found])
+        if len(touched):
+            values = self._decode_blocks(touched, TFS)
+            starts = np.zeros(len(touched), dtype=np.int64)
+            np.cumsum(self.blk_count[touched[:-1]].astype(np.int64), out=starts[1:])
+            tfs[found] = values[starts[np.searchsorted(touched, blocks[found])] + index[found]].astype(np.int64) + 1
+        return tfs
+
+    def phrase_matches(self, phrase_tokens: List[str]) -> Dict[int, int]:
+        """
+        Returns {internal_doc_id: phrase_count}. Candidates come from intersect(); the
+        positions of a block are decoded once and only for blocks holding a candidate.
+        """
+        candidates = self.intersect(phrase_tokens)
+        if not len(candidates):
+            return {}
+        located = [self.locate(t, candidates) for t in phrase_tokens]
+        decoded: Dict[int, Tuple[List[int], List[int]]] = {}
+
+        def positions(block: int, i: int) -> List[int]:
+            entry = decoded.get(block)
+            if entry is None:
+                pos, offsets = self.block_positions(block)
+                entry = decoded[block] = (pos.tolist(), offsets.tolist())
+            return entry[0][entry[1][i]:entry[1][i + 1]]
+
+        per_term = [(blocks.tolist(), index.tolist()) for _, blocks, index in located]
+        counts: Dict[int, int] = {}
+        for c, docnum in enumerate(candidates.tolist()):
+            count = phrase_count([positions(blocks[c], index[c]) for blocks, index in per_term])
+            if count:
+                counts[docnum] = count
+        return counts
+
+    # ----------------------
+    # Sizes
+    # ----------------------
+    def num_postings(self) -> int:
+        return int(self.term_dfs.sum())
+
+    def memory_bytes(self) -> int:
+        """Compressed data plus block headers (excludes the term/doc id strings)."""
+        arrays = (self.term_blocks, self.term_dfs, self.blk_last, self.blk_max_tf, self.blk_count,
+                  self.blk_widths, self.blk_offsets, self.data)
+        return sum(a.nbytes for a in arrays)
+
+    def section_bytes(self) -> Dict[str, int]:
+        """Compressed bytes per section: docs, tfs, positions."""
+        sizes = {}
+        for name, section in (("docs", DOCS), ("tfs", TFS), ("positions", POS)):
+            counts = self.blk_count.astype(np.int64)
+            if section == POS:
+                # A block's positions run up to the next section start (or the buffer end)
+                ends = np.append(self.blk_offsets[1:, DOCS], len(self.data)).astype(np.int64)
+                sizes[name] = int((ends - self.blk_offsets[:, POS].astype(np.int64)).sum())
+            else:
+                sizes[name] = int(((counts * self.blk_widths[:, section] + 7) // 8).sum())
+        return sizes
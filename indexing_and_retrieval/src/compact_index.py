@@ -0,0 +1,467 @@
+import bisect
+import math
+from array import array
+from collections.abc import MutableMapping
+from typing import Iterable, Tuple, Dict, List, Set, Optional, Iterator, Callable
+
+from index_base import Optimizations
+from phrase_match import NextWordIndex, phrase_count
+from query_trace import count as trace_count, dumps, query_log, traced_query
+from self_index import SelfIndexTFIDF
+from topk import TopKHeap, disjunctive_terms, single_term_top_k, wand_top_k, maxscore_top_k
+
+
+class CompactPostings:
+    """
+    Array-backed positional postings for a whole index.
+    - External doc ids are mapped once to dense ints (their position in `doc_ids`).
+    - Terms are kept sorted; term t owns postings [term_offsets[t], term_offsets[t+1]).
+    - Posting p has internal doc id post_docs[p], tf post_tfs[p] and its positions in
+      positions[pos_offsets[p]:pos_offsets[p+1]] (one shared buffer for all terms).
+    Only `terms` and `doc_ids` are Python objects; everything else is a typed array,
+    so pickling is a handful of raw byte copies instead of millions of small objects.
+    """
+
+    def __init__(self, doc_ids: List[str], terms: List[str], term_offsets: array,
+                 post_docs: array, post_tfs: array, pos_offsets: array, positions: array):
+        self.doc_ids = doc_ids
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.pos_offsets = pos_offsets
+        self.positions = positions
+        self._build_lookups()
+
+    def _build_lookups(self):
+        # Lookup dicts are cheap to rebuild, so they are not pickled
+        self.term_ids: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+        self.doc_index: Dict[str, int] = {d: i for i, d in enumerate(self.doc_ids)}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["term_ids"]
+        del state["doc_index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_lookups()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.term_ids
+
+    # ----------------------
+    # Per-term access
+    # ----------------------
+    def term_range(self, term: str) -> Optional[Tuple[int, int]]:
+        """Return (start, end) posting indices for term, or None if the term is unknown."""
+        tid = self.term_ids.get(term)
+        if tid is None:
+            return None
+        return self.term_offsets[tid], self.term_offsets[tid + 1]
+
+    def doc_freq(self, term: str) -> int:
+        rng = self.term_range(term)
+        return rng[1] - rng[0] if rng else 0
+
+    def docs(self, term: str) -> memoryview:
+        """Sorted internal doc ids for term (zero-copy view)."""
+        rng = self.term_range(term)
+        if not rng:
+            return memoryview(array("I"))
+        trace_count("postings", rng[1] - rng[0])
+        return memoryview(self.post_docs)[rng[0]:rng[1]]
+
+    def postings(self, term: str) -> Iterator[Tuple[int, int]]:
+        """Yield (internal_doc_id, tf) for term in doc id order."""
+        rng = self.term_range(term)
+        if not rng:
+            return iter(())
+        start, end = rng
+        trace_count("postings", end - start)
+        return zip(memoryview(self.post_docs)[start:end], memoryview(self.post_tfs)[start:end])
+
+    def max_tf(self, term: str) -> int:
+        """
+        Largest tf in term's postings (the score upper bound used by top-k pruning).
+        Computed once per term on first use; the cache is pickled with the postings.
+        """
+        tid = self.term_ids.get(term)
+        if tid is None:
+            return 0
+        max_tfs = getattr(self, "_max_tfs", None)
+        if max_tfs is None:
+            max_tfs = self._max_tfs = array("I", [0]) * len(self.terms)
+        if not max_tfs[tid]:
+            start, end = self.term_offsets[tid], self.term_offsets[tid + 1]
+            max_tfs[tid] = max(memoryview(self.post_tfs)[start:end], default=0)
+        return max_tfs[tid]
+
+    def find_posting(self, term: str, docnum: int) -> Optional[int]:
+        """Return the global posting index of (term, docnum), or None."""
+        rng = self.term_range(term)
+        if not rng:
+            return None
+        start, end = rng
+        i = bisect.bisect_left(self.post_docs, docnum, start, end)
+        if i < end and self.post_docs[i] == docnum:
+            return i
+        return None
+
+    def posting_positions(self, posting: int) -> memoryview:
+        return memoryview(self.positions)[self.pos_offsets[posting]:self.pos_offsets[posting + 1]]
+
+    def iter_term_postings(self, term: str) -> Iterator[Tuple[int, memoryview]]:
+        """Yield (internal_doc_id, positions) for term."""
+        rng = self.term_range(term)
+        if not rng:
+            return
+        for p in range(rng[0], rng[1]):
+            yield self.post_docs[p], self.posting_positions(p)
+
+    def phrase_matches(self, phrase_tokens: List[str]) -> Dict[int, int]:
+        """
+        Returns {internal_doc_id: phrase_count}. Candidate docs are found by walking the
+        shortest postings list and binary-searching the others (all are doc id sorted),
+        positions are then merged in place (phrase_match.phrase_count).
+        """
+        if any(t not in self for t in phrase_tokens):
+            return {}
+
+        # Drive the intersection from the rarest term
+        driver = min(range(len(phrase_tokens)), key=lambda i: self.doc_freq(phrase_tokens[i]))
+        counts: Dict[int, int] = {}
+        for docnum in self.docs(phrase_tokens[driver]):
+            posting_ids = []
+            for t in phrase_tokens:
+                p = self.find_posting(t, docnum)
+                if p is None: break
+                posting_ids.append(p)
+            else:
+                count = phrase_count([self.posting_positions(p).tolist() for p in posting_ids])
+                if count:
+                    counts[docnum] = count
+        return counts
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the typed arrays (excludes the term/doc id strings)."""
+        arrays = (self.term_offsets, self.post_docs, self.post_tfs, self.pos_offsets, self.positions)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+class CompactPostingsBuilder:
+    """
+    Accumulates postings per term in small typed arrays, then concatenates them
+    into one CompactPostings. Documents must be added in increasing doc id order,
+    which add_document guarantees by assigning ids sequentially.
+    """
+
+    def __init__(self):
+        self.doc_ids: List[str] = []
+        # term -> (docs, tfs, positions)
+        self._terms: Dict[str, Tuple[array, array, array]] = {}
+
+    def _add_doc(self, doc_id: str) -> int:
+        self.doc_ids.append(doc_id)
+        return len(self.doc_ids) - 1
+
+    def add_posting(self, term: str, docnum: int, positions: Iterable[int]) -> None:
+        entry = self._terms.get(term)
+        if entry is None:
+            entry = self._terms[term] = (array("I"), array("I"), array("I"))
+        docs, tfs, pos = entry
+        before = len(pos)
+        pos.extend(positions)
+        docs.append(docnum)
+        tfs.append(len(pos) - before)
+
+    def add_document(self, doc_id: str, tokens: List[str]) -> int:
+        """Assign the next internal id to doc_id and add its positional postings."""
+        docnum = self._add_doc(doc_id)
+        term_positions: Dict[str, List[int]] = {}
+        for pos, term in enumerate(tokens):
+            term_positions.setdefault(term, []).append(pos)
+        for term, positions in term_positions.items():
+            self.add_posting(term, docnum, positions)
+        return docnum
+
+    def add_existing(self, postings: CompactPostings, keep_doc_ids: Set[str]) -> None:
+        """Copy postings of the documents in keep_doc_ids, renumbering them densely."""
+        remap = array("q", [-1]) * len(postings.doc_ids)
+        for old, doc_id in enumerate(postings.doc_ids):
+            if doc_id in keep_doc_ids:
+                remap[old] = self._add_doc(doc_id)
+        for term in postings.terms:
+            for old, positions in postings.iter_term_postings(term):
+                new = remap[old]
+                if new >= 0:
+                    self.add_posting(term, new, positions)
+
+    def build(self) -> CompactPostings:
+        terms = sorted(self._terms)
+        term_offsets = array("Q", [0])
+        post_docs, post_tfs, positions = array("I"), array("I"), array("I")
+        pos_offsets = array("Q", [0])
+        for term in terms:
+            docs, tfs, pos = self._terms[term]
+            post_docs.extend(docs)
+            post_tfs.extend(tfs)
+            positions.extend(pos)
+            term_offsets.append(len(post_docs))
+            running = pos_offsets[-1]
+            for tf in tfs:
+                running += tf
+                pos_offsets.append(running)
+        return CompactPostings(self.doc_ids, terms, term_offsets, post_docs, post_tfs, pos_offsets, positions)
+
+
+class SelfIndexCompact(SelfIndexTFIDF):
+    """
+    TF-IDF index (x=3) stored as CompactPostings instead of nested dicts.
+    - inverted_index: CompactPostings (dense int doc ids, typed arrays, shared positions buffer)
+    - doc_freq is not stored separately, it is the length of each term's postings slice
+    Query helpers keep the parent signatures and return external doc ids.
+    query(q, top_k=k) prunes disjunctive queries with WAND (optim='Thresholding') or
+    MaxScore (optim='EarlyStopping'), see topk.py.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_compact"):
+        super().__init__(core, 'TFIDF', dstore, qproc, compr, optim, preprocess_fn, storage_path)
+
+    # --- Override create_index ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]],
+                     next_word_min_df: Optional[int] = None) -> None:
+        """
+        Builds the compact TF-IDF index and persists it.
+        next_word_min_df: also build a next-word index (phrase_match.NextWordIndex) for
+        two-word phrases whose first word is in at least that many docs.
+        """
+        print(f"[{self.identifier_short}] Creating compact TF-IDF index: {index_id}")
+
+        builder = CompactPostingsBuilder()
+        docs: Dict[str, Dict[str, str]] = {}
+
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            if doc_id in docs:
+                raise ValueError(f"Duplicate doc_id '{doc_id}'")
+
+            tokens = self.preprocess_fn(content)
+            docs[doc_id] = {'original': content, 'clean': " ".join(tokens)}
+            builder.add_document(doc_id, tokens)
+
+        postings = self._encode_postings(builder.build())
+        self.index_data = {
+            "inverted_index": postings,
+            "docs": docs,
+            "doc_count": len(docs),
+            "terms_count": len(postings),
+        }
+        self._build_next_word(next_word_min_df)
+
+        self._save_index_to_file(index_id)
+        self.indices.add(index_id)
+        self._save_registry()
+
+        print(f"[{self.identifier_short}] Compact index '{index_id}' created: {len(docs)} docs, {len(postings)} terms "
+              f"({postings.memory_bytes() / (1024**2):.2f} MB of postings arrays).")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Remove docs, then add docs. The arrays are immutable, so surviving postings are
+        copied into a fresh builder (one pass over the index) and the new docs appended.
+        """
+        print(f"[{self.identifier_short}] Updating index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        self._load_index_from_file(index_id)
+        postings: CompactPostings = self.index_data["inverted_index"]
+        # Copy a read-only doc table (segment_store); the doc store takes the changes in place
+        docs = self.index_data["docs"]
+        if not isinstance(docs, MutableMapping): docs = dict(docs)
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids.update(doc_id for doc_id in additions if doc_id in docs)
+
+        for rid in remove_ids:
+            docs.pop(rid, None)
+
+        builder = CompactPostingsBuilder()
+        builder.add_existing(postings, set(docs.keys()))
+        for doc_id, content in additions.items():
+            tokens = self.preprocess_fn(content)
+            docs[doc_id] = {'original': content, 'clean': " ".join(tokens)}
+            builder.add_document(doc_id, tokens)
+
+        postings = self._encode_postings(builder.build())
+        self.index_data["inverted_index"] = postings
+        self.index_data["docs"] = docs
+        self.index_data["doc_count"] = len(docs)
+        self.index_data["terms_count"] = len(postings)
+        next_word = self.index_data.get("next_word")
+        self._build_next_word(next_word.min_df if next_word else None)
+        self._save_index_to_file(index_id)
+        print(f"[{self.identifier_short}] Update complete. docs={self.index_data['doc_count']}, terms={self.index_data['terms_count']}")
+
+    def _encode_postings(self, postings: CompactPostings) -> CompactPostings:
+        """Hook: the postings object stored as index_data["inverted_index"] (see block_index)."""
+        return postings
+
+    def _build_next_word(self, min_df: Optional[int]) -> None:
+        """(Re)builds index_data["next_word"] from the clean text, or drops it if min_df is None."""
+        if min_df is None:
+            self.index_data.pop("next_word", None)
+            return
+        postings = self._postings()
+        docs = self.index_data["docs"]
+        tokens = (docs[doc_id]['clean'].split() for doc_id in postings.doc_ids)
+        next_word = NextWordIndex.build(tokens, postings.doc_freq, min_df)
+        self.index_data["next_word"] = next_word
+        print(f"[{self.identifier_short}] Next-word index: {len(next_word.pairs)} pairs "
+              f"for {len(next_word.first_words)} first words (df >= {min_df}).")
+
+    # --- Lookup helpers ---
+    def _postings(self) -> CompactPostings:
+        if not self.index_data:
+            raise RuntimeError("No index loaded. Call load_index(index_id) first.")
+        return self.index_data["inverted_index"]
+
+    def _doc_freq(self, term: str) -> int:
+        return self._postings().doc_freq(term)
+
+    def _calculate_idf(self, term: str) -> float:
+        """IDF with df taken from the postings slice length."""
+        N = self.index_data.get('doc_count', 0) if self.index_data else 0
+        df = self._postings().doc_freq(term)
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _get_postings_set(self, term: str) -> Set[str]:
+        postings = self._postings()
+        doc_ids = postings.doc_ids
+        return {doc_ids[d] for d in postings.docs(term)}
+
+    def _get_term_postings_with_counts(self, term: str) -> Dict[str, int]:
+        postings = self._postings()
+        doc_ids = postings.doc_ids
+        return {doc_ids[d]: tf for d, tf in postings.postings(term)}
+
+    def _phrase_matches(self, phrase_tokens: List[str]) -> Dict[int, int]:
+        """{internal doc id: phrase count}, from the next-word index when it covers the phrase."""
+        next_word = self.index_data.get("next_word")
+        if next_word is not None:
+            matches = next_word.lookup(phrase_tokens)
+            if matches is not None:
+                return matches
+        return self._postings().phrase_matches(phrase_tokens)
+
+    def _eval_term_to_set(self, term: str) -> Set[str]:
+        if " " not in term:
+            return self._get_postings_set(term)
+        doc_ids = self._postings().doc_ids
+        return {doc_ids[d] for d in self._phrase_matches(term.split(" "))}
+
+    def _get_phrase_postings_with_counts(self, term: str) -> Dict[str, int]:
+        doc_ids = self._postings().doc_ids
+        return {doc_ids[d]: c for d, c in self._phrase_matches(term.split(" ")).items()}
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates a single term or phrase, returning {doc_id: tfidf_score}."""
+        postings = self._postings()
+        doc_ids = postings.doc_ids
+        final_scores: Dict[str, float] = {}
+
+        if " " not in operand: # Single term
+            idf = self._calculate_idf(operand)
+            if idf == 0: return {}
+            for docnum, tf in postings.postings(operand):
+                final_scores[doc_ids[docnum]] = tf * idf
+
+        else: # Phrase: sum of TF-IDF of the phrase terms in each matching doc
+            phrase_tokens = operand.split(" ")
+            matches = self._phrase_matches(phrase_tokens)
+            if not matches: return {}
+            term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+            for docnum in matches:
+                doc_score = 0.0
+                for term in phrase_tokens:
+                    p = postings.find_posting(term, docnum)
+                    if p is not None:
+                        doc_score += postings.post_tfs[p] * term_idfs[term]
+                final_scores[doc_ids[docnum]] = doc_score
+
+        return final_scores
+
+    # --- Top-k ---
+    def _scoring_segments(self) -> Iterator[Tuple[CompactPostings, Optional[Callable[[int], bool]]]]:
+        """(postings, is_deleted) pairs to run top-k over, in doc order."""
+        yield self._postings(), None
+
+    def _explain_top_k(self, terms: Dict[str, int], top_k: int) -> str:
+        strategy = "WAND" if self.optim is Optimizations.Thresholding else "MaxScore"
+        operands = ", ".join(f'"{term}"~{self._doc_freq(term)}' for term in terms)
+        return f"{strategy}-top{top_k}({operands})"
+
+    def _top_k_disjunctive(self, terms: Dict[str, int], top_k: int) -> List[Tuple[str, float]]:
+        """Exact top-k of an OR of terms ({term: occurrences in the query})."""
+        weights = {term: count * self._calculate_idf(term) for term, count in terms.items()}
+        strategy = wand_top_k if self.optim is Optimizations.Thresholding else maxscore_top_k
+        heap = TopKHeap(top_k)
+        order_base = 0
+        for postings, is_deleted in self._scoring_segments():
+            if len(weights) == 1:
+                (term, weight), = weights.items()
+                single_term_top_k(postings, term, weight, heap, is_deleted, order_base)
+            else:
+                trace_count("candidates", strategy(postings, weights, heap, is_deleted, order_base))
+            order_base += len(postings.doc_ids)
+        return heap.results()
+
+    @traced_query
+    def query(self, query: str, top_k: Optional[int] = None, explain: bool = False, snippets: bool = False) -> str:
+        """
+        TF-IDF query. With top_k and optim Thresholding/EarlyStopping, single-term and
+        OR-of-terms queries skip documents that cannot make the top k; other queries
+        are scored fully and the k best selected.
+        """
+        if top_k is None or self.optim not in (Optimizations.Thresholding, Optimizations.EarlyStopping):
+            return super().query(query, top_k=top_k, explain=explain, snippets=snippets)
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying (TF-IDF x=3, top-%d, %s): %s", self.identifier_short, top_k, self.optim.name, query)
+
+        plan, rpn = None, []
+        try:
+            rpn = self._parse_query(query)
+            terms = disjunctive_terms(rpn)
+            if explain: plan = self._explain_rpn(rpn)
+            if terms is not None:
+                if explain: plan = self._explain_top_k(terms, top_k)
+                compute = lambda: self._top_k_disjunctive(terms, top_k)
+            else:
+                compute = lambda: self._rank(self._evaluate_rpn(rpn), top_k)
+            ranked_results = self._cached_results(rpn, compute, top_k)
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = {
+            "query": query,
+            "results": ranked_results,
+            "count": len(ranked_results),
+        }
+        if explain: out["plan"] = plan
+        if snippets: out["snippets"] = self._snippets(rpn, [doc_id for doc_id, _ in ranked_results])
+        return dumps(out)
@@ -0,0 +1,246 @@
+import gzip
+import io
+import pickle
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from phrase_match import phrase_count
+from self_index import SelfIndexTFIDF
+
+# ----------------------
+# Compressed variants of the pickled TF-IDF index (z=1, z=2)
+# ----------------------
+# - SelfIndexCompressedSimple (z=1): position lists stored as Delta + Variable Byte bytes
+# - SelfIndexCompressedLib (z=2): the whole pickle gzip-compressed
+# Moved from es.ipynb so the benchmark suite (bench/variants.py) can import them.
+# block_index.SelfIndexBlock is the bit-packed z=1 variant of the compact index.
+
+
+# --- Variable Byte Encoding/Decoding ---
+
+def vb_encode_number(n: int) -> bytes:
+    """Encodes a single non-negative integer using Variable Byte encoding."""
+    if n == 0:
+        return b'\x80' # Special case for 0
+    bytes_list = []
+    while n > 0:
+        byte = n & 0x7F # Get the last 7 bits
+        n >>= 7
+        if bytes_list: # If not the first byte (least significant)
+            bytes_list.insert(0, byte) # Prepend without continuation bit
+        else: # First byte (least significant)
+            bytes_list.insert(0, byte | 0x80) # Prepend WITH continuation bit
+    return bytes(bytes_list)
+
+
+def vb_encode(numbers: List[int]) -> bytes:
+    """Encodes a list of non-negative integers into a single byte stream."""
+    stream = io.BytesIO()
+    for n in numbers:
+        stream.write(vb_encode_number(n))
+    return stream.getvalue()
+
+
+def vb_decode(byte_stream: bytes) -> List[int]:
+    """Decodes a Variable Byte encoded byte stream back into a list of integers."""
+    numbers = []
+    n = 0
+    stream = io.BytesIO(byte_stream)
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            break # End of stream
+        byte_val = ord(byte)
+        if byte_val & 0x80: # Continuation bit is set (last byte of current number)
+            n = (n << 7) | (byte_val & 0x7F)
+            numbers.append(n)
+            n = 0 # Reset for next number
+        else: # Continuation bit is not set
+            n = (n << 7) | byte_val
+    return numbers
+
+
+# --- Delta Encoding/Decoding ---
+
+def delta_encode(numbers: List[int]) -> List[int]:
+    """Encodes a sorted list of integers using delta encoding."""
+    if not numbers:
+        return []
+    # Store first number, then gaps
+    return [numbers[0]] + [numbers[i] - numbers[i-1] for i in range(1, len(numbers))]
+
+
+def delta_decode(delta_encoded: List[int]) -> List[int]:
+    """Decodes a delta-encoded list back into the original sorted list."""
+    if not delta_encoded:
+        return []
+    original = [delta_encoded[0]]
+    for i in range(1, len(delta_encoded)):
+        original.append(original[-1] + delta_encoded[i])
+    return original
+
+
+class SelfIndexCompressedSimple(SelfIndexTFIDF):
+    """
+    Extends SelfIndexTFIDF to apply simple compression (z=1)
+    using Delta + VB Encoding on position lists.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_compsimple"):
+        # Explicitly set compressor to CODE
+        super().__init__(core, 'TFIDF', dstore, qproc, 'CODE', optim, preprocess_fn, storage_path)
+        # Index data structure will store compressed positions
+
+    # Override create_index
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Builds index, then compresses position lists before saving.
+        """
+        # 1. Build the index in memory using parent's logic (stores TF and List[int] positions)
+        super().create_index(index_id, files)
+
+        # 2. Now, compress the position lists in self.index_data before saving
+        print(f"[{self.identifier_short}] Compressing position lists (Delta+VB)...")
+        for postings in self.index_data["inverted_index"].values():
+            for data in postings.values():
+                self._compress_positions(data)
+
+        # 3. Re-save the modified index_data to the same file
+        self._save_index_to_file(index_id)
+        print(f"[{self.identifier_short}] Compressed index saved to {self._get_index_filepath(index_id)}")
+
+    @staticmethod
+    def _compress_positions(data: Dict[str, Any]) -> None:
+        """{'count', 'pos'} -> {'count', 'pos_compressed'} in place."""
+        positions = data.pop('pos', None)
+        if positions:
+            data['pos_compressed'] = vb_encode(delta_encode(positions))
+
+    def _add_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, content: str) -> Any:
+        """Parent postings of an added doc (update_index), positions compressed like create_index's."""
+        doc = super()._add_doc_postings(inverted_index, doc_id, content)
+        for term in set(doc['clean'].split()):
+            self._compress_positions(inverted_index[term][doc_id])
+        return doc
+
+    # Override methods that NEED decompressed positions
+
+    # Helper to get decompressed positions for a specific term and doc
+    def _get_decompressed_positions(self, term: str, doc_id: str) -> List[int]:
+        """Finds posting, decompresses positions."""
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+
+        postings = self.index_data["inverted_index"].get(term, {})
+        data = postings.get(doc_id)
+
+        if not data or 'pos_compressed' not in data:
+            return [] # Term/doc not found or no positions stored
+
+        return delta_decode(vb_decode(data['pos_compressed']))
+
+    # Override the part of scoring that handles phrases
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """
+        Evaluates term/phrase, returning {doc_id: tfidf_score}.
+        Overrides phrase logic to decompress positions AND calculate score directly.
+        """
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+        inverted_index = self.index_data["inverted_index"]
+        final_scores = defaultdict(float)
+
+        if " " not in operand: # Single term - Use parent TFIDF logic
+            # This is safe because single term scoring only needs 'count' (TF)
+            # which wasn't removed during compression.
+            return super()._eval_operand_to_scored_docs(operand)
+
+        # Phrase - Needs decompressed positions AND direct scoring
+        phrase_tokens = operand.split(" ")
+
+        # 1. Find candidate docs (containing all terms, starting from the rarest word)
+        all_term_postings = []
+        for term in phrase_tokens:
+            postings = inverted_index.get(term)
+            if not postings: return {}
+            all_term_postings.append(postings)
+        candidate_docs = set(min(all_term_postings, key=len))
+        for postings in all_term_postings:
+            candidate_docs = {doc for doc in candidate_docs if doc in postings}
+            if not candidate_docs: return {}
+
+        # 2. Check positional adjacency using decompressed positions (merge, see phrase_match)
+        matched_docs = [doc for doc in candidate_docs
+                        if phrase_count([self._get_decompressed_positions(t, doc) for t in phrase_tokens])]
+
+        # 3. Calculate scores DIRECTLY for matched_docs
+        term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+        for doc_id in matched_docs:
+            final_scores[doc_id] = sum(postings[doc_id]['count'] * term_idfs[term]
+                                       for term, postings in zip(phrase_tokens, all_term_postings))
+        return dict(final_scores)
+
+    # Note: _evaluate_rpn and query methods from SelfIndexRanked are inherited.
+    #       They call _eval_operand_to_scored_docs, which we have overridden
+    #       to handle decompression for phrases.
+
+
+class SelfIndexCompressedLib(SelfIndexTFIDF):
+    """
+    Extends SelfIndexTFIDF to apply library compression (z=2)
+    using gzip on the entire pickle file (texts included: no separate doc store).
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_complib"):
+        # Explicitly set compressor to CLIB
+        super().__init__(core, 'TFIDF', dstore, qproc, 'CLIB', optim, preprocess_fn, storage_path)
+        # Inherits TFIDF logic and data structures
+
+    # --- Override persistence helpers ---
+
+    def _get_index_filepath(self, index_id: str) -> Path:
+        """Override to return a .pkl.gz extension."""
+        # This helps distinguish compressed files
+        return self.storage_path / f"{index_id}.pkl.gz"
+
+    def _save_index_to_file(self, index_id: str):
+        """Saves the index data to a gzip-compressed pickle file."""
+        path = self._get_index_filepath(index_id)
+        print(f"[{self.identifier_short}] Saving index with gzip compression to {path}...")
+        try:
+            with gzip.open(path, "wb") as f:
+                pickle.dump(self.index_data, f)
+            self._set_loaded(index_id) # as SelfIndex._save_index_to_file: new query cache generation
+            print(f"[{self.identifier_short}] Successfully saved compressed index.")
+        except Exception as e:
+            print(f"[{self.identifier_short}] ERROR saving compressed index: {e}")
+            # Clean up partially written file
+            if path.exists():
+                path.unlink()
+            raise
+
+    def _load_index_from_file(self, index_id: str):
+        """Loads the index data from a gzip-compressed pickle file."""
+        path = self._get_index_filepath(index_id)
+        if not path.exists():
+            raise FileNotFoundError(f"Compressed index file not found: {path}")
+        print(f"[{self.identifier_short}] Loading index with gzip decompression from {path}...")
+        try:
+            with gzip.open(path, "rb") as f:
+                self.index_data = pickle.load(f)
+            self._set_loaded(index_id) # as SelfIndex._load_index_from_file
+            print(f"[{self.identifier_short}] Successfully loaded decompressed index.")
+        except Exception as e:
+            print(f"[{self.identifier_short}] ERROR loading compressed index: {e}")
+            self.index_data = {} # Ensure data is cleared on error
+            self._set_loaded(None)
+            raise
+
+    def _read_doc_ids(self, index_id: str) -> List[str]:
+        with gzip.open(self._get_index_filepath(index_id), "rb") as f:
+            return sorted(pickle.load(f).get("docs", {}).keys())
+
+    # No need to override create_index, load_index, or query methods.
+    # create_index calls _save_index_to_file (which is now overridden).
+    # load_index calls _load_index_from_file (which is now overridden).
+    # query methods operate on self.index_data, which is fully decompressed
+    # into memory by _load_index_from_file.
@@ -0,0 +1,229 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+from compact_index import CompactPostings, SelfIndexCompact
+from phrase_match import phrase_count
+from query_trace import count, dumps, query_log, traced_query
+from topk import TopKHeap
+
+# Past-the-end doc id (internal doc ids are uint32)
+END = 1 << 32
+
+
+# ----------------------
+# Posting-list cursors
+# ----------------------
+# Every node of a compiled query supports
+# - next_candidate(target): smallest doc >= target that may match (END if none), or
+#   is not "generating" (NOT, OR with a NOT branch) and cannot enumerate docs itself
+# - matches(doc): exact boolean test of doc
+# Both are called with non-decreasing doc ids, so each cursor only moves forward.
+
+class TermCursor:
+    """Cursor over one term's doc id sorted postings slice."""
+
+    generating = True
+
+    def __init__(self, postings: CompactPostings, term: str):
+        self.postings = postings
+        self.term = term
+        rng = postings.term_range(term)
+        self.pos, self.end = rng if rng else (0, 0)
+
+    @property
+    def doc(self) -> int:
+        return self.postings.post_docs[self.pos] if self.pos < self.end else END
+
+    @property
+    def tf(self) -> int:
+        return self.postings.post_tfs[self.pos]
+
+    def next(self) -> int:
+        """Move to the next posting; returns its doc (END when exhausted)."""
+        if self.pos < self.end:
+            self.pos += 1
+        return self.doc
+
+    def advance(self, target: int) -> int:
+        """Move to the first posting with doc >= target (binary search); returns its doc."""
+        if self.pos < self.end and self.postings.post_docs[self.pos] < target:
+            self.pos = bisect.bisect_left(self.postings.post_docs, target, self.pos, self.end)
+        return self.doc
+
+    def next_candidate(self, target: int) -> int:
+        return self.advance(target)
+
+    def matches(self, doc: int) -> bool:
+        return self.advance(doc) == doc
+
+
+class PhraseCursor:
+    """Consecutive terms: leapfrog over the term cursors, positions checked on a common doc."""
+
+    generating = True
+
+    def __init__(self, postings: CompactPostings, terms: List[str]):
+        self.postings = postings
+        self.cursors = [TermCursor(postings, t) for t in terms]
+        # Rarest term first: it drives the leapfrog
+        self._order = sorted(self.cursors, key=lambda c: c.end - c.pos)
+
+    def next_candidate(self, target: int) -> int:
+        return _leapfrog(self._order, target)
+
+    def matches(self, doc: int) -> bool:
+        if any(c.advance(doc) != doc for c in self._order):
+            return False
+        pos_lists = [self.postings.posting_positions(c.pos).tolist() for c in self.cursors]
+        return phrase_count(pos_lists, first_only=True) > 0
+
+
+class AndNode:
+    def __init__(self, children):
+        self.children = children
+        self._generating = [c for c in children if c.generating]
+        self.generating = bool(self._generating)
+
+    def next_candidate(self, target: int) -> int:
+        return _leapfrog(self._generating, target)
+
+    def matches(self, doc: int) -> bool:
+        return all(c.matches(doc) for c in self.children)
+
+
+class OrNode:
+    def __init__(self, children):
+        self.children = children
+        self.generating = all(c.generating for c in children)
+
+    def next_candidate(self, target: int) -> int:
+        return min(c.next_candidate(target) for c in self.children)
+
+    def matches(self, doc: int) -> bool:
+        # any() may skip children; they catch up on their next advance
+        return any(c.matches(doc) for c in self.children)
+
+
+class NotNode:
+    generating = False
+
+    def __init__(self, child):
+        self.child = child
+
+    def matches(self, doc: int) -> bool:
+        return not self.child.matches(doc)
+
+
+def _leapfrog(cursors, target: int) -> int:
+    """Smallest doc >= target on which every cursor (next_candidate) agrees."""
+    if not cursors:
+        return END
+    doc = target
+    while True:
+        agreed = True
+        for c in cursors:
+            d = c.next_candidate(doc)
+            if d == END:
+                return END
+            if d != doc:
+                doc = d
+                agreed = False
+                break
+        if agreed:
+            return doc
+
+
+class SelfIndexDaaT(SelfIndexCompact):
+    """
+    Implements Document-at-a-time (DaaT) query processing (q=Dn).
+    The boolean query is compiled into a tree of posting-list cursors over doc id sorted
+    postings (CompactPostings); candidate docs come from the cursors themselves (AND =
+    leapfrog, OR = min, phrase = leapfrog + positions), so only documents present in
+    some posting list are ever visited, and each one is scored as soon as it matches.
+    Score = sum of tf * idf over the distinct query terms; docs scoring 0 are dropped.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_daat"):
+        # Explicitly set query processor to DaaT
+        SelfIndexCompact.__init__(self, core, info, dstore, 'DOCatat', compr, optim, preprocess_fn, storage_path)
+
+    def _compile(self, rpn_tokens: List[str]):
+        """RPN -> cursor tree (AND/OR chains flattened). Returns (root, distinct query terms)."""
+        postings = self._postings()
+        stack = []
+        terms: List[str] = []
+        for tok in rpn_tokens:
+            if tok == "NOT":
+                if not stack: raise ValueError("NOT needs operand")
+                stack.append(NotNode(stack.pop()))
+            elif tok in ("AND", "OR"):
+                if len(stack) < 2: raise ValueError(f"{tok} needs two operands")
+                b = stack.pop()
+                a = stack.pop()
+                cls = AndNode if tok == "AND" else OrNode
+                children = []
+                for node in (a, b):
+                    children.extend(node.children if isinstance(node, cls) else [node])
+                stack.append(cls(children))
+            else: # Operand (term or phrase)
+                parts = tok.split(" ")
+                terms.extend(t for t in parts if t not in terms)
+                stack.append(TermCursor(postings, tok) if len(parts) == 1 else PhraseCursor(postings, parts))
+        if not stack: return None, terms
+        if len(stack) != 1: raise ValueError("Malformed boolean expression")
+        return stack[0], terms
+
+    @traced_query
+    def query(self, query: str, top_k: Optional[int] = None) -> str:
+        """
+        Perform boolean query using Document-at-a-time (DaaT) processing.
+        Returns ranked results based on TF-IDF scores; top_k keeps only the k best.
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying DaaT (TF-IDF x=3, q=D): %s", self.identifier_short, query)
+
+        try:
+            rpn = self._parse_query(query)
+            ranked_results = self._cached_results(rpn, lambda: self._run(*self._compile(rpn), top_k), top_k)
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = {"query": query, "results": ranked_results, "count": len(ranked_results)}
+        return dumps(out)
+
+    def _run(self, root, terms: List[str], top_k: Optional[int]) -> List[Tuple[str, float]]:
+        if root is None:
+            return []
+        postings = self._postings()
+        doc_ids = postings.doc_ids
+        # Only docs containing a query term can score > 0; if the query itself cannot
+        # enumerate docs (e.g. "a OR NOT b"), those term postings generate the candidates
+        generator = root if root.generating else OrNode([TermCursor(postings, t) for t in terms])
+        scorers = [(TermCursor(postings, t), self._calculate_idf(t)) for t in terms]
+        scorers = [(c, idf) for c, idf in scorers if idf > 0]
+
+        heap = TopKHeap(top_k) if top_k is not None else None
+        doc_scores: Dict[str, float] = {}
+        visited = 0
+        doc = generator.next_candidate(0)
+        while doc != END:
+            visited += 1
+            if root.matches(doc):
+                score = 0.0
+                for cursor, idf in scorers:
+                    if cursor.advance(doc) == doc:
+                        score += cursor.tf * idf
+                if score > 0:
+                    if heap is not None:
+                        heap.offer(score, doc, doc_ids[doc])
+                    else:
+                        doc_scores[doc_ids[doc]] = score
+            doc = generator.next_candidate(doc + 1)
+
+        count("candidates", visited)
+        if heap is not None:
+            return heap.results()
+        return sorted(doc_scores.items(), key=lambda item: item[1], reverse=True)
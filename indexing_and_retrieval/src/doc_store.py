@@ -0,0 +1,282 @@
+import glob
+import os
+import struct
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# ----------------------
+# Block-compressed document store
+# ----------------------
+# The texts of a pickled TF-IDF index live in `{index_id}.docs` next to the pickle, so
+# load_index reads postings, doc ids and doc lengths only; texts are decompressed when a
+# document is actually looked up (snippets of the top k hits, update_index, ...).
+# - file: magic, then zlib blocks back to back
+# - block: records packed back to back, ~block_size bytes before compression
+# - record: <II original_len, clean_len> + utf-8 original + utf-8 clean; clean_len
+#   PLAIN marks a doc stored as a bare string (x=1/x=2 doc layout)
+# The table (doc id -> block, offset in the decompressed block) belongs to the DocStore
+# object and is pickled with the index. The file is append-only: updates append blocks
+# for the added docs, removed docs only leave the table, and the file is rewritten once
+# dead records outweigh live ones. A rewrite goes to the next generation file
+# (`{index_id}.docs.1`, `.2`, ...): the pickle on disk keeps pointing at the old file
+# until the index is saved, and only then is the old file deleted (a crash in between
+# leaves a stale file, never a table pointing into the wrong one). Readers open the
+# file at load time, so a rewrite never changes the blocks under a loaded table.
+
+DOCSTORE_MAGIC = b"SIXDOCS\x01"
+RECORD = struct.Struct("<II")
+PLAIN = 0xFFFFFFFF
+
+Doc = Union[str, Dict[str, str]]
+
+
+def generation_path(path, generation: int) -> Path:
+    """File of a doc store generation: path itself, then path.1, path.2, ... (one per rewrite)."""
+    path = Path(path)
+    return path if generation == 0 else path.with_name(f"{path.name}.{generation}")
+
+
+def generation_files(path) -> Dict[int, Path]:
+    """{generation: file} of the doc store files present at path (stale ones included)."""
+    path = Path(path)
+    found = {0: path} if path.exists() else {}
+    for file in path.parent.glob(glob.escape(path.name) + ".*"):
+        suffix = file.name[len(path.name) + 1:]
+        if suffix.isdigit():
+            found[int(suffix)] = file
+    return found
+
+
+def _encode(doc: Doc) -> bytes:
+    if isinstance(doc, str):
+        original = doc.encode("utf-8")
+        return RECORD.pack(len(original), PLAIN) + original
+    original = (doc.get('original') or "").encode("utf-8")
+    clean = (doc.get('clean') or "").encode("utf-8")
+    return RECORD.pack(len(original), len(clean)) + original + clean
+
+
+def _decode(block: bytes, offset: int) -> Doc:
+    original_len, clean_len = RECORD.unpack_from(block, offset)
+    start = offset + RECORD.size
+    original = block[start:start + original_len].decode("utf-8")
+    if clean_len == PLAIN:
+        return original
+    start += original_len
+    return {'original': original, 'clean': block[start:start + clean_len].decode("utf-8")}
+
+
+def _doc_length(doc: Doc) -> int:
+    """Tokens in the clean text (whitespace words of a bare string)."""
+    text = doc if isinstance(doc, str) else doc.get('clean') or ""
+    return len(text.split())
+
+
+class DocStore(MutableMapping):
+    """
+    {doc_id: {'original':..., 'clean':...}} (or {doc_id: text}) backed by a doc store file.
+    Assigned docs stay in memory until flush(); lengths[slot] is each doc's token count.
+    """
+
+    def __init__(self, path, block_size: int = 64 * 1024, level: int = 6, cache_blocks: int = 8,
+                 generation: int = 0):
+        self.base_path = Path(path)
+        self.generation = generation
+        self.path = generation_path(path, generation) # the file actually read
+        self.block_size = block_size
+        self.level = level
+        self.cache_blocks = cache_blocks
+        self.doc_ids: List[Optional[str]] = [] # by slot, None once removed
+        self.lengths = array("I") # by slot
+        self._slots: Dict[str, int] = {}
+        self._block = array("I") # by slot
+        self._offset = array("I") # by slot, in the decompressed block
+        self._record_bytes = array("I") # by slot
+        self._block_offsets = array("Q", [len(DOCSTORE_MAGIC)]) # block b = [b, b + 1)
+        self._pending: Dict[int, Doc] = {} # slot -> doc not written yet
+        self._live_bytes = 0
+        self._dead_bytes = 0
+        self._init_reader()
+
+    def _init_reader(self) -> None:
+        self._lock = threading.Lock()
+        self._file = None
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict() # decompressed blocks, LRU first
+
+    @classmethod
+    def write(cls, path, docs: Iterable[Tuple[str, Doc]], **options) -> "DocStore":
+        """A new doc store file holding docs (replaces any file of that generation once complete)."""
+        store = cls(path, **options)
+        tmp = store.path.with_name(store.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(DOCSTORE_MAGIC)
+            store._write_records(f, ((store._new_slot(doc_id, doc), doc) for doc_id, doc in docs))
+        os.replace(tmp, store.path)
+        store.open()
+        return store
+
+    # ----------------------
+    # Pickling / file handle
+    # ----------------------
+    def __getstate__(self) -> Dict[str, Any]:
+        if self._pending:
+            raise RuntimeError("DocStore has unwritten docs: flush() it before pickling")
+        state = self.__dict__.copy()
+        for name in ("_lock", "_file", "_cache"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state.setdefault("base_path", state["path"]) # pickled before generations
+        state.setdefault("generation", 0)
+        self.__dict__.update(state)
+        self._init_reader()
+
+    def open(self, path=None) -> "DocStore":
+        """
+        (Re)open the file, e.g. after an index is loaded from a pickle; path is the
+        generation 0 location (the file opened is this store's generation of it).
+        """
+        with self._lock:
+            if path is not None:
+                self.base_path = Path(path)
+                self.path = generation_path(path, self.generation)
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, "rb")
+            self._cache.clear()
+        return self
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._cache.clear()
+
+    # ----------------------
+    # Reads
+    # ----------------------
+    def _read_block(self, block: int) -> bytes:
+        with self._lock:
+            data = self._cache.get(block)
+            if data is not None:
+                self._cache.move_to_end(block)
+                return data
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            start, end = self._block_offsets[block], self._block_offsets[block + 1]
+            self._file.seek(start)
+            data = zlib.decompress(self._file.read(end - start))
+            self._cache[block] = data
+            if len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+            return data
+
+    def __getitem__(self, doc_id: str) -> Doc:
+        slot = self._slots[doc_id]
+        doc = self._pending.get(slot)
+        if doc is not None:
+            return doc
+        return _decode(self._read_block(self._block[slot]), self._offset[slot])
+
+    def get_many(self, doc_ids: Iterable[str]) -> Dict[str, Doc]:
+        """Docs of the known ids in doc_ids, each block read and decompressed once."""
+        slots = [(self._slots[doc_id], doc_id) for doc_id in doc_ids if doc_id in self._slots]
+        found: Dict[str, Doc] = {}
+        for slot, doc_id in sorted(slots, key=lambda s: self._block[s[0]] if s[0] not in self._pending else -1):
+            found[doc_id] = self[doc_id]
+        return {doc_id: found[doc_id] for _, doc_id in slots}
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._slots
+
+    def __iter__(self) -> Iterator[str]:
+        return (doc_id for doc_id in self.doc_ids if doc_id is not None)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def length(self, doc_id: str) -> int:
+        return self.lengths[self._slots[doc_id]]
+
+    # ----------------------
+    # Writes
+    # ----------------------
+    def _new_slot(self, doc_id: str, doc: Doc) -> int:
+        slot = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self._slots[doc_id] = slot
+        self.lengths.append(_doc_length(doc))
+        self._block.append(0)
+        self._offset.append(0)
+        self._record_bytes.append(0)
+        return slot
+
+    def __setitem__(self, doc_id: str, doc: Doc) -> None:
+        if doc_id in self._slots:
+            del self[doc_id]
+        self._pending[self._new_slot(doc_id, doc)] = doc
+
+    def __delitem__(self, doc_id: str) -> None:
+        slot = self._slots.pop(doc_id)
+        self.doc_ids[slot] = None
+        if self._pending.pop(slot, None) is None:
+            self._live_bytes -= self._record_bytes[slot]
+            self._dead_bytes += self._record_bytes[slot]
+
+    def _write_records(self, f, records: Iterable[Tuple[int, Doc]]) -> None:
+        """Pack the docs of the given slots into blocks written at the end of f."""
+        buf = bytearray()
+        end = self._block_offsets[-1]
+        for slot, doc in records:
+            record = _encode(doc)
+            self._block[slot] = len(self._block_offsets) - 1
+            self._offset[slot] = len(buf)
+            self._record_bytes[slot] = len(record)
+            self._live_bytes += len(record)
+            buf += record
+            if len(buf) >= self.block_size:
+                end += f.write(zlib.compress(buf, self.level))
+                self._block_offsets.append(end)
+                buf.clear()
+        if buf:
+            end += f.write(zlib.compress(buf, self.level))
+            self._block_offsets.append(end)
+
+    def flush(self) -> None:
+        """Append the assigned docs to the file (or rewrite it when mostly dead records)."""
+        if self._dead_bytes > self._live_bytes:
+            self.compact()
+            return
+        if not self._pending:
+            return
+        with self._lock:
+            with open(self.path, "r+b") as f:
+                # Blocks past the table (a save that failed after appending) are unreferenced
+                f.truncate(self._block_offsets[-1])
+                f.seek(self._block_offsets[-1])
+                self._write_records(f, sorted(self._pending.items()))
+            self._pending.clear()
+
+    def compact(self) -> None:
+        """
+        Rewrite the live docs only (slots renumbered) to the next generation file. The
+        old file is left in place for the pickled table still pointing at it: delete it
+        once the new table is saved.
+        """
+        fresh = DocStore.write(self.base_path, ((doc_id, self[doc_id]) for doc_id in self),
+                               block_size=self.block_size, level=self.level, cache_blocks=self.cache_blocks,
+                               generation=self.generation + 1)
+        self.close()
+        self.__dict__.update(fresh.__dict__)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"docs": len(self), "blocks": len(self._block_offsets) - 1,
+                "file_bytes": self._block_offsets[-1], "live_bytes": self._live_bytes,
+                "dead_bytes": self._dead_bytes, "pending": len(self._pending)}
@@ -0,0 +1,83 @@
+import mmap
+import sys
+import types
+from array import array
+from typing import Any, Optional, Set
+
+try:
+    import numpy as np
+except ImportError: # only needed to size NumPy-backed postings
+    np = None
+
+# ----------------------
+# Approximate memory footprint of a loaded index
+# ----------------------
+# A full deep getsizeof walk of a dict index visits every posting (minutes on a large
+# index). approx_sizeof walks every container with at most `sample` items exactly and
+# estimates larger ones from `sample` evenly spaced items: with the item lengths as the
+# auxiliary variable (ratio estimate), so one posting list per frequent term does not
+# skew the estimate for a Zipfian vocabulary.
+# - arrays and NumPy arrays count their buffers; arrays viewing a memory map (segment
+#   store) count ~nothing, their pages belong to the page cache and can be reclaimed
+# - other objects shared by several containers are counted once
+
+_TRAVERSAL_REFS = 3 # list copy + argument + getrefcount's own: references the walk itself holds
+_ATOMIC = (int, float, complex, bool, str, bytes, bytearray, type(None), array, range)
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, mmap.mmap)
+
+
+def _weight(obj) -> int:
+    try:
+        return len(obj) + 1
+    except TypeError:
+        return 1
+
+
+def approx_sizeof(obj: Any, sample: int = 32, _seen: Optional[Set[int]] = None) -> int:
+    """Estimated bytes reachable from obj (see above)."""
+    if isinstance(obj, str):
+        # Doc ids are shared by every posting of the doc: each reference counts its share
+        # (exact on a full walk, and extrapolates correctly from samples)
+        return sys.getsizeof(obj) // max(1, sys.getrefcount(obj) - _TRAVERSAL_REFS)
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen or isinstance(obj, _SKIP):
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, int) and -5 <= obj <= 256: # preallocated singletons (most positions and tfs)
+        return 0
+    if isinstance(obj, _ATOMIC):
+        return sys.getsizeof(obj)
+    if np is not None and isinstance(obj, np.ndarray):
+        size = sys.getsizeof(obj) # includes the data when the array owns it
+        return size if obj.base is None else size + approx_sizeof(obj.base, sample, seen)
+    if isinstance(obj, memoryview):
+        return sys.getsizeof(obj) + approx_sizeof(obj.obj, sample, seen)
+
+    # Items are always sized from a list copy, so every sized object carries the same
+    # number of references owned by the traversal (see _TRAVERSAL_REFS)
+    if isinstance(obj, dict):
+        keys, values = list(obj), list(obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        keys, values = None, list(obj)
+    else: # plain object: its attributes
+        size = sys.getsizeof(obj)
+        attrs = getattr(obj, "__dict__", None)
+        if attrs is not None:
+            size += approx_sizeof(attrs, sample, seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            size += approx_sizeof(getattr(obj, slot, None), sample, seen)
+        return size
+
+    def item_bytes(i: int) -> int:
+        key_bytes = approx_sizeof(keys[i], sample, seen) if keys is not None else 0
+        return key_bytes + approx_sizeof(values[i], sample, seen)
+
+    size = sys.getsizeof(obj)
+    if len(values) <= sample:
+        return size + sum(item_bytes(i) for i in range(len(values)))
+    step = len(values) / sample
+    picked = [int(i * step) for i in range(sample)]
+    weights = [_weight(value) for value in values]
+    picked_bytes = sum(item_bytes(i) for i in picked)
+    return size + int(picked_bytes * sum(weights) / sum(weights[i] for i in picked))
@@ -14,6 +14,7 @@ class DataStore(Enum):
     CUSTOM = 1
     DB1 = 2
     DB2 = 3
+    SEGMENT = 4
 class Compression(Enum):
     NONE = 1
     CODE = 2
@@ -26,6 +27,7 @@ class Optimizations(Enum):
     Skipping = 'sp'
     Thresholding = 'th'
     EarlyStopping = 'es'
+    Bitmap = 'bm'
 
 class IndexBase(ABC):
     """
@@ -39,6 +41,7 @@ class IndexBase(ABC):
         """
         assert core in ('ESIndex', 'SelfIndex')
         long = [ IndexInfo[info], DataStore[dstore], Compression[compr], QueryProc[qproc], Optimizations[optim] ]
+        self.info, self.dstore, self.compr, self.qproc, self.optim = long
         short = [k.value for k in long]
         self.identifier_long = "core={}|index={}|datastore={}|compressor={}|qproc={}|optim={}".format(*[core]+long)
         self.identifier_short = "{}_i{}d{}c{}q{}o{}".format(*[core]+short)
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from footprint import approx_sizeof
+from index_base import IndexBase
+from query_trace import query_log
+
+# ----------------------
+# Multi-index residency manager
+# ----------------------
+# One factory (class + storage_path) hosts many indices, e.g. one per news domain. A
+# SelfIndex instance holds a single loaded index, so switching ids means a reload from
+# disk; the manager instead loads every id into an instance of its own on first use and
+# keeps it resident:
+# - footprint: index.memory_footprint() right after the load (footprint.py estimate)
+# - budget: while the resident footprints exceed budget_bytes (or more than max_resident
+#   are open), the least recently used indices are dropped. An id loaded before is
+#   known to need its previous footprint, so room is made before loading it again
+# - concurrent first queries of one id wait for a single load
+# - prefetch(ids) loads on a background thread, ahead of the queries
+# Loads run outside the lock, so concurrent loads of different ids can exceed the budget
+# until they finish. A query running on an evicted instance completes normally; its
+# memory is released when the query drops it.
+
+
+class _Resident:
+    __slots__ = ("index", "bytes", "load_s", "last_used", "hits", "prefetched")
+
+    def __init__(self, index: IndexBase, size: int, load_s: float, prefetched: bool):
+        self.index = index
+        self.bytes = size
+        self.load_s = load_s
+        self.last_used = time.monotonic()
+        self.hits = 0
+        self.prefetched = prefetched # loaded by prefetch() and not queried yet
+
+
+class IndexManager:
+    """
+    Lazily loaded indices of one registry under a memory budget (LRU eviction).
+
+        manager = IndexManager(lambda: SelfIndexCompact(..., storage_path="./by_domain"),
+                               budget_bytes=2 << 30)
+        manager.query("bbc.com", '"flu" AND "vaccine"', top_k=10)
+        manager.prefetch(["cnn.com", "reuters.com"])
+        manager.stats()
+
+    factory: returns a fresh, unloaded index instance (configure caches/tracing there).
+    sizer: index -> bytes; defaults to index.memory_footprint().
+    """
+
+    def __init__(self, factory: Callable[[], IndexBase], budget_bytes: Optional[int] = None,
+                 max_resident: Optional[int] = None, prefetch_workers: int = 1,
+                 sizer: Optional[Callable[[IndexBase], int]] = None):
+        if budget_bytes is not None and budget_bytes <= 0:
+            raise ValueError("budget_bytes must be positive")
+        if max_resident is not None and max_resident <= 0:
+            raise ValueError("max_resident must be positive")
+        self.factory = factory
+        self.budget_bytes = budget_bytes
+        self.max_resident = max_resident
+        self.sizer = sizer or self._footprint
+        self.registry = factory() # never loaded, only lists the indices
+        self._resident: "OrderedDict[str, _Resident]" = OrderedDict() # LRU first
+        self._loading: Dict[str, Future] = {}
+        self._known_bytes: Dict[str, int] = {} # footprint at the last load of each id
+        self._lock = threading.Lock()
+        self._prefetcher = (ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="index-prefetch")
+                            if prefetch_workers > 0 else None)
+        self.resident_bytes = 0
+        self.hits = self.misses = self.coalesced = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = self.evicted_bytes = 0
+        self.prefetches = self.prefetch_hits = self.wasted_prefetches = 0
+        self.oversize = 0
+
+    @staticmethod
+    def _footprint(index: IndexBase) -> int:
+        footprint = getattr(index, "memory_footprint", None)
+        return footprint() if footprint is not None else approx_sizeof(getattr(index, "index_data", None))
+
+    # ----------------------
+    # Access
+    # ----------------------
+    def list_indices(self) -> List[str]:
+        """Every registered index id (re-reads the registry)."""
+        self.registry._load_registry()
+        return list(self.registry.list_indices())
+
+    def get(self, index_id: str) -> IndexBase:
+        """The loaded index for index_id, loading it (and evicting others) if needed."""
+        return self._acquire(index_id, prefetch=False)
+
+    def query(self, index_id: str, query: str, **kwargs) -> str:
+        return self.get(index_id).query(query, **kwargs)
+
+    def prefetch(self, index_ids: Iterable[str]) -> List[Future]:
+        """Load the ids not yet resident on the background thread; futures of their indices."""
+        if self._prefetcher is None:
+            raise RuntimeError("Prefetching is off (prefetch_workers=0)")
+        return [self._prefetcher.submit(self._acquire, index_id, True) for index_id in index_ids]
+
+    def _acquire(self, index_id: str, prefetch: bool) -> IndexBase:
+        with self._lock:
+            entry = self._resident.get(index_id)
+            if entry is not None:
+                if not prefetch:
+                    self._touch(index_id, entry)
+                return entry.index
+            future = self._loading.get(index_id)
+            owner = future is None
+            if owner:
+                future = self._loading[index_id] = Future()
+                if prefetch: self.prefetches += 1
+                else: self.misses += 1
+                # Make room up front when the footprint is known from an earlier load
+                self._enforce_budget(incoming=self._known_bytes.get(index_id, 0))
+        if not owner:
+            future.result() # loading on another thread
+            with self._lock:
+                if not prefetch: self.coalesced += 1
+            return self._acquire(index_id, prefetch)
+
+        try:
+            start = time.perf_counter()
+            index = self.factory()
+            index.load_index(index_id)
+            load_s = time.perf_counter() - start
+            size = self.sizer(index)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[index_id]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[index_id]
+            entry = self._resident[index_id] = _Resident(index, size, load_s, prefetched=prefetch)
+            if not prefetch: entry.hits = 1
+            self._known_bytes[index_id] = size
+            self.resident_bytes += size
+            self.loads += 1
+            self.load_seconds += load_s
+            self._enforce_budget()
+        future.set_result(index)
+        return index
+
+    def _touch(self, index_id: str, entry: _Resident) -> None:
+        self._resident.move_to_end(index_id)
+        entry.last_used = time.monotonic()
+        entry.hits += 1
+        self.hits += 1
+        if entry.prefetched:
+            entry.prefetched = False
+            self.prefetch_hits += 1
+
+    # ----------------------
+    # Eviction
+    # ----------------------
+    def _over_budget(self, incoming: int = 0) -> bool:
+        return ((self.budget_bytes is not None and self.resident_bytes + incoming > self.budget_bytes) or
+                (self.max_resident is not None and len(self._resident) + (incoming > 0) > self.max_resident))
+
+    def _enforce_budget(self, incoming: int = 0) -> None:
+        """Evict LRU entries (lock held). The most recent one stays even if it alone is over budget."""
+        keep = 0 if incoming else 1
+        while self._over_budget(incoming) and len(self._resident) > keep:
+            self._drop(next(iter(self._resident)))
+        if not incoming and self.budget_bytes is not None and self.resident_bytes > self.budget_bytes:
+            index_id, entry = next(reversed(self._resident.items()))
+            self.oversize += 1
+            query_log.warning("Index '%s' alone (%d bytes) exceeds the manager budget of %d bytes",
+                              index_id, entry.bytes, self.budget_bytes)
+
+    def _drop(self, index_id: str) -> _Resident:
+        entry = self._resident.pop(index_id)
+        self.resident_bytes -= entry.bytes
+        self.evictions += 1
+        self.evicted_bytes += entry.bytes
+        if entry.prefetched: self.wasted_prefetches += 1
+        return entry
+
+    def evict(self, index_id: str) -> bool:
+        """Drop index_id now (e.g. after it was updated elsewhere: the next get reloads it)."""
+        with self._lock:
+            if index_id not in self._resident:
+                return False
+            self._drop(index_id)
+            return True
+
+    def resize(self, index_id: str) -> int:
+        """Re-measure a resident index (e.g. after update_index through it) and re-apply the budget."""
+        with self._lock:
+            entry = self._resident.get(index_id)
+            if entry is None:
+                return 0
+        size = self.sizer(entry.index)
+        with self._lock:
+            if self._resident.get(index_id) is entry:
+                self.resident_bytes += size - entry.bytes
+                entry.bytes = self._known_bytes[index_id] = size
+                self._resident.move_to_end(index_id)
+                self._enforce_budget()
+        return size
+
+    # ----------------------
+    # Stats / lifecycle
+    # ----------------------
+    def resident(self) -> List[str]:
+        """Resident index ids, least recently used first."""
+        with self._lock:
+            return list(self._resident)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget_bytes": self.budget_bytes,
+                "max_resident": self.max_resident,
+                "resident_bytes": self.resident_bytes,
+                "resident": [{"index_id": index_id, "bytes": e.bytes, "hits": e.hits, "load_s": round(e.load_s, 4),
+                              "idle_s": round(now - e.last_used, 3), "prefetched": e.prefetched}
+                             for index_id, e in self._resident.items()],
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "loads": self.loads,
+                "load_seconds": round(self.load_seconds, 4),
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "prefetches": self.prefetches,
+                "prefetch_hits": self.prefetch_hits,
+                "wasted_prefetches": self.wasted_prefetches,
+                "oversize": self.oversize,
+                "known_bytes": dict(self._known_bytes),
+            }
+
+    def close(self) -> None:
+        """Stop prefetching and drop every resident index."""
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._resident.clear()
+            self.resident_bytes = 0
+
+    def __enter__(self) -> "IndexManager":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
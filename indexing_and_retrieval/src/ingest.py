@@ -0,0 +1,244 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# ----------------------
+# Streaming news ingestion
+# ----------------------
+# Replaces load_all_news_data -> filter_by_language -> get_indexing_iterable (es.ipynb),
+# which held the whole corpus in a DataFrame (several times over) before indexing the
+# first document:
+#   walk (this process)  -> batches of `batch_files` JSON paths, sorted walk order
+#   parse -> language -> analyze (worker processes, one batch per task)
+#   sink (this process)  -> IndexBase.create_index, or Elasticsearch parallel_bulk
+# At most `max_pending` batches are in flight, so a slow sink stalls the walk instead of
+# letting parsed articles pile up; memory is bounded by max_pending * batch_files.
+# Records come out in walk order whatever the number of workers, so every run over the
+# same folder indexes the same docs in the same order. A uuid seen before is skipped
+# (create_index of the compact indexes rejects duplicate doc ids).
+
+ARTICLE_FIELDS = ("title", "text", "author", "published", "categories", "sentiment")
+STAGES = ("walk", "parse", "language", "analyze", "sink")
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_ingest_worker(lang: Optional[str], analyzer: Optional[Callable[[str], List[str]]]) -> None:
+    detect = None
+    if lang is not None:
+        from langdetect import DetectorFactory, LangDetectException, detect
+        DetectorFactory.seed = 0 # langdetect is randomized; seeded, the same articles pass every run
+        _WORKER["lang_error"] = LangDetectException
+    _WORKER.update(lang=lang, detect=detect, analyzer=analyzer)
+
+
+def _process_batch(paths: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Worker: parsed, language-filtered, analyzed articles of one batch, and stage stats."""
+    stats = {"files": len(paths), "bad_files": 0, "other_lang": 0, "parse_s": 0.0, "language_s": 0.0, "analyze_s": 0.0}
+    start = time.perf_counter()
+    articles = []
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            stats["bad_files"] += 1
+            continue
+        article = {"id": data.get("uuid") or "", **{field: data.get(field) or "" for field in ARTICLE_FIELDS}}
+        article["categories"] = data.get("categories") or []
+        articles.append(article)
+    stats["parse_s"] = time.perf_counter() - start
+
+    if _WORKER.get("detect") is not None:
+        start = time.perf_counter()
+        detect, lang, kept = _WORKER["detect"], _WORKER["lang"], []
+        for article in articles:
+            try:
+                if detect(article["text"]) == lang: kept.append(article)
+            except _WORKER["lang_error"]: # empty or undecidable text
+                pass
+        stats["other_lang"] = len(articles) - len(kept)
+        articles = kept
+        stats["language_s"] = time.perf_counter() - start
+
+    analyzer = _WORKER.get("analyzer")
+    if analyzer is not None:
+        start = time.perf_counter()
+        for article in articles:
+            article["clean_text"] = " ".join(analyzer(article["title"] + " " + article["text"]))
+        stats["analyze_s"] = time.perf_counter() - start
+    return articles, stats
+
+
+class IngestStats:
+    """Docs and busy seconds per stage; worker stages add up the time of every worker."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.files = self.bad_files = self.other_lang = self.duplicates = self.docs = 0
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.started = time.perf_counter()
+        self.wall_s = 0.0
+
+    def add_batch(self, batch: Dict[str, Any], docs: int) -> None:
+        self.files += batch["files"]
+        self.bad_files += batch["bad_files"]
+        self.other_lang += batch["other_lang"]
+        for stage in ("parse", "language", "analyze"):
+            self.seconds[stage] += batch[f"{stage}_s"]
+        self.docs += docs
+
+    def to_dict(self) -> Dict[str, Any]:
+        docs_in = {"walk": self.files, "parse": self.files, "language": self.files - self.bad_files,
+                   "analyze": self.files - self.bad_files - self.other_lang, "sink": self.docs}
+        wall = self.wall_s or time.perf_counter() - self.started
+        return {
+            "workers": self.workers,
+            "files": self.files,
+            "bad_files": self.bad_files,
+            "other_lang": self.other_lang,
+            "duplicates": self.duplicates,
+            "docs": self.docs,
+            "wall_s": round(wall, 3),
+            "docs_per_s": round(self.docs / wall, 1) if wall else 0.0,
+            "stages": {stage: {"docs": docs_in[stage], "busy_s": round(self.seconds[stage], 3),
+                               "docs_per_s": round(docs_in[stage] / self.seconds[stage], 1) if self.seconds[stage] else None}
+                       for stage in STAGES},
+        }
+
+    def describe(self) -> str:
+        d = self.to_dict()
+        stages = "  ".join(f"{stage} {s['docs_per_s'] or '-'}/s" for stage, s in d["stages"].items())
+        return (f"{d['docs']} docs from {d['files']} files in {d['wall_s']:.1f} s ({d['docs_per_s']} docs/s; "
+                f"{d['bad_files']} bad, {d['other_lang']} other language, {d['duplicates']} duplicates)\n"
+                f"  per stage (docs per busy second): {stages}")
+
+
+class NewsIngest:
+    """
+    Streaming, parallel reader of the news JSON folder (see above).
+
+        ingest = NewsIngest("../data/news/", workers=8, lang="en", analyzer=Analyzer(STOP_WORDS, STEMMER))
+        ingest.index_into(index, "news")           # (uuid, title + " " + text) into create_index
+        ingest.bulk_into_es(es, "esindex-v1-0")    # or into Elasticsearch, with clean_text
+        print(ingest.stats.describe())
+
+    lang: keep articles whose text langdetect classifies as lang (None: keep all).
+    analyzer: preprocess_text or a picklable equivalent (text_analysis.Analyzer); adds
+    clean_text = " ".join(analyzer(title + " " + text)). None: no clean_text.
+    workers <= 1 processes the batches in this process.
+    Every iteration re-reads the folder and starts new stats.
+    """
+
+    def __init__(self, base_folder: str, workers: Optional[int] = None, batch_files: int = 64,
+                 lang: Optional[str] = "en", analyzer: Optional[Callable[[str], List[str]]] = None,
+                 max_pending: Optional[int] = None, log: Optional[Callable[[str], None]] = print):
+        self.base_folder = base_folder
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.batch_files = batch_files
+        self.lang = lang
+        self.analyzer = analyzer
+        self.max_pending = max_pending or 2 * max(1, self.workers)
+        self.log = log
+        self.stats = IngestStats(self.workers)
+
+    def _file_batches(self) -> Iterator[List[str]]:
+        batch: List[str] = []
+        for dirpath, dirnames, filenames in os.walk(self.base_folder):
+            dirnames.sort()
+            for file_name in sorted(filenames):
+                if file_name.endswith(".json"):
+                    batch.append(os.path.join(dirpath, file_name))
+                    if len(batch) >= self.batch_files:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def _batches(self) -> Iterator[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """(articles, stats) per batch in walk order, at most max_pending batches ahead."""
+        stats = self.stats
+        walk = self._file_batches()
+
+        def next_paths() -> Optional[List[str]]:
+            start = time.perf_counter()
+            paths = next(walk, None)
+            stats.seconds["walk"] += time.perf_counter() - start
+            return paths
+
+        if self.workers <= 1:
+            _init_ingest_worker(self.lang, self.analyzer)
+            while (paths := next_paths()) is not None:
+                yield _process_batch(paths)
+            return
+        with ProcessPoolExecutor(self.workers, initializer=_init_ingest_worker,
+                                 initargs=(self.lang, self.analyzer)) as pool:
+            pending: Deque = deque()
+            while True:
+                while len(pending) < self.max_pending and (paths := next_paths()) is not None:
+                    pending.append(pool.submit(_process_batch, paths))
+                if not pending:
+                    return
+                yield pending.popleft().result()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Article dicts (id, title, text, author, published, categories, sentiment[, clean_text])."""
+        stats = self.stats = IngestStats(self.workers)
+        seen = set()
+        for articles, batch in self._batches():
+            fresh = 0
+            for article in articles:
+                if not article["id"] or article["id"] in seen:
+                    stats.duplicates += 1
+                    continue
+                seen.add(article["id"])
+                fresh += 1
+                start = time.perf_counter()
+                yield article
+                stats.seconds["sink"] += time.perf_counter() - start # consumer time: the sink stage
+            stats.add_batch(batch, fresh)
+        stats.wall_s = time.perf_counter() - stats.started
+        if self.log: self.log(f"[ingest] {stats.describe()}")
+
+    def documents(self, field: str = "content") -> Iterator[Tuple[str, str]]:
+        """
+        (doc_id, text) pairs for IndexBase.create_index. field "content" is title + " " +
+        text (get_indexing_iterable); "clean_text" the analyzed text (needs an analyzer).
+        """
+        if field == "clean_text" and self.analyzer is None:
+            raise ValueError("clean_text needs an analyzer")
+        for article in self:
+            yield article["id"], (article["title"] + " " + article["text"] if field == "content" else article[field])
+
+    # ----------------------
+    # Sinks
+    # ----------------------
+    def index_into(self, index, index_id: str, field: str = "content", **create_kwargs) -> Dict[str, Any]:
+        """Stream the articles into index.create_index(index_id, ...); returns the stats."""
+        index.create_index(index_id, self.documents(field), **create_kwargs)
+        return self.stats.to_dict()
+
+    def bulk_into_es(self, es, index_name: str, thread_count: int = 4, chunk_size: int = 500,
+                     raise_on_error: bool = False) -> Tuple[int, List[Any]]:
+        """
+        Stream the articles into Elasticsearch with helpers.parallel_bulk (the es.ipynb
+        document layout). Returns (indexed count, errors).
+        """
+        from elasticsearch import helpers
+
+        def actions() -> Iterator[Dict[str, Any]]:
+            for article in self:
+                source = {"id": article["id"], **{field: article[field] for field in ARTICLE_FIELDS}}
+                source["published"] = article["published"] or None # "" is not a valid date
+                if "clean_text" in article: source["clean_text"] = article["clean_text"]
+                yield {"_index": index_name, "_id": article["id"], "_source": source}
+
+        indexed, errors = 0, []
+        for ok, info in helpers.parallel_bulk(es, actions(), thread_count=thread_count, chunk_size=chunk_size,
+                                              raise_on_error=raise_on_error):
+            if ok: indexed += 1
+            else: errors.append(info)
+        return indexed, errors
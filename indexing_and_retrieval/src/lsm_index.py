@@ -0,0 +1,617 @@
+import json
+import math
+import os
+import pickle
+import shutil
+import struct
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, Tuple, Dict, Any, List, Set, Optional, Iterator
+
+from compact_index import CompactPostings, CompactPostingsBuilder
+from segment_store import Segment, SelfIndexSegment, write_segment
+
+# ----------------------
+# On-disk layout of one LSM index ({storage_path}/{index_id}.lsm/)
+# ----------------------
+# manifest.json          segment list + generation; rewriting it is the commit point
+# seg_000001.seg         immutable segment (segment_store format): base or delta
+# seg_000001.fwd         forward index of that segment: doc -> term ids
+# seg_000001.<gen>.del   tombstones of that segment as of generation <gen> (pickle)
+# Files are only ever added, then referenced by a new manifest, so a crash mid-update
+# leaves the previous generation intact.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+FORWARD_MAGIC = b"SIXFWD\x00\x00"
+FORWARD_HEADER = struct.Struct("<8sQQ")
+
+
+def build_forward_index(postings: CompactPostings) -> Tuple[array, array]:
+    """
+    Transpose postings into a doc -> term ids table (CSR):
+    the term ids of internal doc d are doc_terms[doc_offsets[d]:doc_offsets[d+1]].
+    """
+    n_docs = len(postings.doc_ids)
+    post_docs, term_offsets = postings.post_docs, postings.term_offsets
+
+    doc_offsets = array("Q", [0]) * (n_docs + 1)
+    for d in post_docs:
+        doc_offsets[d + 1] += 1
+    for d in range(n_docs):
+        doc_offsets[d + 1] += doc_offsets[d]
+
+    doc_terms = array("I", [0]) * len(post_docs)
+    fill = array("Q", doc_offsets[:-1]) if n_docs else array("Q")
+    for tid in range(len(postings.terms)):
+        for p in range(term_offsets[tid], term_offsets[tid + 1]):
+            d = post_docs[p]
+            doc_terms[fill[d]] = tid
+            fill[d] += 1
+    return doc_offsets, doc_terms
+
+
+def write_forward_index(path: Path, postings: CompactPostings) -> None:
+    doc_offsets, doc_terms = build_forward_index(postings)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(FORWARD_HEADER.pack(FORWARD_MAGIC, len(doc_offsets) - 1, len(doc_terms)))
+        doc_offsets.tofile(f)
+        doc_terms.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def read_forward_index(path: Path) -> Tuple[array, array]:
+    with open(path, "rb") as f:
+        magic, n_docs, n_entries = FORWARD_HEADER.unpack(f.read(FORWARD_HEADER.size))
+        if magic != FORWARD_MAGIC:
+            raise ValueError(f"Not a forward index file: {path}")
+        doc_offsets, doc_terms = array("Q"), array("I")
+        doc_offsets.fromfile(f, n_docs + 1)
+        doc_terms.fromfile(f, n_entries)
+    return doc_offsets, doc_terms
+
+
+class LSMSegment:
+    """
+    One immutable segment plus its mutable delete state:
+    - bitmap: bit d set = internal doc d is deleted (queries skip it)
+    - del_df: {term_id: deleted docs containing the term}, so the live df of a term is
+      its postings slice length minus del_df, without rewriting the postings
+    The forward index is read on the first delete only.
+    """
+
+    def __init__(self, directory: Path, name: str, tombstone_file: Optional[str] = None):
+        self.directory = Path(directory)
+        self.name = name
+        segment = Segment(self.directory / f"{name}.seg")
+        data = segment.to_index_data()
+        self.postings: CompactPostings = data["inverted_index"]
+        self._original = segment.strings("original")
+        self._clean = segment.strings("clean")
+
+        self.bitmap = bytearray((len(self.postings.doc_ids) + 7) // 8)
+        self.deleted = 0
+        self.del_df: Dict[int, int] = {}
+        self.tombstone_file = tombstone_file
+        if tombstone_file:
+            with open(self.directory / tombstone_file, "rb") as f:
+                state = pickle.load(f)
+            self.bitmap = bytearray(state["bitmap"])
+            self.deleted = state["deleted"]
+            self.del_df = state["del_df"]
+        self._forward: Optional[Tuple[array, array]] = None
+
+    @property
+    def doc_ids(self) -> List[str]:
+        return self.postings.doc_ids
+
+    @property
+    def live_count(self) -> int:
+        return len(self.postings.doc_ids) - self.deleted
+
+    def is_deleted(self, docnum: int) -> bool:
+        return bool(self.bitmap[docnum >> 3] & (1 << (docnum & 7)))
+
+    def live_docnums(self) -> Iterator[int]:
+        for d in range(len(self.postings.doc_ids)):
+            if not self.is_deleted(d):
+                yield d
+
+    def doc(self, docnum: int) -> Dict[str, str]:
+        return {'original': self._original[docnum], 'clean': self._clean[docnum]}
+
+    def doc_freq(self, term: str) -> int:
+        """Number of live docs in this segment containing term."""
+        tid = self.postings.term_ids.get(term)
+        if tid is None:
+            return 0
+        offsets = self.postings.term_offsets
+        return offsets[tid + 1] - offsets[tid] - self.del_df.get(tid, 0)
+
+    def live_postings(self, term: str) -> Iterator[Tuple[int, int]]:
+        """(internal_doc_id, tf) of live docs only."""
+        if not self.deleted:
+            return self.postings.postings(term)
+        return ((d, tf) for d, tf in self.postings.postings(term) if not self.is_deleted(d))
+
+    def term_ids_of(self, docnum: int) -> memoryview:
+        if self._forward is None:
+            self._forward = read_forward_index(self.directory / f"{self.name}.fwd")
+        doc_offsets, doc_terms = self._forward
+        return memoryview(doc_terms)[doc_offsets[docnum]:doc_offsets[docnum + 1]]
+
+    def delete(self, docnum: int) -> List[str]:
+        """Tombstone internal doc docnum. Returns its terms (empty if already deleted)."""
+        if self.is_deleted(docnum):
+            return []
+        self.bitmap[docnum >> 3] |= 1 << (docnum & 7)
+        self.deleted += 1
+        terms = self.postings.terms
+        out = []
+        for tid in self.term_ids_of(docnum):
+            self.del_df[tid] = self.del_df.get(tid, 0) + 1
+            out.append(terms[tid])
+        return out
+
+    def save_tombstones(self, generation: int) -> None:
+        self.tombstone_file = f"{self.name}.{generation}.del"
+        tmp_path = self.directory / (self.tombstone_file + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"bitmap": bytes(self.bitmap), "deleted": self.deleted, "del_df": self.del_df},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.directory / self.tombstone_file)
+
+
+class LSMDocTable(Mapping):
+    """
+    Read-only {doc_id: {'original':..., 'clean':...}} view over the live docs of all
+    segments; `locations` maps doc_id -> (segment, internal doc id).
+    """
+
+    def __init__(self, locations: Dict[str, Tuple[LSMSegment, int]]):
+        self.locations = locations
+
+    def __getitem__(self, doc_id: str) -> Dict[str, str]:
+        segment, docnum = self.locations[doc_id]
+        return segment.doc(docnum)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self.locations
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.locations)
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+
+class SelfIndexLSM(SelfIndexSegment):
+    """
+    Segment-backed TF-IDF index with an LSM-style update path.
+    - create_index writes one base segment; every update_index batch adds at most one
+      small delta segment and tombstones removed/replaced docs in a per-segment delete
+      bitmap (found through the forward index, so no vocabulary scan)
+    - df and N are kept consistent: df = sum over segments of (slice length - deleted),
+      N = live docs; both are exact after every update
+    - when there are more than max_segments segments (or deleted docs exceed
+      max_deleted_ratio) all segments are merged into one by a background thread;
+      updates and queries continue meanwhile and deletes made during the merge are
+      carried over when it commits
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_lsm", max_segments: int = 8,
+                 max_deleted_ratio: float = 0.3, background_compaction: bool = True):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.background_compaction = background_compaction
+
+        self._lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._loaded_id: Optional[str] = None
+
+    # ----------------------
+    # Storage helpers
+    # ----------------------
+    def _get_index_filepath(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.lsm"
+
+    def _read_manifest(self, index_id: str) -> Dict[str, Any]:
+        path = self._get_index_filepath(index_id) / MANIFEST_NAME
+        if not path.exists():
+            raise FileNotFoundError(f"Index manifest not found: {path}")
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported LSM manifest version {manifest.get('version')}: {path}")
+        return manifest
+
+    def _write_manifest(self, index_id: str) -> None:
+        data = self.index_data
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "generation": data["generation"],
+            "next_segment": data["next_segment"],
+            "doc_count": data["doc_count"],
+            "terms_count": data["terms_count"],
+            "segments": [{"name": s.name, "tombstones": s.tombstone_file} for s in data["segments"]],
+        }
+        directory = self._get_index_filepath(index_id)
+        tmp_path = directory / (MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, directory / MANIFEST_NAME)
+        # Every create/update/compaction commits through here: new query cache generation
+        self._invalidate_query_cache()
+
+    def _new_segment_name(self) -> str:
+        name = f"seg_{self.index_data['next_segment']:06d}"
+        self.index_data["next_segment"] += 1
+        return name
+
+    def _write_new_segment(self, directory: Path, name: str, postings: CompactPostings, docs: Mapping) -> LSMSegment:
+        write_segment(directory / f"{name}.seg", postings, docs)
+        write_forward_index(directory / f"{name}.fwd", postings)
+        return LSMSegment(directory, name)
+
+    @staticmethod
+    def _locate(segments: List[LSMSegment]) -> Dict[str, Tuple[LSMSegment, int]]:
+        """doc_id -> (segment, internal doc id) for live docs, oldest segment first."""
+        locations: Dict[str, Tuple[LSMSegment, int]] = {}
+        for segment in segments:
+            doc_ids = segment.doc_ids
+            for d in segment.live_docnums():
+                locations[doc_ids[d]] = (segment, d)
+        return locations
+
+    def _set_segments(self, segments: List[LSMSegment]) -> None:
+        self.index_data["segments"] = segments
+        self.index_data["docs"] = LSMDocTable(self._locate(segments))
+
+    @staticmethod
+    def _remove_files(directory: Path, names: Iterable[str]) -> None:
+        for name in names:
+            try:
+                (directory / name).unlink()
+            except OSError:
+                pass # e.g. still mapped on Windows; the file is no longer referenced anyway
+
+    def _load_index_from_file(self, index_id: str):
+        self.wait_for_compaction()
+        with self._lock:
+            manifest = self._read_manifest(index_id)
+            directory = self._get_index_filepath(index_id)
+            segments = [LSMSegment(directory, s["name"], s["tombstones"]) for s in manifest["segments"]]
+            self.index_data = {
+                "generation": manifest["generation"],
+                "next_segment": manifest["next_segment"],
+                "doc_count": manifest["doc_count"],
+                "terms_count": manifest["terms_count"],
+            }
+            self._set_segments(segments)
+            self._set_loaded(index_id)
+
+    def _ensure_loaded(self, index_id: str) -> None:
+        # Must be called without holding _lock: loading waits for a running compaction
+        if self._loaded_id != index_id or not self.index_data:
+            self._load_index_from_file(index_id)
+
+    # ----------------------
+    # Create / update
+    # ----------------------
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """Builds the base segment (generation 0) of a new LSM index."""
+        print(f"[{self.identifier_short}] Creating LSM index: {index_id}")
+        self.wait_for_compaction()
+
+        builder = CompactPostingsBuilder()
+        docs: Dict[str, Dict[str, str]] = {}
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            if doc_id in docs:
+                raise ValueError(f"Duplicate doc_id '{doc_id}'")
+
+            tokens = self.preprocess_fn(content)
+            docs[doc_id] = {'original': content, 'clean': " ".join(tokens)}
+            builder.add_document(doc_id, tokens)
+        postings = builder.build()
+
+        with self._lock:
+            directory = self._get_index_filepath(index_id)
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir(parents=True)
+            self.index_data = {"generation": 0, "next_segment": 1,
+                               "doc_count": len(docs), "terms_count": len(postings)}
+            base = self._write_new_segment(directory, self._new_segment_name(), postings, docs)
+            self._set_segments([base])
+            self._write_manifest(index_id)
+            self._loaded_id = index_id
+
+        self.indices.add(index_id)
+        self._save_registry()
+        print(f"[{self.identifier_short}] LSM index '{index_id}' created: {len(docs)} docs, {len(postings)} terms.")
+        print(f"[{self.identifier_short}] Saved to {directory}")
+
+    def _live_doc_freq(self, term: str, segments: Optional[List[LSMSegment]] = None) -> int:
+        segments = self.index_data["segments"] if segments is None else segments
+        return sum(segment.doc_freq(term) for segment in segments)
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Remove docs, then add docs, in time proportional to the batch:
+        - removed (and re-added) docs are tombstoned in the segment holding them; their
+          terms come from the forward index and only those terms' df are adjusted
+        - added docs go into one new delta segment
+        - changed tombstone files and the manifest are written under a new generation
+        May start a background compaction (see compact).
+        """
+        print(f"[{self.identifier_short}] Updating LSM index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids.update(additions)
+
+        # Analysis is the slow part and needs no lock
+        builder = CompactPostingsBuilder()
+        new_docs: Dict[str, Dict[str, str]] = {}
+        for doc_id, content in additions.items():
+            tokens = self.preprocess_fn(content)
+            new_docs[doc_id] = {'original': content, 'clean': " ".join(tokens)}
+            builder.add_document(doc_id, tokens)
+
+        self._ensure_loaded(index_id)
+        with self._lock:
+            data = self.index_data
+            directory = self._get_index_filepath(index_id)
+            locations = data["docs"].locations
+            segments = list(data["segments"])
+
+            # ---------- removals ----------
+            dirty: Dict[str, LSMSegment] = {}
+            removed = 0
+            for doc_id in remove_ids:
+                location = locations.pop(doc_id, None)
+                if location is None:
+                    continue
+                segment, docnum = location
+                for term in segment.delete(docnum):
+                    if self._live_doc_freq(term, segments) == 0:
+                        data["terms_count"] -= 1
+                dirty[segment.name] = segment
+                removed += 1
+
+            # ---------- additions (one delta segment) ----------
+            if new_docs:
+                postings = builder.build()
+                data["terms_count"] += sum(1 for term in postings.terms if self._live_doc_freq(term, segments) == 0)
+                delta = self._write_new_segment(directory, self._new_segment_name(), postings, new_docs)
+                segments.append(delta)
+                for docnum, doc_id in enumerate(delta.doc_ids):
+                    locations[doc_id] = (delta, docnum)
+
+            # ---------- commit ----------
+            data["generation"] += 1
+            stale = [s.tombstone_file for s in dirty.values() if s.tombstone_file]
+            for segment in dirty.values():
+                segment.save_tombstones(data["generation"])
+            data["segments"] = segments
+            data["doc_count"] = len(locations)
+            self._write_manifest(index_id)
+            self._remove_files(directory, stale)
+
+        print(f"[{self.identifier_short}] Update complete: -{removed} / +{len(new_docs)} docs, "
+              f"{len(segments)} segments. docs={data['doc_count']}, terms={data['terms_count']}")
+
+        if self._needs_compaction():
+            self.compact(index_id, wait=not self.background_compaction)
+
+    # ----------------------
+    # Compaction
+    # ----------------------
+    def _needs_compaction(self) -> bool:
+        segments = self.index_data.get("segments", [])
+        total = sum(len(s.doc_ids) for s in segments)
+        deleted = sum(s.deleted for s in segments)
+        return len(segments) > self.max_segments or (total > 0 and deleted / total > self.max_deleted_ratio)
+
+    def compact(self, index_id: str, wait: bool = True) -> None:
+        """
+        Merge all current segments into one, dropping deleted docs.
+        wait=False runs the merge in a background thread (at most one at a time).
+        """
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            if wait:
+                self.wait_for_compaction()
+            return
+        self._ensure_loaded(index_id)
+        if wait:
+            self._compact(index_id)
+            return
+        self._compaction_thread = threading.Thread(target=self._compact_in_background, args=(index_id,),
+                                                   name=f"lsm-compact-{index_id}", daemon=True)
+        self._compaction_thread.start()
+
+    def wait_for_compaction(self) -> None:
+        thread = self._compaction_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+            self._compaction_thread = None
+
+    def _compact_in_background(self, index_id: str) -> None:
+        try:
+            self._compact(index_id)
+        except Exception as e:
+            print(f"[{self.identifier_short}] Background compaction of '{index_id}' failed: {e}")
+
+    def _compact(self, index_id: str) -> None:
+        start = time.perf_counter()
+        directory = self._get_index_filepath(index_id)
+
+        # 1. Snapshot the segment list and delete bitmaps
+        with self._lock:
+            snapshot = list(self.index_data["segments"])
+            if len(snapshot) <= 1 and not any(s.deleted for s in snapshot):
+                return
+            bitmaps = {s.name: bytes(s.bitmap) for s in snapshot}
+            name = self._new_segment_name()
+
+        # 2. Merge live docs (no lock: updates and queries go on)
+        builder = CompactPostingsBuilder()
+        merged_locations: Dict[str, Tuple[LSMSegment, int]] = {}
+        for segment in snapshot:
+            bitmap = bitmaps[segment.name]
+            live = [d for d in range(len(segment.doc_ids)) if not bitmap[d >> 3] & (1 << (d & 7))]
+            for d in live:
+                merged_locations[segment.doc_ids[d]] = (segment, d)
+            builder.add_existing(segment.postings, {segment.doc_ids[d] for d in live})
+        merged = self._write_new_segment(directory, name, builder.build(), LSMDocTable(merged_locations))
+
+        # 3. Commit: carry over deletes made during the merge, swap segments
+        with self._lock:
+            if self._loaded_id != index_id:
+                raise RuntimeError(f"Index '{index_id}' was unloaded during compaction.")
+            for segment in snapshot:
+                before = bitmaps[segment.name]
+                for i, byte in enumerate(segment.bitmap):
+                    newly = byte & ~before[i]
+                    while newly:
+                        bit = newly & -newly
+                        doc_id = segment.doc_ids[i * 8 + bit.bit_length() - 1]
+                        merged.delete(merged.postings.doc_index[doc_id])
+                        newly ^= bit
+
+            data = self.index_data
+            data["generation"] += 1
+            if merged.deleted:
+                merged.save_tombstones(data["generation"])
+            current = data["segments"]
+            self._set_segments([merged] + current[len(snapshot):])
+            self._write_manifest(index_id)
+
+            obsolete = []
+            for segment in snapshot:
+                obsolete += [f"{segment.name}.seg", f"{segment.name}.fwd"]
+                if segment.tombstone_file:
+                    obsolete.append(segment.tombstone_file)
+            self._remove_files(directory, obsolete)
+
+        print(f"[{self.identifier_short}] Compacted {len(snapshot)} segments of '{index_id}' into {name} "
+              f"({len(merged.doc_ids)} docs) in {time.perf_counter() - start:.2f}s.")
+
+    # ----------------------
+    # Other methods
+    # ----------------------
+    def delete_index(self, index_id: str) -> None:
+        """Delete the index directory and remove it from the registry."""
+        self.wait_for_compaction()
+        path = self._get_index_filepath(index_id)
+        if path.exists():
+            with self._lock:
+                shutil.rmtree(path)
+                self.indices.discard(index_id)
+                self._save_registry()
+                if self._loaded_id == index_id:
+                    self.index_data = {}
+                    self._set_loaded(None)
+            print(f"[{self.identifier_short}] Deleted index '{index_id}'.")
+        else:
+            print(f"[{self.identifier_short}] Index directory not found for '{index_id}'.")
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        if index_id not in self.indices and not self._get_index_filepath(index_id).exists():
+            raise FileNotFoundError(f"Index '{index_id}' not found.")
+        self._ensure_loaded(index_id)
+        return sorted(self.index_data["docs"])
+
+    # ----------------------
+    # Lookup helpers (every segment, tombstones skipped)
+    # ----------------------
+    def _vocabulary(self) -> Iterable[str]:
+        """Terms of every segment (a term whose docs are all deleted has df 0 and is folded by the planner)."""
+        return {term for segment in self._segments() for term in segment.postings.terms}
+
+    def _segments(self) -> List[LSMSegment]:
+        if not self.index_data:
+            raise RuntimeError("No index loaded. Call load_index(index_id) first.")
+        return self.index_data["segments"]
+
+    def _scoring_segments(self):
+        for segment in self._segments():
+            yield segment.postings, (segment.is_deleted if segment.deleted else None)
+
+    def _doc_freq(self, term: str) -> int:
+        return self._live_doc_freq(term, self._segments())
+
+    def _calculate_idf(self, term: str) -> float:
+        """IDF with df summed over the live docs of all segments."""
+        N = self.index_data.get('doc_count', 0) if self.index_data else 0
+        df = self._live_doc_freq(term, self._segments())
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _get_postings_set(self, term: str) -> Set[str]:
+        return set(self._get_term_postings_with_counts(term))
+
+    def _get_term_postings_with_counts(self, term: str) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for segment in self._segments():
+            doc_ids = segment.doc_ids
+            for d, tf in segment.live_postings(term):
+                out[doc_ids[d]] = tf
+        return out
+
+    def _get_phrase_postings_with_counts(self, term: str) -> Dict[str, int]:
+        phrase_tokens = term.split(" ")
+        out: Dict[str, int] = {}
+        for segment in self._segments():
+            doc_ids = segment.doc_ids
+            for d, count in segment.postings.phrase_matches(phrase_tokens).items():
+                if not segment.is_deleted(d):
+                    out[doc_ids[d]] = count
+        return out
+
+    def _eval_term_to_set(self, term: str) -> Set[str]:
+        if " " not in term:
+            return self._get_postings_set(term)
+        return set(self._get_phrase_postings_with_counts(term))
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates a single term or phrase, returning {doc_id: tfidf_score}."""
+        final_scores: Dict[str, float] = {}
+
+        if " " not in operand: # Single term
+            idf = self._calculate_idf(operand)
+            if idf == 0: return {}
+            for doc_id, tf in self._get_term_postings_with_counts(operand).items():
+                final_scores[doc_id] = tf * idf
+
+        else: # Phrase: sum of TF-IDF of the phrase terms in each matching doc
+            phrase_tokens = operand.split(" ")
+            term_idfs = None
+            for segment in self._segments():
+                postings = segment.postings
+                matches = postings.phrase_matches(phrase_tokens)
+                if not matches: continue
+                if term_idfs is None:
+                    term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+                for docnum in matches:
+                    if segment.is_deleted(docnum): continue
+                    doc_score = 0.0
+                    for term in phrase_tokens:
+                        p = postings.find_posting(term, docnum)
+                        if p is not None:
+                            doc_score += postings.post_tfs[p] * term_idfs[term]
+                    final_scores[postings.doc_ids[docnum]] = doc_score
+
+        return final_scores
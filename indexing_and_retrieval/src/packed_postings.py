@@ -0,0 +1,101 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, Hashable, Iterator, List, Set, Tuple
+
+from phrase_match import phrase_count
+from query_trace import count
+
+# ----------------------
+# Packed binary postings (datastores, y=2)
+# ----------------------
+# n postings of one term packed as uint32 arrays (native byte order):
+#   docs[n] | tfs[n] | positions[sum(tfs)]
+# docs are internal doc numbers, ascending. The SQLite and Redis layouts store these
+# blobs as values, so a term is fetched and decoded with one read and no JSON.
+
+Packed = Tuple[array, array, array]
+
+
+def pack_postings(docs: array, tfs: array, positions: array) -> bytes:
+    return docs.tobytes() + tfs.tobytes() + positions.tobytes()
+
+
+def unpack_postings(n: int, data: bytes) -> Packed:
+    count("postings_decoded", n)
+    count("bytes_decoded", len(data))
+    docs, tfs, positions = array('I'), array('I'), array('I')
+    docs.frombytes(data[:4 * n])
+    tfs.frombytes(data[4 * n:8 * n])
+    positions.frombytes(data[8 * n:])
+    return docs, tfs, positions
+
+
+def drop_docs(docs: array, tfs: array, positions: array, removed: Set[int]) -> Packed:
+    """The postings without the docs in `removed`."""
+    offsets = list(accumulate(tfs, initial=0))
+    keep = [i for i, d in enumerate(docs) if d not in removed]
+    kept_positions = array('I')
+    for i in keep:
+        kept_positions.extend(positions[offsets[i]:offsets[i + 1]])
+    return array('I', (docs[i] for i in keep)), array('I', (tfs[i] for i in keep)), kept_positions
+
+
+class PostingsBuilder:
+    """In-memory postings of a batch of documents, keyed by term (text or id)."""
+
+    def __init__(self):
+        self.postings: Dict[Hashable, Packed] = {}
+        self.num_docs = 0
+
+    def add(self, doc_num: int, term_positions: Dict[Hashable, List[int]]) -> None:
+        self.num_docs += 1
+        for term, positions in term_positions.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array('I'), array('I'), array('I'))
+            entry[0].append(doc_num)
+            entry[1].append(len(positions))
+            entry[2].extend(positions)
+
+    def items(self) -> Iterator[Tuple[Hashable, Packed]]:
+        return iter(self.postings.items())
+
+
+class TermBlob:
+    """The decoded postings of one term: docs, tfs and the positions of posting i."""
+    __slots__ = ("df", "docs", "tfs", "positions", "_offsets")
+
+    def __init__(self, df: int, docs: array, tfs: array, positions: array):
+        self.df, self.docs, self.tfs, self.positions = df, docs, tfs, positions
+        self._offsets = None
+
+    def find(self, doc_num: int) -> int:
+        """Index of doc_num in docs, -1 if absent."""
+        i = bisect_left(self.docs, doc_num)
+        return i if i < len(self.docs) and self.docs[i] == doc_num else -1
+
+    def positions_at(self, i: int) -> List[int]:
+        if self._offsets is None:
+            self._offsets = array('I', accumulate(self.tfs, initial=0))
+        return self.positions[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+
+def phrase_scores(blobs: Dict[str, TermBlob], phrase_tokens: List[str],
+                  idfs: Dict[str, float]) -> Dict[int, float]:
+    """
+    {doc_num: score} of the docs holding the phrase: the rarest word's docs are walked,
+    the others probed by binary search. Score = sum of tf * idf of the words, in phrase order.
+    """
+    driver = min(blobs.values(), key=lambda b: len(b.docs))
+    scores = {}
+    for doc_num in driver.docs:
+        found = [blobs[term].find(doc_num) for term in phrase_tokens]
+        if -1 in found: continue
+        pos_lists = [blobs[term].positions_at(i) for term, i in zip(phrase_tokens, found)]
+        if not phrase_count(pos_lists, first_only=True): continue
+        doc_score = 0.0
+        for term, i in zip(phrase_tokens, found):
+            doc_score += blobs[term].tfs[i] * idfs[term]
+        scores[doc_num] = doc_score
+    return scores
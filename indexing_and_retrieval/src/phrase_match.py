@@ -0,0 +1,87 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# ----------------------
+# Positional phrase matching
+# ----------------------
+# A phrase t0 t1 ... tk occurs at p when p + i is a position of ti for every i, i.e. p is
+# in the intersection of the shifted position lists {q - i : q in pos(ti)}. The lists are
+# sorted, so the intersection is a merge driven by the shortest list: every other list
+# keeps a cursor that only moves forward, by binary search from the cursor (bisect, in C),
+# so a rare word skips over a frequent one in O(log n) steps. No per-document sets are
+# built, and a list running out ends the search.
+
+
+def phrase_count(pos_lists: Sequence[Sequence[int]], first_only: bool = False) -> int:
+    """
+    Number of occurrences of the phrase given the sorted position lists of its words
+    in one document (pos_lists[i] for word i). first_only: stop at the first one (0/1).
+    """
+    k = len(pos_lists)
+    if k == 0:
+        return 0
+    driver = min(range(k), key=lambda i: len(pos_lists[i]))
+    # (offset from the driver word, positions, length) of every other word
+    others = [(i - driver, positions, len(positions)) for i, positions in enumerate(pos_lists) if i != driver]
+    cursors = [0] * len(others)
+    count = 0
+    for p in pos_lists[driver]:
+        for c, (offset, positions, n) in enumerate(others):
+            target = p + offset
+            j = cursors[c] = bisect_left(positions, target, cursors[c])
+            if j == n:
+                return count # later starts are larger still
+            if positions[j] != target:
+                break
+        else:
+            count += 1
+            if first_only:
+                return count
+    return count
+
+
+# ----------------------
+# Next-word (biword) index
+# ----------------------
+# For every "frequent" first word (df >= min_df), the docs and counts of each word pair
+# "first second" it starts, so a common two-word phrase is one dictionary lookup instead
+# of a positional merge over two long posting lists.
+
+class NextWordIndex:
+    """{"first second": (internal doc ids, counts)} for first words with df >= min_df."""
+
+    def __init__(self, min_df: int, pairs: Dict[str, Tuple[array, array]]):
+        self.min_df = min_df
+        self.pairs = pairs
+        self.first_words = {pair.split(" ", 1)[0] for pair in pairs}
+
+    @classmethod
+    def build(cls, docs_tokens: Iterable[Sequence[str]], doc_freq, min_df: int) -> "NextWordIndex":
+        """docs_tokens: token lists in internal doc id order; doc_freq(term) -> df."""
+        frequent: Dict[str, bool] = {}
+        counts: Dict[str, Dict[int, int]] = defaultdict(dict)
+        for docnum, tokens in enumerate(docs_tokens):
+            for first, second in zip(tokens, tokens[1:]):
+                is_frequent = frequent.get(first)
+                if is_frequent is None:
+                    is_frequent = frequent[first] = doc_freq(first) >= min_df
+                if is_frequent:
+                    doc_counts = counts[f"{first} {second}"]
+                    doc_counts[docnum] = doc_counts.get(docnum, 0) + 1
+        pairs = {pair: (array("I", doc_counts), array("I", doc_counts.values())) for pair, doc_counts in counts.items()}
+        return cls(min_df, pairs)
+
+    def covers(self, phrase_tokens: List[str]) -> bool:
+        """True if the index answers this phrase (two words, frequent first word)."""
+        return len(phrase_tokens) == 2 and phrase_tokens[0] in self.first_words
+
+    def lookup(self, phrase_tokens: List[str]) -> Optional[Dict[int, int]]:
+        """{internal doc id: phrase count}, or None if the phrase is not covered."""
+        if not self.covers(phrase_tokens):
+            return None
+        entry = self.pairs.get(" ".join(phrase_tokens))
+        if entry is None:
+            return {}
+        return dict(zip(*entry))
@@ -0,0 +1,173 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# ----------------------
+# Two-level query cache attached to an index instance
+# ----------------------
+# 1. plan cache:   normalized query string -> RPN (tokenize + stem + shunting-yard)
+# 2. result cache: (generation, RPN, top_k) -> ranked results, bounded in bytes
+# Mutations (create/load/update/delete index) call invalidate(), which bumps the
+# generation: older result entries can no longer be hit and are dropped right away.
+# Plans only depend on the analyzer, so they survive invalidation, except those of
+# queries with expanded terms ("heal*", "helth~": they depend on the vocabulary).
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and/or an estimated byte size."""
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = sys.getsizeof):
+        if max_entries is not None and max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """Insert/replace; returns False if the value alone exceeds max_bytes (not cached)."""
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self._data and ((self.max_entries is not None and len(self._data) > self.max_entries) or
+                                  (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every key matching predicate (not counted as evictions)."""
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                self.bytes -= self._data.pop(key)[1]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def results_sizeof(results) -> int:
+    """
+    Approximate memory of a cached result: the tuple plus, per entry, either the doc id
+    string (boolean) or a (doc_id, score) pair. Shared doc id strings are counted
+    anyway, so the estimate errs on the safe side.
+    """
+    size = sys.getsizeof(results)
+    for item in results:
+        if isinstance(item, tuple):
+            size += sys.getsizeof(item) + sys.getsizeof(item[0]) + sys.getsizeof(item[1])
+        else:
+            size += sys.getsizeof(item)
+    return size
+
+
+def plan_sizeof(plan) -> int:
+    return sys.getsizeof(plan) + sum(sys.getsizeof(tok) for tok in plan)
+
+
+class QueryCache:
+    """
+    Plan + result cache for one index instance (see SelfIndex.enable_query_cache).
+
+    Usage:
+        cache = QueryCache(max_plans=4096, max_result_bytes=64 << 20)
+        rpn = cache.plan(query, compile_fn)                 # compile_fn(normalized query) -> RPN
+        results = cache.results(rpn, top_k, compute_fn)     # compute_fn() -> ranked results
+        cache.invalidate()                                  # after any index mutation
+        cache.stats()
+    Exceptions raised by compile_fn/compute_fn propagate and nothing is cached.
+    """
+
+    def __init__(self, max_plans: int = 4096, max_result_bytes: int = 64 * 1024 * 1024,
+                 max_results: Optional[int] = None):
+        self.generation = 0
+        self._plans = LRUCache(max_entries=max_plans, sizeof=plan_sizeof)
+        self._results = LRUCache(max_entries=max_results, max_bytes=max_result_bytes, sizeof=results_sizeof)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Whitespace-insensitive key; case is left to the analyzer (phrases are analyzed)."""
+        return " ".join(query.split())
+
+    def plan(self, query: str, compile_fn: Callable[[str], List[str]]) -> Tuple[str, ...]:
+        key = self.normalize(query)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = tuple(compile_fn(key))
+            self._plans.put(key, plan)
+        return plan
+
+    def results(self, plan: Tuple[str, ...], top_k: Optional[int], compute_fn: Callable[[], Any]) -> tuple:
+        # Queries differing only in case/stemmed forms share one plan and one result entry
+        generation = self.generation
+        key = (generation, plan, top_k)
+        results = self._results.get(key)
+        if results is None:
+            results = tuple(tuple(item) if isinstance(item, (list, tuple)) else item for item in compute_fn())
+            # An update that finished while we computed makes this result stale: don't keep it
+            if generation == self.generation:
+                self._results.put(key, results)
+        return results
+
+    def invalidate(self, stale_plan: Optional[Callable[[str], bool]] = None) -> None:
+        """New index generation: every cached result becomes stale, and the plans of queries stale_plan(query) is true for."""
+        self.generation += 1
+        generation = self.generation
+        self._results.discard_if(lambda key: key[0] != generation)
+        if stale_plan is not None:
+            self._plans.discard_if(stale_plan)
+
+    def clear(self) -> None:
+        self._plans.clear()
+        self._results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "plan": self._plans.stats(),
+            "result": self._results.stats(),
+            "result_budget_bytes": self._results.max_bytes,
+        }
@@ -0,0 +1,195 @@
+from typing import Callable, Dict, List, Optional, Set, Union
+
+from query_trace import count, span
+
+# ----------------------
+# Cost-based boolean query planner (sits between _shunting_yard and evaluation)
+# ----------------------
+# 1. build_tree: RPN -> expression tree (same operand/arity errors as the old stack evaluator)
+# 2. plan_tree:  flatten nested AND/OR into n-ary nodes, attach a cost estimate (number of
+#    matching docs, an upper bound except under NOT) and fold operands that cannot match
+#    (df = 0) so they are never fetched
+# 3. execute:    AND intersects its positive children by ascending cost, starting from the
+#    smallest posting list and stopping at the first empty intersection; its NOT children
+#    are subtracted from that candidate set, so "a AND NOT b" costs O(df(a) + df(b))
+#    instead of materializing every doc id. Only a NOT that is not under an AND (e.g.
+#    "NOT a", "a OR NOT b") still needs the universe.
+# Scores are those of the old evaluator: AND/OR sum the children's scores, a NOT child
+# contributes 1.0 to every doc it lets through.
+
+TERM, AND, OR, NOT, EMPTY = "TERM", "AND", "OR", "NOT", "EMPTY"
+
+Result = Union[Set[str], Dict[str, float]]
+
+
+class PlanNode:
+    """One node of a query plan; children keep query order (the order scores are summed in)."""
+    __slots__ = ("op", "children", "operand", "cost", "exec_order")
+
+    def __init__(self, op: str, children: Optional[List["PlanNode"]] = None, operand: Optional[str] = None):
+        self.op = op
+        self.children = children or []
+        self.operand = operand
+        self.cost = 0
+        # AND only: positive children by ascending cost, then NOT children by ascending cost
+        self.exec_order: List["PlanNode"] = []
+
+    def describe(self) -> str:
+        """Readable plan, children in execution order, e.g. AND~12("covid"~12, -"hospit"~30)."""
+        if self.op == TERM:
+            return f'"{self.operand}"~{self.cost}'
+        if self.op == EMPTY:
+            return "EMPTY"
+        if self.op == NOT:
+            return f"NOT~{self.cost}({self.children[0].describe()})"
+        if self.op == AND:
+            parts = [("-" + c.children[0].describe()) if c.op == NOT else c.describe() for c in self.exec_order]
+            return f"AND~{self.cost}({', '.join(parts)})"
+        return f"OR~{self.cost}({', '.join(c.describe() for c in self.children)})"
+
+    def __repr__(self) -> str:
+        return self.describe()
+
+
+def build_tree(rpn_tokens: List[str]) -> Optional[PlanNode]:
+    """RPN -> expression tree (None for an empty query)."""
+    stack: List[PlanNode] = []
+    for tok in rpn_tokens:
+        if tok == "NOT":
+            if not stack: raise ValueError("NOT needs operand")
+            stack.append(PlanNode(NOT, [stack.pop()]))
+        elif tok in ("AND", "OR"):
+            if len(stack) < 2: raise ValueError(f"{tok} needs two operands")
+            b = stack.pop()
+            a = stack.pop()
+            stack.append(PlanNode(tok, [a, b]))
+        else:
+            stack.append(PlanNode(TERM, operand=tok))
+
+    if not stack: return None
+    if len(stack) != 1: raise ValueError("Malformed boolean expression")
+    return stack[0]
+
+
+def plan_tree(node: PlanNode, doc_freq: Callable[[str], int], universe_size: int) -> PlanNode:
+    """
+    Flatten, cost and simplify the tree bottom-up.
+    doc_freq(term): number of docs containing term; universe_size: number of docs.
+    """
+    if node.op == TERM:
+        # A phrase matches at most as many docs as its rarest word
+        node.cost = min(doc_freq(t) for t in node.operand.split(" "))
+        return node if node.cost else PlanNode(EMPTY)
+
+    if node.op == NOT:
+        child = plan_tree(node.children[0], doc_freq, universe_size)
+        node.children = [child]
+        node.cost = max(universe_size - child.cost, 0)
+        return node
+
+    # Flatten: AND(a, AND(b, c)) -> AND(a, b, c), same for OR
+    children: List[PlanNode] = []
+    for child in node.children:
+        child = plan_tree(child, doc_freq, universe_size)
+        if child.op == node.op:
+            children.extend(child.children)
+        else:
+            children.append(child)
+
+    if node.op == OR:
+        # EMPTY adds neither docs nor score
+        children = [c for c in children if c.op != EMPTY]
+        if not children: return PlanNode(EMPTY)
+        if len(children) == 1: return children[0]
+        node.children = children
+        node.cost = min(sum(c.cost for c in children), universe_size)
+        return node
+
+    # AND: one empty positive operand empties the whole conjunction. NOT children are
+    # kept even when empty, they still add 1.0 to the score of every surviving doc.
+    positives = sorted((c for c in children if c.op != NOT), key=lambda c: c.cost)
+    negatives = sorted((c for c in children if c.op == NOT), key=lambda c: c.children[0].cost)
+    if positives and positives[0].op == EMPTY:
+        return PlanNode(EMPTY)
+    node.children = children
+    node.exec_order = positives + negatives
+    node.cost = positives[0].cost if positives else universe_size
+    return node
+
+
+def execute(node: Optional[PlanNode], fetch: Callable[[str], Result],
+            universe: Callable[[], Set[str]], scored: bool) -> Result:
+    """
+    Evaluate a planned tree.
+    fetch(operand): matching docs of one term/phrase, a set (scored=False) or {doc_id: score}.
+    universe(): every doc id, only called for a NOT outside an AND.
+    Returns a set of doc ids, or {doc_id: score} if scored.
+    """
+    if node is None:
+        return {} if scored else set()
+    # Repeated operands ("a AND b OR a AND c") are fetched once per query
+    fetched: Dict[str, Result] = {}
+
+    def fetch_once(operand: str) -> Result:
+        result = fetched.get(operand)
+        if result is None:
+            with span("fetch"):
+                result = fetched[operand] = fetch(operand)
+                count("matches", len(result))
+        return result
+
+    return _execute(node, fetch_once, universe, scored)
+
+
+def _execute(node: PlanNode, fetch, universe, scored: bool) -> Result:
+    if node.op == TERM:
+        return fetch(node.operand)
+    if node.op == EMPTY:
+        return {} if scored else set()
+
+    if node.op == NOT:
+        docs = universe()
+        docs.difference_update(_execute(node.children[0], fetch, universe, scored))
+        return dict.fromkeys(docs, 1.0) if scored else docs
+
+    if node.op == OR:
+        if not scored:
+            union: Set[str] = set()
+            for child in node.children:
+                union.update(_execute(child, fetch, universe, scored))
+            return union
+        scores: Dict[str, float] = {}
+        for child in node.children:
+            for doc_id, score in _execute(child, fetch, universe, scored).items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+        return scores
+
+    # AND
+    results: Dict[int, Result] = {}
+    docs: Optional[Set[str]] = None
+    for child in node.exec_order:
+        if child.op == NOT:
+            if docs is None: # NOT-only conjunction: "NOT a AND NOT b"
+                docs = universe()
+            excluded = _execute(child.children[0], fetch, universe, scored)
+            if len(excluded) < len(docs):
+                docs.difference_update(excluded)
+            else:
+                docs = {doc_id for doc_id in docs if doc_id not in excluded}
+        else:
+            result = results[id(child)] = _execute(child, fetch, universe, scored)
+            docs = set(result) if docs is None else {doc_id for doc_id in docs if doc_id in result}
+        if not docs:
+            return {} if scored else set()
+
+    if not scored:
+        return docs
+    # Sum in query order, as the pairwise evaluator did
+    terms = [results.get(id(child)) for child in node.children]
+    scores = {}
+    for doc_id in docs:
+        score = 0.0
+        for child_scores in terms:
+            score += 1.0 if child_scores is None else child_scores[doc_id]
+        scores[doc_id] = score
+    return scores
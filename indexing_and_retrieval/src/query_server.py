@@ -0,0 +1,294 @@
+import http.client
+import inspect
+import json
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from index_base import IndexBase
+
+# ----------------------
+# Multi-index query server
+# ----------------------
+# Every index of the given registries is loaded once, in its own IndexBase instance, and
+# stays resident. HTTP requests are accepted on threads; each index runs its queries on
+# its own worker pool over the shared, read-only loaded data (mmap-backed for the segment
+# store, a connection pool for SelfIndexSQLiteBlob). Indices with concurrent_queries =
+# False (one DB connection) get a single worker.
+#
+#   GET  /indices  resident indices
+#   GET  /stats    requests, QPS and latency percentiles since start
+#   GET  /traces   per index: stage histograms, counters and kept traces (trace_sample_rate)
+#   POST /query    {"index": name, "query": q, "top_k": k}  -> the index's query() output
+#   POST /batch    {"index": name, "queries": [q, ...], "top_k": k}
+#                  one worker runs the batch inside index.batch_scope(), so datastores fetch
+#                  every query word once; repeated queries are evaluated once
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class LatencyStats:
+    """Request/query counters and the latencies of the last `window` requests (thread-safe)."""
+
+    def __init__(self, window: int = 100_000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = self.queries = self.errors = 0
+        self.started = time.perf_counter()
+
+    def record(self, seconds: float, queries: int = 1, error: bool = False) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.requests += 1
+            self.queries += queries
+            self.errors += error
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            requests, queries, errors = self.requests, self.queries, self.errors
+        elapsed = time.perf_counter() - self.started
+        return {
+            "requests": requests, "queries": queries, "errors": errors,
+            "seconds": round(elapsed, 3),
+            "qps": round(queries / elapsed, 1) if elapsed else 0.0,
+            **{f"p{p}_ms": round(_percentile(latencies, p) * 1000, 3) for p in (50, 95, 99)},
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+
+
+class ResidentIndex:
+    """One loaded index and the worker pool its queries run on."""
+
+    def __init__(self, name: str, index_id: str, index: IndexBase, workers: int = 4,
+                 trace_sample_rate: Optional[float] = None, slow_ms: Optional[float] = None):
+        self.name, self.index_id, self.index = name, index_id, index
+        self.workers = workers if getattr(index, "concurrent_queries", True) else 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"index-{name}")
+        self.executor.submit(index.load_index, index_id).result()
+        if trace_sample_rate is not None and hasattr(index, "enable_tracing"):
+            index.enable_tracing(sample_rate=trace_sample_rate, slow_ms=slow_ms)
+        self._takes_top_k = "top_k" in inspect.signature(index.query).parameters
+
+    def _query(self, query: str, top_k: Optional[int]) -> Dict[str, Any]:
+        if self._takes_top_k:
+            return json.loads(self.index.query(query, top_k=top_k))
+        out = json.loads(self.index.query(query))
+        if top_k is not None:
+            out["results"] = out["results"][:top_k]
+            out["count"] = len(out["results"])
+        return out
+
+    def _batch(self, queries: List[str], top_k: Optional[int]) -> List[Dict[str, Any]]:
+        unique = list(dict.fromkeys(queries))
+        scope = getattr(self.index, "batch_scope", None)
+        with scope(unique) if scope is not None else nullcontext():
+            results = {query: self._query(query, top_k) for query in unique}
+        return [results[query] for query in queries]
+
+    def query(self, query: str, top_k: Optional[int] = None) -> Dict[str, Any]:
+        return self.executor.submit(self._query, query, top_k).result()
+
+    def batch(self, queries: List[str], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.executor.submit(self._batch, queries, top_k).result()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "index_id": self.index_id, "class": type(self.index).__name__,
+                "identifier": self.index.identifier_short, "workers": self.workers}
+
+    def trace_stats(self) -> Dict[str, Any]:
+        return self.index.trace_stats() if hasattr(self.index, "trace_stats") else {}
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class IndexServer:
+    """
+    Local HTTP query service over every index of one or more registries.
+    factories: {prefix: callable returning a fresh, unloaded index instance}. The first
+    instance of each factory reads its registry (index_registry.json); each registered
+    index_id is then loaded into an instance of its own, served as "{prefix}/{index_id}".
+
+        server = IndexServer({"compact": lambda: SelfIndexCompact(...)}, port=8080)
+        server.start()  # serves in a background thread until stop()
+
+    trace_sample_rate: trace that fraction of each index's queries (see SelfIndex.enable_tracing),
+    queries of at least slow_ms are logged; None leaves tracing off.
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[], IndexBase]], host: str = "127.0.0.1",
+                 port: int = 8080, workers: int = 4, trace_sample_rate: Optional[float] = None,
+                 slow_ms: Optional[float] = None):
+        self.host, self.port, self.workers = host, port, workers
+        self.trace_sample_rate, self.slow_ms = trace_sample_rate, slow_ms
+        self.factories = factories
+        self.indices: Dict[str, ResidentIndex] = {}
+        self.stats = LatencyStats()
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _load_all(self) -> None:
+        for prefix, factory in self.factories.items():
+            for index_id in sorted(factory().indices):
+                name = f"{prefix}/{index_id}"
+                self.indices[name] = ResidentIndex(name, index_id, factory(), self.workers,
+                                                   self.trace_sample_rate, self.slow_ms)
+                print(f"[query_server] Loaded {name} ({self.indices[name].workers} workers)")
+
+    def start(self) -> Tuple[str, int]:
+        """Load every registered index and serve in a background thread; returns (host, port)."""
+        self._load_all()
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _handler_for(self))
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="query-server", daemon=True)
+        self._thread.start()
+        self.stats = LatencyStats()
+        print(f"[query_server] Serving {len(self.indices)} indices on http://{self.host}:{self.port}")
+        return self.host, self.port
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        for resident in self.indices.values():
+            resident.close()
+        self.indices = {}
+
+    def __enter__(self) -> "IndexServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # --- Request handling (called on the HTTP threads) ---
+    def handle(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+        if method == "GET" and path == "/indices":
+            return 200, {"indices": [resident.describe() for resident in self.indices.values()]}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats.summary()
+        if method == "GET" and path == "/traces":
+            return 200, {name: resident.trace_stats() for name, resident in self.indices.items()}
+        if method != "POST" or path not in ("/query", "/batch"):
+            return 404, {"error": f"No route for {method} {path}"}
+
+        resident = self.indices.get((body or {}).get("index"))
+        if resident is None:
+            return 404, {"error": f"Unknown index: {(body or {}).get('index')!r}"}
+        top_k = body.get("top_k")
+        if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 0):
+            return 400, {"error": "top_k must be a non-negative integer"}
+
+        if path == "/query":
+            if not isinstance(body.get("query"), str):
+                return 400, {"error": "'query' must be a string"}
+            return 200, resident.query(body["query"], top_k)
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            return 400, {"error": "'queries' must be a list of strings"}
+        results = resident.batch(queries, top_k)
+        return 200, {"results": results, "count": len(results)}
+
+
+def _handler_for(server: IndexServer):
+    class QueryHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, the load generator reuses its connection
+
+        def setup(self):
+            super().setup()
+            # Headers and body are two writes: without this, Nagle + delayed ACK add ~40 ms
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _serve(self, method: str) -> None:
+            start = time.perf_counter()
+            queries = 1
+            try:
+                body = None
+                if method == "POST":
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length) or b"null")
+                    if not isinstance(body, dict): raise ValueError("Request body must be a JSON object")
+                    if isinstance(body.get("queries"), list): queries = len(body["queries"])
+                status, payload = server.handle(method, self.path, body)
+            except ValueError as e: # Also json.JSONDecodeError
+                status, payload = 400, {"error": str(e)}
+            except Exception as e:
+                status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            if self.path in ("/query", "/batch"):
+                server.stats.record(time.perf_counter() - start, queries, error=status != 200)
+
+        def do_GET(self):
+            self._serve("GET")
+
+        def do_POST(self):
+            self._serve("POST")
+
+        def log_message(self, format, *args):
+            pass # One line per request would dominate the cost of a query
+
+    return QueryHandler
+
+
+# ----------------------
+# Closed-loop load generator
+# ----------------------
+def closed_loop_load(host: str, port: int, requests: List[Tuple[str, Dict[str, Any]]],
+                     clients: int = 8, duration_s: float = 10.0) -> Dict[str, Any]:
+    """
+    `clients` threads, each with one keep-alive connection, send POST requests (path, body)
+    round robin and issue the next one as soon as the previous answer arrives, for duration_s.
+    Returns QPS (queries, a /batch counts its queries) and client-side latency percentiles.
+    """
+    latencies: List[List[float]] = [[] for _ in range(clients)]
+    counts = [[0, 0] for _ in range(clients)] # queries, errors
+    deadline = time.perf_counter() + duration_s
+
+    def client(c: int) -> None:
+        conn = http.client.HTTPConnection(host, port)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        i = c
+        while time.perf_counter() < deadline:
+            path, body = requests[i % len(requests)]
+            i += 1
+            data = json.dumps(body).encode()
+            start = time.perf_counter()
+            conn.request("POST", path, body=data, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            latencies[c].append(time.perf_counter() - start)
+            counts[c][0] += len(body.get("queries", [])) or 1
+            counts[c][1] += response.status != 200
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = sorted(x for per_client in latencies for x in per_client)
+    queries = sum(q for q, _ in counts)
+    return {
+        "clients": clients, "requests": len(all_latencies), "queries": queries,
+        "errors": sum(e for _, e in counts), "seconds": round(elapsed, 3),
+        "qps": round(queries / elapsed, 1),
+        **{f"p{p}_ms": round(_percentile(all_latencies, p) * 1000, 3) for p in (50, 95, 99)},
+        "max_ms": round(all_latencies[-1] * 1000, 3) if all_latencies else 0.0,
+    }
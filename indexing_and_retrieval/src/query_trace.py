@@ -0,0 +1,319 @@
+import functools
+import itertools
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# ----------------------
+# Query logging and per-query tracing
+# ----------------------
+# query() no longer prints: it logs to the "selfindex.query" logger (query lines at INFO,
+# parse/eval errors at WARNING), so by default only errors reach stderr. log_queries()
+# brings the old one-line-per-query output back.
+#
+# A traced query is a tree of spans with wall times and counters:
+#   query > parse > tokenize, shunting_yard
+#         > plan
+#         > evaluate > fetch (one per distinct operand), rank
+#         > serialize
+# Counters: matches per fetch, postings and bytes decoded, round trips,
+# candidates scored, plan/result cache hits.
+# The stack of open spans is thread-local and shared by every tracer, so any module of
+# the pipeline reports through the module-level span()/count() without holding the
+# tracer. Outside a sampled trace both return right away: with 1-in-N sampling the
+# other N-1 queries only pay a counter increment and a thread-local lookup per call.
+
+query_log = logging.getLogger("selfindex.query")
+
+_active = threading.local() # .stack: open spans of the current trace, .in_query, .forced, .last
+
+
+def log_queries(level: int = logging.INFO, stream=None) -> logging.Handler:
+    """Print query log lines (one per query at INFO) to stream (stdout); returns the handler."""
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    query_log.addHandler(handler)
+    query_log.setLevel(level)
+    return handler
+
+
+class Span:
+    __slots__ = ("name", "start", "seconds", "counters", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.counters: Dict[str, int] = {}
+        self.children: List["Span"] = []
+
+    def walk(self, prefix: str = "") -> Iterator[Tuple[str, "Span"]]:
+        """(path, span) for this span and every descendant, paths like "query/evaluate/fetch"."""
+        path = f"{prefix}/{self.name}" if prefix else self.name
+        yield path, self
+        for child in self.children:
+            yield from child.walk(path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"name": self.name, "ms": round(self.seconds * 1000, 4)}
+        if self.counters: out["counters"] = dict(self.counters)
+        if self.children: out["children"] = [child.to_dict() for child in self.children]
+        return out
+
+    def describe(self, depth: int = 0) -> str:
+        """Indented text tree, one span per line."""
+        counters = " ".join(f"{k}={v}" for k, v in self.counters.items())
+        lines = [f"{'  ' * depth}{self.name} {self.seconds * 1000:.3f} ms" + (f"  {counters}" if counters else "")]
+        lines.extend(child.describe(depth + 1) for child in self.children)
+        return "\n".join(lines)
+
+
+class _SpanScope:
+    __slots__ = ("stack", "span")
+
+    def __init__(self, stack: List[Span], name: str):
+        self.stack = stack
+        self.span = Span(name)
+
+    def __enter__(self) -> Span:
+        self.stack[-1].children.append(self.span)
+        self.stack.append(self.span)
+        return self.span
+
+    def __exit__(self, *exc) -> bool:
+        self.span.seconds = time.perf_counter() - self.span.start
+        self.stack.pop()
+        return False
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+def span(name: str):
+    """Child span of the open one (a shared no-op when this thread is not tracing)."""
+    stack = getattr(_active, "stack", None)
+    return _SpanScope(stack, name) if stack else _NULL_SCOPE
+
+
+def count(key: str, n: int = 1) -> None:
+    """Add n to a counter of the innermost open span (no-op when not tracing)."""
+    stack = getattr(_active, "stack", None)
+    if stack:
+        counters = stack[-1].counters
+        counters[key] = counters.get(key, 0) + n
+
+
+class LatencyHistogram:
+    """
+    Log-scale histogram of durations: 4 buckets per power of two of microseconds, so a
+    percentile is off by at most ~19%; count/sum/min/max are exact.
+    """
+
+    SUB_BUCKETS = 4
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        us = seconds * 1e6
+        bucket = int(math.log2(us) * self.SUB_BUCKETS) if us >= 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def _upper_ms(self, bucket: int) -> float:
+        return 2 ** ((bucket + 1) / self.SUB_BUCKETS) / 1000
+
+    def percentile(self, p: float) -> float:
+        """Upper bound (ms) of the bucket holding the p-th percentile, capped at max."""
+        if not self.count: return 0.0
+        rank = math.ceil(p / 100 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self._upper_ms(bucket), self.max * 1000)
+        return self.max * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 4),
+            "min_ms": round(self.min * 1000, 4),
+            **{f"p{p}_ms": round(self.percentile(p), 4) for p in (50, 95, 99)},
+            "max_ms": round(self.max * 1000, 4),
+            "buckets": {f"{self._upper_ms(b):.4g}": n for b, n in sorted(self.buckets.items())},
+        }
+
+
+class _TraceScope:
+    __slots__ = ("tracer", "attrs", "root")
+
+    def __init__(self, tracer: "QueryTracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.attrs = attrs
+        self.root = Span(name)
+
+    def __enter__(self) -> Span:
+        _active.stack = [self.root]
+        return self.root
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.root.seconds = time.perf_counter() - self.root.start
+        _active.stack = None
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        _active.last = self.tracer._record(self.root, self.attrs)
+        return False
+
+
+class QueryTracer:
+    """
+    Samples queries, keeps their span trees and aggregates them (see SelfIndex.enable_tracing).
+    - sample_rate: fraction of queries traced, as 1 in round(1 / sample_rate); 0 disables
+    - keep_traces: the most recent traced queries kept in full
+    - slow_ms: traced queries at least this slow are also kept apart and logged (WARNING)
+
+    Usage:
+        tracer = QueryTracer(sample_rate=0.01, slow_ms=50)
+        with tracer.trace("query", query=q):   # root span, sampled or a no-op
+            with span("parse"): ...
+            count("postings", n)
+        tracer.export()                        # JSON-ready histograms, counters, traces
+    """
+
+    def __init__(self, sample_rate: float = 1.0, keep_traces: int = 64, slow_ms: Optional[float] = None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be within [0, 1]")
+        self.sample_rate = sample_rate
+        self.sample_every = round(1 / sample_rate) if sample_rate else 0
+        self.slow_ms = slow_ms
+        self.keep_traces = keep_traces
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._seen = itertools.count(1) # next() is atomic: no lock on the unsampled path
+            self.queries_seen = 0
+            self.queries_traced = 0
+            self.stages: Dict[str, LatencyHistogram] = {}
+            self.counters: Dict[str, int] = {}
+            self.recent: Deque[Dict[str, Any]] = deque(maxlen=self.keep_traces)
+            self.slow: Deque[Dict[str, Any]] = deque(maxlen=self.keep_traces)
+
+    def trace(self, name: str = "query", **attrs):
+        """
+        Root span of one query, or a no-op if it is not sampled. Inside an open trace (a
+        query run by another traced query on the same thread) it is a no-op as well: the
+        inner query's spans become part of the outer tree.
+        """
+        if getattr(_active, "stack", None):
+            return _NULL_SCOPE
+        n = self.queries_seen = next(self._seen)
+        if getattr(_active, "forced", None) is self or (self.sample_every and n % self.sample_every == 0):
+            return _TraceScope(self, name, attrs)
+        return _NULL_SCOPE
+
+    @contextmanager
+    def forced(self):
+        """Trace every query run on this thread within the block, whatever the sample rate."""
+        previous = getattr(_active, "forced", None)
+        _active.forced = self
+        try:
+            yield self
+        finally:
+            _active.forced = previous
+
+    @staticmethod
+    def last() -> Optional[Dict[str, Any]]:
+        """The last trace recorded on this thread, by any tracer."""
+        return getattr(_active, "last", None)
+
+    def _record(self, root: Span, attrs: Dict[str, Any]) -> Dict[str, Any]:
+        trace = {**attrs, "ms": round(root.seconds * 1000, 4), "spans": root.to_dict()}
+        slow = self.slow_ms is not None and root.seconds * 1000 >= self.slow_ms
+        with self._lock:
+            self.queries_traced += 1
+            for path, node in root.walk():
+                hist = self.stages.get(path)
+                if hist is None:
+                    hist = self.stages[path] = LatencyHistogram()
+                hist.add(node.seconds)
+                for key, n in node.counters.items():
+                    self.counters[key] = self.counters.get(key, 0) + n
+            self.recent.append(trace)
+            if slow: self.slow.append(trace)
+        if slow:
+            query_log.warning("Slow query (%.1f ms): %s\n%s", root.seconds * 1000, attrs.get("query"), root.describe())
+        return trace
+
+    def export(self) -> Dict[str, Any]:
+        with self._lock:
+            traced = self.queries_traced
+            return {
+                "sample_rate": self.sample_rate,
+                "slow_ms": self.slow_ms,
+                "queries_seen": self.queries_seen,
+                "queries_traced": traced,
+                "stages": {path: hist.to_dict() for path, hist in sorted(self.stages.items())},
+                "counters": {key: {"total": n, "per_query": round(n / traced, 3)}
+                             for key, n in sorted(self.counters.items())},
+                "recent": list(self.recent),
+                "slow": list(self.slow),
+            }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.export(), indent=indent)
+
+
+def traced_query(method):
+    """
+    Decorator for IndexBase.query implementations: runs the call as the root span of a
+    trace when the instance has a tracer (attribute `tracer`) that samples it, or when a
+    tracer forces it. Also times the JSON serialization of the result.
+    """
+    @functools.wraps(method)
+    def wrapper(self, query, *args, **kwargs):
+        tracer = getattr(_active, "forced", None) or getattr(self, "tracer", None)
+        # An override calling super().query() is the same query: sampled (and counted) once
+        if tracer is None or getattr(_active, "in_query", False):
+            return method(self, query, *args, **kwargs)
+        _active.in_query = True
+        try:
+            with tracer.trace("query", index=self.identifier_short, query=query):
+                return method(self, query, *args, **kwargs)
+        finally:
+            _active.in_query = False
+    return wrapper
+
+
+def dumps(out: Dict[str, Any]) -> str:
+    """The query() response, json.dumps(indent=2) as before, as a "serialize" span."""
+    with span("serialize"):
+        return json.dumps(out, indent=2)
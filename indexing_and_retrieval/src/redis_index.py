@@ -0,0 +1,819 @@
+import redis
+import json
+import math
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Tuple, Dict, Any, List, Optional, Set
+from array import array
+from collections import defaultdict
+
+from footprint import approx_sizeof
+from self_index import SelfIndexTFIDF
+from phrase_match import phrase_count
+from query_trace import count, dumps, query_log, traced_query
+from packed_postings import Packed, PostingsBuilder, TermBlob, drop_docs, pack_postings, phrase_scores, unpack_postings
+
+
+class SelfIndexRedis(SelfIndexTFIDF):
+    """
+    Implements the index using Redis as the datastore (y=2, option 2).
+    Inherits TF-IDF logic (x=3) but overrides storage and querying.
+    Uses Redis Hashes for postings: key='idx:{id}:term:{term}', field='doc_id', value=JSON(count, pos)
+    Uses Redis Hash for DF: key='idx:{id}:meta:df', field='term', value=df_count
+    Uses Redis Set for Docs: key='idx:{id}:meta:docs', member='doc_id'
+    Uses Redis String for N: key='idx:{id}:meta:doc_count', value=N
+    Uses Redis Set as forward index: key='idx:{id}:doc:{doc_id}', member='term' (for update_index)
+    """
+    _decode_responses = True # Decode keys/values from bytes to strings
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_redis", # Path for registry only
+                 redis_host='localhost', redis_port=6379, redis_db=0, redis_client=None):
+        # Specify DB2 for datastore type
+        super().__init__(core, 'TFIDF', 'DB2', qproc, compr, optim, preprocess_fn, storage_path)
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.redis_db = redis_db
+        self.redis_conn: redis.Redis | None = None
+        # An already-built client (e.g. an in-process stand-in such as fakeredis) replaces
+        # host/port/db; it must match _decode_responses
+        self.redis_client = redis_client
+        self.current_index_id: str | None = None # Track the "loaded" index
+
+        # Registry is still file-based
+        self.storage_path = Path(storage_path)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.index_registry_file = self.storage_path / "index_registry.json"
+        self._load_registry()
+
+    def _get_redis_key(self, key_type: str, term: str | None = None) -> str:
+        """Helper to construct Redis keys with index ID prefix."""
+        if not self.current_index_id:
+            raise RuntimeError("No index loaded. Call load_index first.")
+        prefix = f"idx:{self.current_index_id}"
+        if key_type == 'term_postings':
+            return f"{prefix}:term:{term}"
+        elif key_type == 'meta_df':
+            return f"{prefix}:meta:df"
+        elif key_type == 'meta_doc_count':
+            return f"{prefix}:meta:doc_count"
+        elif key_type == 'meta_term_count':
+             return f"{prefix}:meta:term_count"
+        elif key_type == 'meta_docs':
+             return f"{prefix}:meta:docs"
+        elif key_type == 'doc_terms':
+             return f"{prefix}:doc:{term}"
+        else:
+            raise ValueError(f"Unknown key type: {key_type}")
+
+    def _connect_redis(self):
+        """Establish connection to Redis."""
+        if self.redis_conn is None:
+            if self.redis_client is not None:
+                self.redis_conn = self.redis_client
+                return
+            try:
+                # print(f"Connecting to Redis: {self.redis_host}:{self.redis_port} DB {self.redis_db}")
+                self.redis_conn = redis.Redis(
+                    host=self.redis_host, port=self.redis_port, db=self.redis_db,
+                    decode_responses=self._decode_responses
+                )
+                self.redis_conn.ping() # Verify connection
+            except redis.exceptions.ConnectionError as e:
+                self.redis_conn = None
+                raise RuntimeError(f"Failed to connect to Redis: {e}") from e
+
+    def _close_redis(self):
+        """Close Redis connection."""
+        if self.redis_conn:
+            self.redis_conn.close()
+            self.redis_conn = None
+            self.current_index_id = None
+
+    # --- Override create_index ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """Builds and stores the index in Redis."""
+        print(f"[{self.identifier_short}] Creating Redis index (y=2): {index_id}")
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+
+        # --- Clear existing index data for this index_id ---
+        # Use SCAN to find keys and delete in batches for large indexes
+        print(f"[{self.identifier_short}] Deleting existing keys for index '{index_id}'...")
+        keys_deleted = 0
+        for key in self.redis_conn.scan_iter(match=f"idx:{index_id}:*"):
+            self.redis_conn.delete(key)
+            keys_deleted += 1
+        print(f"[{self.identifier_short}] Deleted {keys_deleted} old keys.")
+
+        # --- Indexing ---
+        # Use pipeline for efficient bulk operations
+        pipe = self.redis_conn.pipeline()
+        processed_docs = 0
+        term_df_counts = defaultdict(int)
+        all_doc_ids = set()
+
+        print(f"[{self.identifier_short}] Processing documents...")
+        for doc_id, content in files:
+            # (Input validation...)
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            processed_docs += 1
+            all_doc_ids.add(doc_id)
+
+            tokens = self.preprocess_fn(content)
+            term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+            doc_unique_terms = set()
+            for pos, term in enumerate(tokens):
+                term_positions_in_doc[term].append(pos)
+                doc_unique_terms.add(term)
+
+            # Add postings to pipeline
+            for term, positions in term_positions_in_doc.items():
+                posting_data = {'count': len(positions), 'pos': positions}
+                redis_key = f"idx:{index_id}:term:{term}" # Construct key directly here
+                # HSET key field value
+                pipe.hset(redis_key, doc_id, json.dumps(posting_data))
+
+            # Update DF counts (in memory first)
+            for term in doc_unique_terms:
+                term_df_counts[term] += 1
+
+            # Add doc_id to the set of all docs for this index
+            pipe.sadd(f"idx:{index_id}:meta:docs", doc_id)
+            # Forward index: the doc's terms, so a removal only touches those postings
+            if doc_unique_terms:
+                pipe.sadd(f"idx:{index_id}:doc:{doc_id}", *doc_unique_terms)
+
+            if processed_docs % 1000 == 0: # Execute pipeline periodically
+                print(f"[{self.identifier_short}] Processed {processed_docs} documents, executing pipeline...")
+                pipe.execute()
+                pipe = self.redis_conn.pipeline() # Start new pipeline
+
+        # --- Finalize ---
+        print(f"[{self.identifier_short}] Executing final pipeline...")
+        # Add DF counts to pipeline
+        if term_df_counts:
+             pipe.hset(f"idx:{index_id}:meta:df", mapping=term_df_counts)
+        # Store metadata (N and term count)
+        pipe.set(f"idx:{index_id}:meta:doc_count", processed_docs)
+        term_count = len(term_df_counts)
+        pipe.set(f"idx:{index_id}:meta:term_count", term_count)
+
+        pipe.execute() # Execute remaining commands
+        self._invalidate_query_cache()
+
+        print(f"[{self.identifier_short}] Redis index '{index_id}' created: {processed_docs} docs, {term_count} terms.")
+
+        # Update registry (file-based)
+        self.indices.add(index_id)
+        self._save_registry()
+        # Don't close connection here, maybe load follows
+
+    # --- Override load_index ---
+    def load_index(self, serialized_index_dump: str) -> None:
+        """Establishes connection and sets current_index_id for Redis."""
+        index_id = serialized_index_dump
+        # Check registry first
+        if index_id not in self.indices:
+             # Maybe check Redis directly? For now, rely on registry.
+             raise FileNotFoundError(f"Index '{index_id}' not found in registry.")
+
+        print(f"[{self.identifier_short}] Connecting to Redis for index '{index_id}'...")
+        self._close_redis() # Close previous connection if any
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+
+        # Verify index exists in Redis by checking metadata
+        doc_count = self.redis_conn.get(f"idx:{index_id}:meta:doc_count")
+        term_count = self.redis_conn.get(f"idx:{index_id}:meta:term_count")
+        if doc_count is None or term_count is None:
+            self._close_redis()
+            raise RuntimeError(f"Index '{index_id}' metadata not found in Redis. Index may be incomplete or deleted.")
+
+        self.current_index_id = index_id # Set the active index
+        print(f"[{self.identifier_short}] Connected to Redis index: docs={doc_count}, terms={term_count}")
+        # Clear any in-memory data
+        self.index_data = {}
+        self._invalidate_query_cache()
+
+    # --- Override query-related methods ---
+
+    def _get_doc_count_N(self) -> int:
+        """Gets N from Redis."""
+        if not self.redis_conn: raise RuntimeError("Redis not connected.")
+        count = self.redis_conn.get(self._get_redis_key('meta_doc_count'))
+        return int(count) if count else 0
+
+    def _get_term_df(self, term: str) -> int:
+        """Gets DF for a term from Redis Hash."""
+        if not self.redis_conn: raise RuntimeError("Redis not connected.")
+        df = self.redis_conn.hget(self._get_redis_key('meta_df'), term)
+        return int(df) if df else 0
+
+    def _calculate_idf(self, term: str) -> float:
+        """Calculates IDF using N and DF from Redis."""
+        N = self._get_doc_count_N()
+        df = self._get_term_df(term) # Fetches from Redis
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates term/phrase, returning {doc_id: tfidf_score} by querying Redis."""
+        if not self.redis_conn: raise RuntimeError("Redis not connected.")
+        final_scores = defaultdict(float)
+
+        if " " not in operand: # Single term
+            term = operand
+            idf = self._calculate_idf(term) # Uses Redis
+            if idf == 0: return {}
+
+            # Fetch all postings for this term from Redis Hash
+            # HGETALL key -> {doc_id1: json_str1, doc_id2: json_str2, ...}
+            redis_key = self._get_redis_key('term_postings', term=term)
+            all_postings = self.redis_conn.hgetall(redis_key)
+
+            for doc_id, posting_json in all_postings.items():
+                try:
+                    posting_data = json.loads(posting_json)
+                    tf = posting_data.get('count', 0)
+                    final_scores[doc_id] = tf * idf
+                except json.JSONDecodeError:
+                    query_log.warning("Corrupt JSON data in Redis for term '%s', doc '%s'", term, doc_id)
+                    continue
+
+        else: # Phrase
+            phrase_tokens = operand.split(" ")
+            if not phrase_tokens: return {}
+
+            # --- Phrase matching using Redis and Python ---
+            # 1. Fetch postings for all phrase terms
+            term_postings_map: Dict[str, Dict[str, Dict[str, Any]]] = {} # {term: {doc: {count, pos}}}
+            candidate_docs = None
+
+            for term in phrase_tokens:
+                redis_key = self._get_redis_key('term_postings', term=term)
+                term_postings_raw = self.redis_conn.hgetall(redis_key)
+                if not term_postings_raw: return {} # Term not found
+
+                term_docs = set()
+                term_postings_map[term] = {}
+                for doc_id, posting_json in term_postings_raw.items():
+                    try:
+                        term_postings_map[term][doc_id] = json.loads(posting_json)
+                        term_docs.add(doc_id)
+                    except json.JSONDecodeError: continue # Skip corrupt data
+
+                # Intersect candidate docs
+                if candidate_docs is None:
+                    candidate_docs = term_docs
+                else:
+                    candidate_docs &= term_docs
+                if not candidate_docs: return {} # No common docs
+
+            # 2. Perform positional check in Python
+            matched_docs = set()
+            for doc in candidate_docs:
+                pos_lists = [term_postings_map[t].get(doc, {}).get('pos', []) for t in phrase_tokens]
+                if any(not pl for pl in pos_lists): continue # Skip if data missing
+                if phrase_count(pos_lists, first_only=True): matched_docs.add(doc)
+
+            # 3. Calculate scores for matched docs (sum TF-IDF of individual terms)
+            term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+            for doc_id in matched_docs:
+                doc_score = 0.0
+                for term in phrase_tokens:
+                    # TF is already fetched in term_postings_map
+                    tf = term_postings_map[term].get(doc_id, {}).get('count', 0)
+                    idf = term_idfs[term]
+                    doc_score += tf * idf
+                final_scores[doc_id] = doc_score
+
+        return dict(final_scores)
+
+    # --- Planner hooks and query ---
+    # df and the NOT universe come from Redis (the universe only for a NOT outside an AND)
+
+    def _doc_freq(self, term: str) -> int:
+        return self._get_term_df(term)
+
+    def _universe_size(self) -> int:
+        return self._get_doc_count_N()
+
+    def _universe(self) -> Set[str]:
+        if not self.redis_conn: raise RuntimeError("Redis not connected.")
+        return self.redis_conn.smembers(self._get_redis_key('meta_docs'))
+
+    @traced_query
+    def query(self, query: str, explain: bool = False) -> str:
+        """Perform boolean query using Redis."""
+        # --- FIX: Check self.redis_conn ---
+        if not self.redis_conn:
+             raise RuntimeError("Redis not connected. Call load_index(index_id) first.")
+        # --- END FIX ---
+
+        query_log.info("[%s] Querying Redis (TF-IDF x=3, DB y=2): %s", self.identifier_short, query)
+
+        plan = None
+        try:
+            rpn = self._parse_query(query) # Inherited is fine
+            if explain: plan = self._explain_rpn(rpn)
+            # Calls the overridden _evaluate_rpn which uses Redis
+            ranked_results = self._cached_results(rpn, lambda: self._rank(self._evaluate_rpn(rpn)))
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = { "query": query, "results": ranked_results, "count": len(ranked_results) }
+        if explain: out["plan"] = plan
+        return dumps(out)
+
+
+    # --- Other methods ---
+
+    def delete_index(self, index_id: str) -> None:
+        """Delete all Redis keys associated with index_id and remove from registry."""
+        print(f"[{self.identifier_short}] Deleting Redis index '{index_id}'...")
+        self._connect_redis()
+        if not self.redis_conn:
+            print("Warning: Redis not connected, cannot delete keys.")
+        else:
+            keys_deleted = 0
+            # Use SCAN to avoid blocking Redis on large key spaces
+            for key in self.redis_conn.scan_iter(match=f"idx:{index_id}:*"):
+                self.redis_conn.delete(key)
+                keys_deleted += 1
+            print(f"[{self.identifier_short}] Deleted {keys_deleted} keys from Redis.")
+            # Don't close connection here, maybe needed for registry save
+
+        # Remove from file registry
+        self.indices.discard(index_id)
+        self._save_registry()
+        # If this was the loaded index, clear connection info
+        if self.current_index_id == index_id:
+            self._close_redis()
+        self._invalidate_query_cache()
+
+        print(f"[{self.identifier_short}] Index '{index_id}' removed from registry.")
+
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Return list of doc IDs from the Redis set."""
+        # Ensure connection is established for the correct index
+        self.load_index(index_id) # Connects and sets self.current_index_id
+        if not self.redis_conn: raise RuntimeError("Failed to connect to Redis for listing files.")
+
+        doc_ids = self.redis_conn.smembers(self._get_redis_key('meta_docs'))
+        # Don't close connection, might be needed right after
+        return sorted(list(doc_ids))
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Incremental update; touches only the postings of the changed documents.
+        - removed (and re-added) docs: the forward index set 'idx:{id}:doc:{doc_id}' gives
+          their terms -> HDEL from those postings hashes, HINCRBY df -1
+        - added docs: HSET postings, HINCRBY df +1, forward index set written
+        - terms whose df reaches 0 are dropped; doc_count/term_count recomputed
+        Each phase is sent as one pipeline. Indexes created before the forward index
+        existed fall back to scanning the term keys for removed docs.
+        """
+        print(f"[{self.identifier_short}] Updating Redis index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+        r = self.redis_conn
+        prefix = f"idx:{index_id}"
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids.update(additions)
+
+        # ---------- removals ----------
+        pipe = r.pipeline()
+        for doc_id in remove_ids:
+            pipe.sismember(f"{prefix}:meta:docs", doc_id)
+            pipe.smembers(f"{prefix}:doc:{doc_id}")
+        replies = pipe.execute()
+
+        touched_terms = set()
+        removed = 0
+        pipe = r.pipeline()
+        for i, doc_id in enumerate(remove_ids):
+            present, doc_terms = replies[2 * i], replies[2 * i + 1]
+            if not present:
+                continue
+            if not doc_terms:
+                doc_terms = self._scan_doc_terms(index_id, doc_id)
+            for term in doc_terms:
+                pipe.hdel(f"{prefix}:term:{term}", doc_id)
+                pipe.hincrby(f"{prefix}:meta:df", term, -1)
+            touched_terms.update(doc_terms)
+            pipe.srem(f"{prefix}:meta:docs", doc_id)
+            pipe.delete(f"{prefix}:doc:{doc_id}")
+            removed += 1
+        pipe.execute()
+
+        # ---------- additions ----------
+        pipe = r.pipeline()
+        for doc_id, content in additions.items():
+            tokens = self.preprocess_fn(content)
+            term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+            for pos, term in enumerate(tokens):
+                term_positions_in_doc[term].append(pos)
+
+            for term, positions in term_positions_in_doc.items():
+                posting_data = {'count': len(positions), 'pos': positions}
+                pipe.hset(f"{prefix}:term:{term}", doc_id, json.dumps(posting_data))
+                pipe.hincrby(f"{prefix}:meta:df", term, 1)
+            touched_terms.update(term_positions_in_doc)
+            pipe.sadd(f"{prefix}:meta:docs", doc_id)
+            if term_positions_in_doc:
+                pipe.sadd(f"{prefix}:doc:{doc_id}", *term_positions_in_doc)
+        pipe.execute()
+
+        # ---------- drop empty terms, refresh metadata ----------
+        touched_terms = list(touched_terms)
+        if touched_terms:
+            dfs = r.hmget(f"{prefix}:meta:df", touched_terms)
+            dead = [term for term, df in zip(touched_terms, dfs) if df is not None and int(df) <= 0]
+            if dead:
+                pipe = r.pipeline()
+                pipe.hdel(f"{prefix}:meta:df", *dead)
+                pipe.delete(*[f"{prefix}:term:{term}" for term in dead])
+                pipe.execute()
+        doc_count = r.scard(f"{prefix}:meta:docs")
+        term_count = r.hlen(f"{prefix}:meta:df")
+        pipe = r.pipeline()
+        pipe.set(f"{prefix}:meta:doc_count", doc_count)
+        pipe.set(f"{prefix}:meta:term_count", term_count)
+        pipe.execute()
+        self._invalidate_query_cache()
+
+        print(f"[{self.identifier_short}] Update complete: -{removed} / +{len(additions)} docs. "
+              f"docs={doc_count}, terms={term_count}")
+
+    def _scan_doc_terms(self, index_id: str, doc_id: str) -> Set[str]:
+        """Terms of doc_id found by scanning postings keys (indexes without a forward index)."""
+        prefix = f"idx:{index_id}:term:"
+        return {key[len(prefix):] for key in self.redis_conn.scan_iter(match=f"{prefix}*")
+                if self.redis_conn.hexists(key, doc_id)}
+
+    # Need __del__ to ensure DB connection is closed
+    def __del__(self):
+        self._close_redis()
+
+
+class SelfIndexRedisBlob(SelfIndexRedis):
+    """
+    Redis datastore (y=2) with packed binary postings, a query costs one round trip.
+    Keys (prefix 'idx:{id}'):
+    - ':term:{term}' STRING: uint32 n, then n postings packed by packed_postings (docs are doc_nums)
+    - ':meta:doc_nums' HASH doc_id -> doc_num; ':doc:{doc_id}' SET of its terms (forward index)
+    - ':meta:doc_count', ':meta:term_count', ':meta:next_doc' STRING
+    - ':meta:generation' STRING, incremented by every create/update
+    df is the n header of a blob. N, the doc_num -> doc_id map and the dfs are cached
+    client-side and dropped when the generation changes; query() sends the generation
+    check and the blobs of every query word in one pipeline.
+    """
+    _decode_responses = False # Blobs are binary
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_redis_blob",
+                 redis_host='localhost', redis_port=6379, redis_db=0, redis_client=None):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path,
+                         redis_host, redis_port, redis_db, redis_client)
+        self.generation: Optional[int] = None
+        self.doc_ids: Dict[int, str] = {} # doc_num -> doc_id
+        self.df_cache: Dict[str, int] = {}
+        # Per thread: .prefetched, the blobs of the query being evaluated;
+        # .batch, the blobs of a whole batch_scope
+        self._local = threading.local()
+        self.round_trips = 0 # Redis round trips made by this client
+
+    @staticmethod
+    def _encode_blob(docs: array, tfs: array, positions: array) -> bytes:
+        return array('I', [len(docs)]).tobytes() + pack_postings(docs, tfs, positions)
+
+    @staticmethod
+    def _unpack_blob(data: bytes) -> Packed:
+        return unpack_postings(int.from_bytes(data[:4], sys.byteorder), data[4:])
+
+    def _decode_blob(self, data: bytes) -> TermBlob:
+        docs, tfs, positions = self._unpack_blob(data)
+        return TermBlob(len(docs), docs, tfs, positions)
+
+    def _execute(self, pipe) -> list:
+        self.round_trips += 1
+        count("round_trips")
+        return pipe.execute()
+
+    def _delete_keys(self, index_id: str) -> int:
+        keys = list(self.redis_conn.scan_iter(match=f"idx:{index_id}:*", count=10_000))
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for i in range(0, len(keys), 10_000):
+            pipe.unlink(*keys[i:i + 10_000])
+        self._execute(pipe)
+        return len(keys)
+
+    # --- Build ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]], batch_commands: int = 10_000) -> None:
+        """Builds the postings in memory, then writes one blob per term in large pipelines."""
+        print(f"[{self.identifier_short}] Creating Redis blob index (y=2): {index_id}")
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+        print(f"[{self.identifier_short}] Deleted {self._delete_keys(index_id)} old keys.")
+        prefix = f"idx:{index_id}"
+
+        builder = PostingsBuilder()
+        doc_nums: Dict[str, int] = {}
+        forward: List[Tuple[str, List[str]]] = []
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            if doc_id in doc_nums: raise ValueError(f"Duplicate doc_id: {doc_id}")
+            doc_nums[doc_id] = len(doc_nums)
+            term_positions = self._term_positions(content)
+            builder.add(doc_nums[doc_id], term_positions)
+            forward.append((doc_id, list(term_positions)))
+
+        pipe = self.redis_conn.pipeline(transaction=False)
+        def flush(pipe):
+            if len(pipe) >= batch_commands:
+                self._execute(pipe)
+        for term, postings in builder.items():
+            pipe.set(f"{prefix}:term:{term}", self._encode_blob(*postings))
+            flush(pipe)
+        for doc_id, terms in forward:
+            if terms: pipe.sadd(f"{prefix}:doc:{doc_id}", *terms)
+            flush(pipe)
+        if doc_nums: pipe.hset(f"{prefix}:meta:doc_nums", mapping=doc_nums)
+        pipe.set(f"{prefix}:meta:doc_count", len(doc_nums))
+        pipe.set(f"{prefix}:meta:term_count", len(builder.postings))
+        pipe.set(f"{prefix}:meta:next_doc", len(doc_nums))
+        pipe.incr(f"{prefix}:meta:generation")
+        self._execute(pipe)
+        self._invalidate_query_cache()
+
+        print(f"[{self.identifier_short}] Redis blob index '{index_id}' created: "
+              f"{len(doc_nums)} docs, {len(builder.postings)} terms.")
+        self.indices.add(index_id)
+        self._save_registry()
+
+    def _term_positions(self, content: str) -> Dict[str, List[int]]:
+        term_positions: Dict[str, List[int]] = defaultdict(list)
+        for pos, term in enumerate(self.preprocess_fn(content)):
+            term_positions[term].append(pos)
+        return term_positions
+
+    # --- Load / client-side cache ---
+    def load_index(self, serialized_index_dump: str) -> None:
+        index_id = serialized_index_dump
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' not found in registry.")
+        print(f"[{self.identifier_short}] Connecting to Redis for index '{index_id}'...")
+        self._close_redis()
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+        self.current_index_id = index_id
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.get(f"idx:{index_id}:meta:generation")
+        generation, = self._execute(pipe)
+        if generation is None:
+            self._close_redis()
+            raise RuntimeError(f"Index '{index_id}' metadata not found in Redis. Index may be incomplete or deleted.")
+        self._refresh(int(generation))
+        print(f"[{self.identifier_short}] Connected to Redis index: docs={len(self.doc_ids)}, generation={self.generation}")
+        self.index_data = {}
+        self._invalidate_query_cache()
+
+    def _refresh(self, generation: int) -> None:
+        """Reload the doc map and drop the cached dfs (the index changed)."""
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hgetall(f"idx:{self.current_index_id}:meta:doc_nums")
+        doc_nums, = self._execute(pipe)
+        self.doc_ids = {int(num): doc_id.decode() for doc_id, num in doc_nums.items()}
+        self.df_cache = {}
+        self.generation = generation
+
+    def memory_footprint(self) -> int:
+        """Postings stay in Redis: only the doc id map and df cache are resident here."""
+        return approx_sizeof(self.doc_ids) + approx_sizeof(self.df_cache)
+
+    def _fetch_blobs(self, terms: List[str]) -> Dict[str, Optional[TermBlob]]:
+        """The generation check and every blob in one pipeline; refreshes a stale cache."""
+        if not self.redis_conn: raise RuntimeError("Redis not connected.")
+        prefix = f"idx:{self.current_index_id}"
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.get(f"{prefix}:meta:generation")
+        for term in terms:
+            pipe.get(f"{prefix}:term:{term}")
+        generation, *blobs = self._execute(pipe)
+        if generation is not None and int(generation) != self.generation:
+            self._refresh(int(generation))
+        fetched = {}
+        for term, data in zip(terms, blobs):
+            fetched[term] = self._decode_blob(data) if data else None
+            self.df_cache[term] = fetched[term].df if data else 0
+        return fetched
+
+    def _prefetch(self, rpn_tokens: List[str]) -> None:
+        words = {word for tok in rpn_tokens if tok not in ("AND", "OR", "NOT") for word in tok.split(" ")}
+        batch = getattr(self._local, "batch", None)
+        if batch is None:
+            self._local.prefetched = self._fetch_blobs(sorted(words))
+            return
+        missing = sorted(words.difference(batch))
+        if missing: batch.update(self._fetch_blobs(missing))
+        self._local.prefetched = batch
+
+    def _blob(self, term: str) -> Optional[TermBlob]:
+        prefetched = getattr(self._local, "prefetched", None)
+        if prefetched is not None and term in prefetched:
+            return prefetched[term]
+        return self._fetch_blobs([term])[term]
+
+    @contextmanager
+    def batch_scope(self, queries: List[str]):
+        """The blobs of every word of the batch are fetched up front, in one pipeline."""
+        self._local.batch = self._fetch_blobs(self._query_words(queries))
+        try:
+            yield
+        finally:
+            self._local.batch = None
+
+    def _doc_freq(self, term: str) -> int:
+        if term not in self.df_cache:
+            if not self.redis_conn: raise RuntimeError("Redis not connected.")
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.getrange(f"idx:{self.current_index_id}:term:{term}", 0, 3)
+            header, = self._execute(pipe)
+            self.df_cache[term] = int.from_bytes(header, sys.byteorder) if header else 0
+        return self.df_cache[term]
+
+    def _get_term_df(self, term: str) -> int:
+        return self._doc_freq(term)
+
+    def _get_doc_count_N(self) -> int:
+        return len(self.doc_ids)
+
+    def _idf(self, df: int) -> float:
+        N = len(self.doc_ids)
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _calculate_idf(self, term: str) -> float:
+        return self._idf(self._doc_freq(term))
+
+    def _universe(self) -> Set[str]:
+        return set(self.doc_ids.values())
+
+    # --- Query ---
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Dict[str, float]:
+        """Fetches every query word up front (one round trip), then evaluates as usual."""
+        self._prefetch(rpn_tokens)
+        try:
+            return super()._evaluate_rpn(rpn_tokens)
+        finally:
+            self._local.prefetched = None
+
+    def _explain_rpn(self, rpn_tokens: List[str]) -> str:
+        self._prefetch(rpn_tokens)
+        try:
+            return super()._explain_rpn(rpn_tokens)
+        finally:
+            self._local.prefetched = None
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates term/phrase, returning {doc_id: tfidf_score} from the decoded blobs."""
+        doc_ids = self.doc_ids
+        if " " not in operand: # Single term
+            blob = self._blob(operand)
+            if blob is None: return {}
+            idf = self._idf(blob.df)
+            if idf == 0: return {}
+            return {doc_ids[d]: tf * idf for d, tf in zip(blob.docs, blob.tfs)}
+
+        # Phrase: matched on the decoded positions
+        phrase_tokens = operand.split(" ")
+        blobs = {term: self._blob(term) for term in phrase_tokens}
+        if any(blob is None for blob in blobs.values()): return {}
+        idfs = {term: self._idf(blob.df) for term, blob in blobs.items()}
+        return {doc_ids[d]: score for d, score in phrase_scores(blobs, phrase_tokens, idfs).items()}
+
+    # --- Other methods ---
+    def delete_index(self, index_id: str) -> None:
+        """Delete all Redis keys of index_id and remove it from the registry."""
+        print(f"[{self.identifier_short}] Deleting Redis blob index '{index_id}'...")
+        self._connect_redis()
+        print(f"[{self.identifier_short}] Deleted {self._delete_keys(index_id)} keys from Redis.")
+        self.indices.discard(index_id)
+        self._save_registry()
+        if self.current_index_id == index_id:
+            self._close_redis()
+            self.doc_ids, self.df_cache, self.generation = {}, {}, None
+        self._invalidate_query_cache()
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Return the sorted doc IDs of index_id."""
+        self.load_index(index_id)
+        return sorted(self.doc_ids.values())
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Incremental update in three round trips, whatever the number of changed docs:
+        1. doc_nums and forward-index sets of the removed (and re-added) docs, counters
+        2. the blobs of every touched term
+        3. one MULTI/EXEC writing the rewritten blobs (removed docs dropped, added docs
+           appended with fresh doc_nums), forward index, doc map, counters and generation
+        Terms left without postings are deleted. Queries after this see the new generation.
+        """
+        print(f"[{self.identifier_short}] Updating Redis blob index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+        self._connect_redis()
+        if not self.redis_conn: raise RuntimeError("Redis connection failed.")
+        r = self.redis_conn
+        prefix = f"idx:{index_id}"
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids = sorted(remove_ids | set(additions))
+
+        # 1. removed docs and counters
+        pipe = r.pipeline(transaction=False)
+        pipe.get(f"{prefix}:meta:next_doc")
+        pipe.get(f"{prefix}:meta:doc_count")
+        pipe.get(f"{prefix}:meta:term_count")
+        for doc_id in remove_ids:
+            pipe.hget(f"{prefix}:meta:doc_nums", doc_id)
+            pipe.smembers(f"{prefix}:doc:{doc_id}")
+        next_doc, doc_count, term_count, *replies = self._execute(pipe)
+        next_doc, doc_count, term_count = int(next_doc or 0), int(doc_count or 0), int(term_count or 0)
+
+        removed_ids, removed_nums, touched = [], set(), set()
+        for i, doc_id in enumerate(remove_ids):
+            num, doc_terms = replies[2 * i], replies[2 * i + 1]
+            if num is None: continue
+            removed_ids.append(doc_id)
+            removed_nums.add(int(num))
+            touched.update(term.decode() for term in doc_terms)
+
+        builder = PostingsBuilder()
+        added_nums: Dict[str, int] = {}
+        forward: List[Tuple[str, List[str]]] = []
+        for doc_id, content in additions.items():
+            added_nums[doc_id] = next_doc
+            term_positions = self._term_positions(content)
+            builder.add(next_doc, term_positions)
+            forward.append((doc_id, list(term_positions)))
+            next_doc += 1
+        touched.update(builder.postings)
+        touched = sorted(touched)
+
+        # 2. blobs of the touched terms
+        pipe = r.pipeline(transaction=False)
+        for term in touched:
+            pipe.get(f"{prefix}:term:{term}")
+        blobs = self._execute(pipe) if touched else []
+
+        # 3. write everything at once
+        pipe = r.pipeline(transaction=True)
+        for term, data in zip(touched, blobs):
+            if data:
+                docs, tfs, positions = drop_docs(*self._unpack_blob(data), removed_nums)
+            else:
+                docs, tfs, positions = array('I'), array('I'), array('I')
+                term_count += 1
+            if term in builder.postings:
+                added = builder.postings[term]
+                docs.extend(added[0]); tfs.extend(added[1]); positions.extend(added[2])
+            if docs:
+                pipe.set(f"{prefix}:term:{term}", self._encode_blob(docs, tfs, positions))
+            else:
+                pipe.delete(f"{prefix}:term:{term}")
+                term_count -= 1
+        for doc_id in removed_ids:
+            pipe.delete(f"{prefix}:doc:{doc_id}")
+        if removed_ids: pipe.hdel(f"{prefix}:meta:doc_nums", *removed_ids)
+        for doc_id, terms in forward:
+            if terms: pipe.sadd(f"{prefix}:doc:{doc_id}", *terms)
+        if added_nums: pipe.hset(f"{prefix}:meta:doc_nums", mapping=added_nums)
+        doc_count += len(added_nums) - len(removed_ids)
+        pipe.set(f"{prefix}:meta:doc_count", doc_count)
+        pipe.set(f"{prefix}:meta:term_count", term_count)
+        pipe.set(f"{prefix}:meta:next_doc", next_doc)
+        pipe.incr(f"{prefix}:meta:generation")
+        self._execute(pipe)
+        self._invalidate_query_cache()
+
+        print(f"[{self.identifier_short}] Update complete: -{len(removed_ids)} / +{len(additions)} docs. "
+              f"docs={doc_count}, terms={term_count}")
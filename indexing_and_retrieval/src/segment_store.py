@@ -0,0 +1,274 @@
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, Dict, Any, List, Iterator
+
+from compact_index import CompactPostings, SelfIndexCompact
+
+# ----------------------
+# Segment file format (version 1)
+# ----------------------
+# [header][section table][section 0][section 1]...
+# - header: magic, version, big-endian flag, section count, doc_count, term_count
+# - section table: (offset, length) in bytes for every entry of SECTIONS, in order
+# - sections are raw machine arrays (typecode below) or utf-8 blobs, 8-byte aligned
+# Strings (terms, doc ids, doc texts) are stored as one blob + an offsets array,
+# string i being blob[offsets[i]:offsets[i+1]].
+SEGMENT_MAGIC = b"SIXSEG\x00\x00"
+SEGMENT_VERSION = 1
+
+SECTIONS = (
+    # term dictionary (sorted terms)
+    ("term_blob", "B"),
+    ("term_str_offsets", "Q"),
+    # postings, same layout as CompactPostings
+    ("term_offsets", "Q"),
+    ("post_docs", "I"),
+    ("post_tfs", "I"),
+    ("pos_offsets", "Q"),
+    ("positions", "I"),
+    # doc table, indexed by internal doc id
+    ("docid_blob", "B"),
+    ("docid_offsets", "Q"),
+    ("original_blob", "B"),
+    ("original_offsets", "Q"),
+    ("clean_blob", "B"),
+    ("clean_offsets", "Q"),
+)
+
+HEADER = struct.Struct("<8sHBxIQQ")
+SECTION_ENTRY = struct.Struct("<QQ")
+
+
+def _pack_strings(strings: Iterable[str]):
+    """Returns (utf-8 blob, offsets array) for a sequence of strings."""
+    offsets = array("Q", [0])
+    parts: List[bytes] = []
+    total = 0
+    for s in strings:
+        b = (s or "").encode("utf-8")
+        parts.append(b)
+        total += len(b)
+        offsets.append(total)
+    return b"".join(parts), offsets
+
+
+class StringTable:
+    """Strings stored as blob + offsets; each item is decoded only when accessed."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class SegmentDocTable(Mapping):
+    """
+    Read-only {doc_id: {'original':..., 'clean':...}} view over a segment's doc table.
+    Doc texts stay in the mmap until a document is actually looked up.
+    """
+
+    def __init__(self, doc_ids: List[str], doc_index: Dict[str, int], original: StringTable, clean: StringTable):
+        self._doc_ids = doc_ids
+        self._doc_index = doc_index
+        self._original = original
+        self._clean = clean
+
+    def __getitem__(self, doc_id: str) -> Dict[str, str]:
+        i = self._doc_index[doc_id]
+        return {'original': self._original[i], 'clean': self._clean[i]}
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._doc_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._doc_ids)
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+
+def write_segment(path: Path, postings: CompactPostings, docs: Mapping) -> None:
+    """
+    Write postings and their doc table as a segment file.
+    Written to a temp file first and renamed, so readers never see a partial segment
+    (and processes still mapping the old file keep a valid view on POSIX).
+    """
+    path = Path(path)
+    doc_ids = postings.doc_ids
+    term_blob, term_str_offsets = _pack_strings(postings.terms)
+    docid_blob, docid_offsets = _pack_strings(doc_ids)
+    original_blob, original_offsets = _pack_strings(docs[d]['original'] for d in doc_ids)
+    clean_blob, clean_offsets = _pack_strings(docs[d]['clean'] for d in doc_ids)
+
+    data = {
+        "term_blob": term_blob,
+        "term_str_offsets": term_str_offsets,
+        "term_offsets": postings.term_offsets,
+        "post_docs": postings.post_docs,
+        "post_tfs": postings.post_tfs,
+        "pos_offsets": postings.pos_offsets,
+        "positions": postings.positions,
+        "docid_blob": docid_blob,
+        "docid_offsets": docid_offsets,
+        "original_blob": original_blob,
+        "original_offsets": original_offsets,
+        "clean_blob": clean_blob,
+        "clean_offsets": clean_offsets,
+    }
+
+    write_segment_sections(path, len(doc_ids), len(postings.terms), data)
+
+
+def write_segment_sections(path: Path, doc_count: int, term_count: int, data: Dict[str, Any]) -> None:
+    """
+    Low-level writer: `data` maps every name in SECTIONS to either an in-memory buffer
+    (bytes / array) or a Path whose raw contents are copied in (used by the SPIMI merge).
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, sys.byteorder == "big",
+                            len(SECTIONS), doc_count, term_count))
+        table_start = f.tell()
+        f.write(b"\0" * SECTION_ENTRY.size * len(SECTIONS))
+
+        entries = []
+        for name, _ in SECTIONS:
+            f.write(b"\0" * (-f.tell() % 8))
+            start = f.tell()
+            source = data[name]
+            if isinstance(source, Path):
+                with open(source, "rb") as src:
+                    shutil.copyfileobj(src, f, 1024 * 1024)
+            else:
+                f.write(source)
+            entries.append((start, f.tell() - start))
+
+        f.seek(table_start)
+        for entry in entries:
+            f.write(SECTION_ENTRY.pack(*entry))
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """
+    Read-only mmap of a segment file. Every section is a zero-copy memoryview into
+    the mapping, so opening costs O(header) and pages are read on first touch.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._mmap)
+
+        if len(mv) < HEADER.size:
+            raise ValueError(f"Not an index segment (file too small): {self.path}")
+        magic, version, big_endian, n_sections, self.doc_count, self.term_count = HEADER.unpack_from(mv, 0)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not an index segment: {self.path}")
+        if version != SEGMENT_VERSION or n_sections != len(SECTIONS):
+            raise ValueError(f"Unsupported segment version {version} (expected {SEGMENT_VERSION}): {self.path}")
+
+        # Segments written on a machine with the other byte order are copied and swapped
+        swap = bool(big_endian) != (sys.byteorder == "big")
+        self.sections: Dict[str, Any] = {}
+        for i, (name, typecode) in enumerate(SECTIONS):
+            offset, length = SECTION_ENTRY.unpack_from(mv, HEADER.size + i * SECTION_ENTRY.size)
+            raw = mv[offset:offset + length]
+            if typecode == "B":
+                self.sections[name] = raw
+            elif swap:
+                arr = array(typecode)
+                arr.frombytes(raw)
+                arr.byteswap()
+                self.sections[name] = arr
+            else:
+                self.sections[name] = raw.cast(typecode)
+
+    def strings(self, prefix: str) -> StringTable:
+        return StringTable(self.sections[f"{prefix}_blob"], self.sections[f"{prefix}_offsets"])
+
+    def to_index_data(self) -> Dict[str, Any]:
+        """Build the usual index_data dict on top of the mapped sections."""
+        s = self.sections
+        # Only the term dictionary and doc ids are decoded up front
+        terms = list(StringTable(s["term_blob"], s["term_str_offsets"]))
+        doc_ids = list(self.strings("docid"))
+        postings = CompactPostings(doc_ids, terms, s["term_offsets"], s["post_docs"],
+                                   s["post_tfs"], s["pos_offsets"], s["positions"])
+        docs = SegmentDocTable(doc_ids, postings.doc_index, self.strings("original"), self.strings("clean"))
+        return {
+            "inverted_index": postings,
+            "docs": docs,
+            "doc_count": self.doc_count,
+            "terms_count": self.term_count,
+        }
+
+
+class SelfIndexSegment(SelfIndexCompact):
+    """
+    Compact TF-IDF index persisted as a memory-mapped binary segment (DataStore.SEGMENT).
+    - create/update build CompactPostings in memory, then write one `{index_id}.seg` file
+    - load_index maps the file; startup cost is the term dictionary, not the postings,
+      and processes loading the same segment share the page cache
+    - the optional next-word index (create_index(next_word_min_df=...)) is pickled next
+      to the segment as `{index_id}.nw` and loaded with it
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_segment"):
+        super().__init__(core, info, 'SEGMENT', qproc, compr, optim, preprocess_fn, storage_path)
+
+    def _get_index_filepath(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.seg"
+
+    def _next_word_path(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.nw"
+
+    def _save_index_to_file(self, index_id: str):
+        write_segment(self._get_index_filepath(index_id),
+                      self.index_data["inverted_index"], self.index_data["docs"])
+        next_word_path = self._next_word_path(index_id)
+        next_word = self.index_data.get("next_word")
+        if next_word is not None:
+            tmp_path = next_word_path.with_name(next_word_path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(next_word, f)
+            os.replace(tmp_path, next_word_path)
+        else:
+            next_word_path.unlink(missing_ok=True)
+        self._set_loaded(index_id)
+
+    def _load_index_from_file(self, index_id: str):
+        path = self._get_index_filepath(index_id)
+        if not path.exists():
+            raise FileNotFoundError(f"Index file not found: {path}")
+        self.index_data = Segment(path).to_index_data()
+        next_word_path = self._next_word_path(index_id)
+        if next_word_path.exists():
+            with open(next_word_path, "rb") as f:
+                self.index_data["next_word"] = pickle.load(f)
+        self._set_loaded(index_id)
+
+    def _read_doc_ids(self, index_id: str) -> List[str]:
+        return sorted(Segment(self._get_index_filepath(index_id)).strings("docid"))
+
+    def delete_index(self, index_id: str) -> None:
+        super().delete_index(index_id)
+        self._next_word_path(index_id).unlink(missing_ok=True)
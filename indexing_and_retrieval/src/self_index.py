@@ -0,0 +1,1200 @@
+import heapq
+import json
+import pickle
+import re
+import math
+import multiprocessing
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Tuple, Dict, Any, List, Set, Optional
+from collections import defaultdict
+
+from index_base import IndexBase, IndexInfo, Optimizations
+from footprint import approx_sizeof
+from doc_store import DocStore, generation_files
+from bitmap_postings import BitmapPostings, Container, evaluate as evaluate_containers
+from query_cache import QueryCache
+from query_planner import PlanNode, build_tree, plan_tree, execute
+from phrase_match import phrase_count
+from term_dict import EXPANSION_CHARS, EXPANSION_RE, TermDictionary, auto_edits
+from query_trace import QueryTracer, count, dumps, query_log, span, traced_query
+
+
+class SelfIndex(IndexBase):
+    """
+    Simple self-contained inverted index implementation.
+    - Boolean index with term positions (x=1)
+    - Stores index on disk using pickle (y=1)
+    - Supports boolean queries with parentheses and NOT/AND/OR precedence
+    """
+
+    TOKEN_RE = re.compile(r"[A-Za-z0-9]+|[^\s]")  # keep simple tokens (alphanum groups, or single non-space char)
+    # query() may run on several threads at once (query_server); datastores whose
+    # connection is bound to the thread that opened it set this to False
+    concurrent_queries = True
+    # Most terms a wildcard/fuzzy query word expands to (see expand_term)
+    max_expansions = 50
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage"):
+        super().__init__(core, info, dstore, qproc, compr, optim)
+
+        self.preprocess_fn = preprocess_fn
+        self.storage_path = Path(storage_path)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+
+        self.index_registry_file = self.storage_path / "index_registry.json"
+        self._load_registry()
+
+        # in-memory loaded index (populated by load_index or create_index)
+        # internal structure after load/save:
+        # self.index_data = {
+        #   "inverted_index": { term: {doc_id: [pos, ...], ...}, ... },
+        #   "docs": { doc_id: original_text, ... },
+        #   "doc_count": int,
+        #   "terms_count": int,
+        #   "bitmaps": BitmapPostings (optim='Bitmap' only)
+        # }
+        self.index_data: Dict[str, Any] = {}
+        self._loaded_id: Optional[str] = None # index whose data index_data holds
+        self._term_dict: Optional[TermDictionary] = None # built on first use if not persisted
+
+        # optional plan/result cache (enable_query_cache); invalidated on every index mutation
+        self.query_cache: Optional[QueryCache] = None
+        # optional sampled per-query tracing (enable_tracing)
+        self.tracer: Optional[QueryTracer] = None
+
+    # ----------------------
+    # Query cache
+    # ----------------------
+    def enable_query_cache(self, max_plans: int = 4096, max_result_bytes: int = 64 * 1024 * 1024,
+                           max_results: Optional[int] = None) -> QueryCache:
+        """
+        Attach a two-level LRU cache to this instance: normalized query -> RPN, and
+        (index generation, RPN, top_k) -> results within max_result_bytes.
+        create/load/update/delete_index invalidate the cached results.
+        """
+        self.query_cache = QueryCache(max_plans=max_plans, max_result_bytes=max_result_bytes, max_results=max_results)
+        return self.query_cache
+
+    def disable_query_cache(self) -> None:
+        self.query_cache = None
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of both cache levels ({} when caching is off)."""
+        return self.query_cache.stats() if self.query_cache is not None else {}
+
+    def _set_loaded(self, index_id: Optional[str]) -> None:
+        """index_data now holds index_id (None: nothing): record it and start a new cache generation."""
+        self._loaded_id = index_id
+        self._invalidate_query_cache()
+
+    def _invalidate_query_cache(self) -> None:
+        # Called on every index mutation: the vocabulary may have changed as well
+        self._term_dict = None
+        if self.query_cache is not None:
+            self.query_cache.invalidate(stale_plan=EXPANSION_CHARS.search)
+
+    # ----------------------
+    # Tracing (see query_trace.py)
+    # ----------------------
+    def enable_tracing(self, sample_rate: float = 1.0, keep_traces: int = 64,
+                       slow_ms: Optional[float] = None) -> QueryTracer:
+        """
+        Trace 1 in round(1 / sample_rate) queries: span tree (parse, plan, fetch, rank,
+        serialize...) with timings and counters, aggregated into per-stage histograms.
+        Traces at least slow_ms long are kept apart and logged.
+        """
+        self.tracer = QueryTracer(sample_rate=sample_rate, keep_traces=keep_traces, slow_ms=slow_ms)
+        return self.tracer
+
+    def disable_tracing(self) -> None:
+        self.tracer = None
+
+    def trace_stats(self) -> Dict[str, Any]:
+        """Histograms, counters and kept traces of the tracer ({} when tracing is off)."""
+        return self.tracer.export() if self.tracer is not None else {}
+
+    def trace_query(self, query: str, **kwargs) -> Tuple[str, Dict[str, Any]]:
+        """query(query, **kwargs) traced whatever the sampling (tracing need not be enabled): (results json, trace)."""
+        tracer = self.tracer or QueryTracer(keep_traces=1)
+        with tracer.forced():
+            result = self.query(query, **kwargs)
+        return result, tracer.last()
+
+    @contextmanager
+    def batch_scope(self, queries: List[str]):
+        """
+        Context for a batch of queries run on one thread (query_server /batch): datastores
+        fetch the postings of every query word once, up front. In memory there is nothing to share.
+        """
+        yield
+
+    def _query_words(self, queries: List[str]) -> List[str]:
+        """Every word of the terms/phrases of queries, sorted; unparsable queries are skipped."""
+        words = set()
+        for query in queries:
+            try:
+                rpn = self._parse_query(query)
+            except Exception:
+                continue
+            words.update(word for tok in rpn if tok not in ("AND", "OR", "NOT") for word in tok.split(" "))
+        return sorted(words)
+
+    def _compile_query(self, query: str) -> List[str]:
+        with span("tokenize"):
+            tokens = self._tokenize_query(query)
+        with span("shunting_yard"):
+            return self._shunting_yard(tokens)
+
+    def _parse_query(self, query: str) -> List[str]:
+        """Query string -> RPN (_tokenize_query + _shunting_yard), through the plan cache if enabled."""
+        with span("parse"):
+            if self.query_cache is None:
+                return self._compile_query(query)
+            compiled = []
+            rpn = self.query_cache.plan(query, lambda q: compiled.append(q) or self._compile_query(q))
+            if not compiled: count("plan_cache_hits")
+            return list(rpn)
+
+    def _cached_results(self, rpn: List[str], compute, top_k: Optional[int] = None):
+        """compute() -> results, memoized per (index generation, rpn, top_k) if caching is enabled."""
+        with span("evaluate"):
+            if self.query_cache is None:
+                return compute()
+            computed = []
+            results = self.query_cache.results(tuple(rpn), top_k, lambda: computed.append(True) or compute())
+            if not computed: count("result_cache_hits")
+            return results
+
+    # ----------------------
+    # Registry helpers
+    # ----------------------
+    def _load_registry(self):
+        try:
+            with open(self.index_registry_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                if isinstance(data, list):
+                    self.indices = set(data)
+                else:
+                    # resilience against malformed file
+                    self.indices = set()
+        except FileNotFoundError:
+            self.indices = set()
+
+    def _save_registry(self):
+        with open(self.index_registry_file, "w", encoding="utf-8") as f:
+            json.dump(sorted(list(self.indices)), f, indent=2)
+
+    def _get_index_filepath(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.pkl"
+
+    # ----------------------
+    # Tokenization / normalize
+    # ----------------------
+    @classmethod
+    def _tokenize(cls, text: str) -> List[str]:
+        """
+        Normalize + tokenize text into tokens preserving deterministic positions.
+        Lowercases tokens and splits on TOKEN_RE (alphanumeric groups or single non-space char).
+        """
+        if text is None:
+            return []
+        text = text.lower()
+        # simple tokenization: sequences of ascii letters/digits or single non-whitespace chars
+        tokens = cls.TOKEN_RE.findall(text)
+        return tokens
+
+    # ----------------------
+    # Persistence helpers
+    # ----------------------
+    # Every create/update goes through _save_index_to_file and every (re)load through
+    # _load_index_from_file, so both call _set_loaded; overrides that do not call
+    # super() must call it themselves
+    def _save_index_to_file(self, index_id: str):
+        path = self._get_index_filepath(index_id)
+        vocabulary = self._vocabulary()
+        if vocabulary is not None:
+            self.index_data["term_dict"] = TermDictionary(vocabulary)
+        with open(path, "wb") as f:
+            pickle.dump(self.index_data, f)
+        self._set_loaded(index_id)
+
+    def _load_index_from_file(self, index_id: str):
+        path = self._get_index_filepath(index_id)
+        if not path.exists():
+            raise FileNotFoundError(f"Index file not found: {path}")
+        with open(path, "rb") as f:
+            self.index_data = pickle.load(f)
+        self._set_loaded(index_id)
+
+    def _read_doc_ids(self, index_id: str) -> List[str]:
+        """Sorted doc ids of a stored index, read without loading it (the loaded index is untouched)."""
+        with open(self._get_index_filepath(index_id), "rb") as f:
+            docs = pickle.load(f).get("docs", {})
+        doc_ids = sorted(docs.keys())
+        if isinstance(docs, DocStore):
+            docs.close()
+        return doc_ids
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held in memory by the loaded index (index_manager's budget unit)."""
+        return approx_sizeof(self.index_data)
+
+    # ----------------------
+    # Abstract method implementations
+    # ----------------------
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Build inverted index from iterable of (doc_id, content_text).
+        Persist index and update registry.
+        """
+        print(f"[{self.identifier_short}] Creating index: {index_id}")
+
+        inverted_index: Dict[str, Dict[str, List[int]]] = {}
+        docs: Dict[str, str] = {}
+        doc_count = 0
+
+        for doc_id, content in files:
+            if doc_id is None:
+                raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str):
+                doc_id = str(doc_id)
+
+            tokens = self.preprocess_fn(content)
+            docs[doc_id] = content
+            doc_count += 1
+            for pos, term in enumerate(tokens):
+                postings = inverted_index.setdefault(term, {})
+                postings.setdefault(doc_id, []).append(pos)
+
+        self.index_data = {
+            "inverted_index": inverted_index,
+            "docs": docs,
+            "doc_count": doc_count,
+            "terms_count": len(inverted_index),
+        }
+        self._refresh_bitmaps()
+
+        # persist
+        self._save_index_to_file(index_id)
+
+        # registry
+        self.indices.add(index_id)
+        self._save_registry()
+
+        print(f"[{self.identifier_short}] Index '{index_id}' created: {doc_count} docs, {len(inverted_index)} terms.")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
+
+    def load_index(self, serialized_index_dump: str) -> None:
+        """Load index identified by index_id into memory (self.index_data)."""
+        index_id = serialized_index_dump
+        if index_id not in self.indices and not self._get_index_filepath(index_id).exists():
+            raise FileNotFoundError(f"Index '{index_id}' not registered and no file found.")
+        print(f"[{self.identifier_short}] Loading index '{index_id}'...")
+        self._load_index_from_file(index_id)
+        print(f"[{self.identifier_short}] Loaded index: docs={self.index_data.get('doc_count',0)}, terms={self.index_data.get('terms_count',0)}")
+
+    def update_index(self, index_id: str,
+                        remove_files: Iterable[Tuple[str, str]],
+                        add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Remove doc_ids (from remove_files) and add new docs (add_files).
+        Note: remove_files/add_files are iterables of (doc_id, content). For removal only the doc_id is required.
+        """
+        print(f"[{self.identifier_short}] Updating index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        # load index into memory
+        self._load_index_from_file(index_id)
+        inverted_index = self.index_data["inverted_index"]
+        docs = self.index_data["docs"]
+
+        # ---------- removals ----------
+        remove_ids = [doc_id for doc_id, _ in remove_files] if remove_files else []
+        for rid in remove_ids:
+            if rid not in docs:
+                continue
+            # remove all occurrences from inverted_index
+            self._remove_doc_postings(inverted_index, rid, docs[rid])
+            # remove doc from docs map
+            del docs[rid]
+
+        # ---------- additions ----------
+        for doc_id, content in add_files or []:
+            if doc_id in docs:
+                # if doc already present, treat as replacement: remove old then re-add
+                # remove old postings first
+                self._remove_doc_postings(inverted_index, doc_id, docs[doc_id])
+                del docs[doc_id]
+
+            docs[doc_id] = self._add_doc_postings(inverted_index, doc_id, content)
+
+        # update counts and persist
+        self.index_data["inverted_index"] = inverted_index
+        self.index_data["docs"] = docs
+        self.index_data["doc_count"] = len(docs)
+        self.index_data["terms_count"] = len(inverted_index)
+        self._refresh_bitmaps()
+        self._save_index_to_file(index_id)
+        print(f"[{self.identifier_short}] Update complete. docs={self.index_data['doc_count']}, terms={self.index_data['terms_count']}")
+
+    def _add_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, content: str) -> Any:
+        """Add doc_id to the postings of its terms; returns the doc to store. x=1: {doc_id: [pos, ...]}, raw text."""
+        for pos, term in enumerate(self.preprocess_fn(content)):
+            postings = inverted_index.setdefault(term, {})
+            postings.setdefault(doc_id, []).append(pos)
+        return content
+
+    def _remove_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, doc: Any) -> None:
+        """
+        Delete doc_id from the postings of its own terms only. The stored doc acts as the
+        forward index: its 'clean' text (x=3) or its content re-analyzed (x=1, x=2).
+        """
+        text = doc['clean'].split() if isinstance(doc, dict) else self.preprocess_fn(doc)
+        for term in set(text):
+            postings = inverted_index.get(term)
+            if postings is not None and doc_id in postings:
+                del postings[doc_id]
+                # drop term if no postings remain
+                if not postings:
+                    del inverted_index[term]
+
+    def _get_postings_set(self, term: str) -> Set[str]:
+        """Return set of doc_ids containing term (term should be normalized lowercased)."""
+        if not self.index_data:
+            raise RuntimeError("No index loaded. Call load_index(index_id) first.")
+        inverted_index = self.index_data["inverted_index"]
+        return set(inverted_index.get(term, {}).keys())
+
+    # ----------------------
+    # Term expansion (see term_dict.py)
+    # ----------------------
+    def _vocabulary(self) -> Optional[Iterable[str]]:
+        """Every indexed term (None if this datastore cannot list them)."""
+        inverted_index = self.index_data.get("inverted_index")
+        if inverted_index is None:
+            return None
+        return getattr(inverted_index, "terms", inverted_index) # CompactPostings/BlockPostings or dict
+
+    def term_dictionary(self) -> Optional[TermDictionary]:
+        """Sorted term dictionary of the loaded index: persisted with it, or built on first use."""
+        term_dict = self.index_data.get("term_dict") or self._term_dict
+        if term_dict is None:
+            vocabulary = self._vocabulary()
+            if vocabulary is None:
+                return None
+            with span("build_term_dict"):
+                term_dict = self._term_dict = TermDictionary(vocabulary)
+        return term_dict
+
+    def expand_term(self, pattern: str) -> List[str]:
+        """
+        Indexed terms matching a query word pattern, at most max_expansions:
+        - "heal*", "h?alth": wildcards, lowercased but not analyzed; highest df kept
+        - "helth~", "helth~2": terms within 2 edits of the analyzed word (no count:
+          Elasticsearch's AUTO, by length); closest kept
+        """
+        term_dict = self.term_dictionary()
+        if term_dict is None:
+            raise ValueError(f"Term expansion is not supported by this datastore: {pattern}")
+        with span("expand"):
+            if "~" in pattern:
+                word, _, edits = pattern.partition("~")
+                analyzed = self.preprocess_fn(word)
+                if len(analyzed) != 1: # a stopword, or several words
+                    return []
+                terms = [term for term, _ in term_dict.fuzzy(analyzed[0], int(edits) if edits else auto_edits(analyzed[0]))]
+            else:
+                terms = term_dict.wildcard(pattern.lower())
+                if len(terms) > self.max_expansions:
+                    terms.sort(key=self._doc_freq, reverse=True) # stable: ties stay sorted
+            terms = terms[:self.max_expansions]
+            count("expansions", len(terms))
+            return terms
+
+    def _expansion_tokens(self, pattern: str) -> List[str]:
+        """Query tokens for a pattern: ( t1 OR t2 ... ), or the pattern itself (matches nothing)."""
+        if self.term_dictionary() is None: # plain words, as before expansion existed
+            return self.preprocess_fn(pattern)
+        terms = self.expand_term(pattern)
+        if len(terms) <= 1:
+            return terms or [pattern]
+        tokens = ["("]
+        for term in terms:
+            tokens += [term, "OR"]
+        tokens[-1] = ")"
+        return tokens
+
+    # ----------------------
+    # Boolean query parser + evaluator
+    # ----------------------
+    def _shunting_yard(self, tokens: List[str]) -> List[str]:
+        """
+        Convert list of tokens (terms and operators) into RPN (postfix) using shunting-yard algorithm.
+        Operators: NOT (unary), AND, OR.
+        Precedence: NOT > AND > OR
+        All operators are left-associative except NOT which is right/unary.
+        """
+        out_queue: List[str] = []
+        op_stack: List[str] = []
+
+        precedence = {"NOT": 3, "AND": 2, "OR": 1}
+        # NOTE: treat NOT as unary operator
+
+        for tok in tokens:
+            t = tok.upper()
+            if t in ("AND", "OR", "NOT"):
+                # operator
+                while op_stack:
+                    top = op_stack[-1]
+                    if top == "(":
+                        break
+                    if (precedence.get(top, 0) > precedence[t]) or (precedence.get(top, 0) == precedence[t] and t != "NOT"):
+                        out_queue.append(op_stack.pop())
+                    else:
+                        break
+                op_stack.append(t)
+            elif tok == "(":
+                op_stack.append(tok)
+            elif tok == ")":
+                while op_stack and op_stack[-1] != "(":
+                    out_queue.append(op_stack.pop())
+                if not op_stack:
+                    raise ValueError("Mismatched parentheses in query")
+                op_stack.pop()  # remove "("
+            else:
+                # operand (term)
+                out_queue.append(tok)
+        while op_stack:
+            top = op_stack.pop()
+            if top in ("(", ")"):
+                raise ValueError("Mismatched parentheses in query")
+            out_queue.append(top)
+        return out_queue
+
+    def _tokenize_query(self, query: str) -> List[str]:
+        """
+        Tokenize a query according to README grammar...
+        """
+        if not query:
+            return []
+
+        tokens: List[str] = []
+        # quoted term/phrase | operator or parenthesis | wildcard/fuzzy word (term_dict.EXPANSION_RE)
+        pattern = re.compile(r'"([^"]+)"|(\(|\)|\bAND\b|\bOR\b|\bNOT\b)|(?<![^\s()"])(' + EXPANSION_RE.pattern +
+                             r')(?=[\s()"]|$)', flags=re.IGNORECASE)
+        idx = 0
+        for m in pattern.finditer(query):
+            # add any stray content between matches
+            if m.start() > idx:
+                stray = query[idx:m.start()].strip()
+                if stray:
+                    
+                    # --- FIX FOR UNQUOTED TERMS ---
+                    # OLD: tokens.extend([s for s in stray.split() if s])
+                    stray_tokens = self.preprocess_fn(stray)
+                    tokens.extend(stray_tokens)
+                    # --- END FIX ---
+
+            idx = m.end()
+
+            quoted = m.group(1)
+            other = m.group(2)
+            expansion = m.group(3)
+            if quoted is not None and EXPANSION_RE.fullmatch(quoted.strip()):
+                expansion = quoted.strip()
+            if expansion is not None:
+                tokens.extend(self._expansion_tokens(expansion))
+
+            elif quoted is not None:
+                
+                # --- FIX FOR QUOTED TERMS/PHRASES ---
+                # OLD: tokens.append(" ".join(self._tokenize(quoted)))
+                processed_tokens = self.preprocess_fn(quoted)
+                tokens.append(" ".join(processed_tokens))
+                # --- END FIX ---
+                
+            elif other is not None:
+                up = other.upper()
+                if up in ("AND", "OR", "NOT"):
+                    tokens.append(up)
+                else:
+                    tokens.append(other)
+                    
+        # trailing content after last match
+        if idx < len(query):
+            tail = query[idx:].strip()
+            if tail:
+                
+                # --- FIX FOR TRAILING TERMS ---
+                # OLD: tokens.extend([t for t in tail.split() if t])
+                tail_tokens = self.preprocess_fn(tail)
+                tokens.extend(tail_tokens)
+                # --- END FIX ---
+                
+        return tokens
+    
+    def _eval_term_to_set(self, term: str) -> Set[str]:
+        """
+        Evaluate a single operand (normalized term or multi-token phrase) and return
+        the set of doc_ids matching it.
+
+        - If `term` contains spaces -> treat as phrase ("flu vaccine"):
+            match documents where tokens appear consecutively in order.
+        - Otherwise -> single-term lookup using positional postings.
+        """
+        if not self.index_data:
+            raise RuntimeError("No index loaded. Call load_index(index_id) first.")
+        inverted_index = self.index_data["inverted_index"]
+
+        # single term
+        if " " not in term:
+            return set(inverted_index.get(term, {}).keys())
+
+        # phrase: sequence of tokens
+        phrase_tokens = term.split(" ")
+        # if any phrase token not in index, no docs match
+        for t in phrase_tokens:
+            if t not in inverted_index:
+                return set()
+
+        # walk the docs of the rarest token, requiring presence of all the others
+        all_postings = [inverted_index[t] for t in phrase_tokens]  # dict: doc_id -> [pos,...]
+        matched_docs = set()
+        for doc in min(all_postings, key=len):
+            if not all(doc in postings for postings in all_postings):
+                continue
+            # positional merge of the sorted position lists (stops at the first occurrence)
+            if phrase_count([postings[doc] for postings in all_postings], first_only=True):
+                matched_docs.add(doc)
+        return matched_docs
+
+    # ----------------------
+    # Query planner (see query_planner.py)
+    # ----------------------
+    def _doc_freq(self, term: str) -> int:
+        """Number of docs containing term (planner cost estimate)."""
+        return len(self.index_data["inverted_index"].get(term, ()))
+
+    def _universe_size(self) -> int:
+        return self.index_data.get("doc_count", 0)
+
+    def _universe(self) -> Set[str]:
+        """Every doc id (fresh set); only needed by a NOT that is not under an AND."""
+        return set(self.index_data["docs"].keys())
+
+    def _plan(self, rpn_tokens: List[str]) -> Optional[PlanNode]:
+        """RPN -> flattened, cost-ordered plan (None for an empty query)."""
+        with span("plan"):
+            tree = build_tree(rpn_tokens)
+            if tree is None:
+                return None
+            return plan_tree(tree, self._doc_freq, self._universe_size())
+
+    def _explain_rpn(self, rpn_tokens: List[str]) -> str:
+        plan = self._plan(rpn_tokens)
+        return plan.describe() if plan is not None else "EMPTY"
+
+    def explain(self, query: str) -> str:
+        """The plan query(query) evaluates, e.g. AND~12("covid"~12, "vaccin"~40, -"hospit"~30)."""
+        return self._explain_rpn(self._parse_query(query))
+
+    # ----------------------
+    # Bitmap postings (optim='Bitmap', boolean index only, see bitmap_postings.py)
+    # ----------------------
+    def _bitmap_postings(self) -> Optional[BitmapPostings]:
+        """Per-term array/bitmap containers; built here if the loaded index has none."""
+        if self.optim is not Optimizations.Bitmap or self.info is not IndexInfo.BOOLEAN:
+            return None
+        bitmaps = self.index_data.get("bitmaps")
+        if bitmaps is None:
+            bitmaps = self.index_data["bitmaps"] = BitmapPostings.build(self.index_data["inverted_index"],
+                                                                        self.index_data["docs"])
+        return bitmaps
+
+    def _refresh_bitmaps(self) -> None:
+        """Rebuild the containers after create/update, before the index is saved."""
+        self.index_data.pop("bitmaps", None)
+        self._bitmap_postings()
+
+    def _eval_term_to_container(self, term: str, bitmaps: BitmapPostings) -> Container:
+        if " " not in term:
+            return bitmaps.get(term)
+        return bitmaps.from_doc_ids(self._eval_term_to_set(term))
+
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Set[str]:
+        """
+        Evaluate RPN tokens where operands are normalized terms/phrases (already tokenized),
+        and operators are 'AND', 'OR', 'NOT'. The RPN is planned first: AND operands are
+        intersected rarest first and AND NOT becomes a set difference.
+        With optim='Bitmap' the plan runs over the per-term containers instead of sets
+        of doc id strings; only the final result is turned back into doc ids.
+        """
+        bitmaps = self._bitmap_postings()
+        if bitmaps is not None:
+            fetch = lambda term: self._eval_term_to_container(term, bitmaps)
+            return bitmaps.to_doc_ids(evaluate_containers(self._plan(rpn_tokens), fetch, bitmaps))
+        return execute(self._plan(rpn_tokens), self._eval_term_to_set, self._universe, scored=False)
+
+    def _evaluate_sorted(self, rpn_tokens: List[str]) -> List[str]:
+        """Matching doc ids in sorted order (the boolean query result)."""
+        bitmaps = self._bitmap_postings()
+        if bitmaps is not None:
+            fetch = lambda term: self._eval_term_to_container(term, bitmaps)
+            return bitmaps.to_sorted_doc_ids(evaluate_containers(self._plan(rpn_tokens), fetch, bitmaps))
+        return sorted(self._evaluate_rpn(rpn_tokens))
+
+    @traced_query
+    def query(self, query: str, explain: bool = False) -> str:
+        """
+        Perform boolean query against the loaded index.
+        Returns JSON string with fields: query, results (list of doc ids), count
+        (and plan, see explain(), if explain=True).
+        Supports parentheses and operators AND/OR/NOT (case-insensitive).
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying: %s", self.identifier_short, query)
+
+        # Tokenize query and convert to RPN
+        plan = None
+        try:
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            results_list = self._cached_results(rpn, lambda: self._evaluate_sorted(rpn))
+        except Exception as e:
+            # best effort: if parse failed, try single-term lookup
+            query_log.warning("[%s] Query parse error: %s. Falling back to single-term lookup.", self.identifier_short, e)
+            normalized = " ".join(self._tokenize(query))
+            results_list = sorted(self._get_postings_set(normalized))
+
+        out = {
+            "query": query,
+            "results": results_list,
+            "count": len(results_list),
+        }
+        if explain: out["plan"] = plan
+        return dumps(out)
+
+    def delete_index(self, index_id: str) -> None:
+        """Delete index file and remove entry from registry."""
+        path = self._get_index_filepath(index_id)
+        if path.exists():
+            path.unlink()
+            self.indices.discard(index_id)
+            self._save_registry()
+            # clear loaded index if it was this one
+            if self._loaded_id == index_id:
+                self.index_data = {}
+                self._set_loaded(None)
+            print(f"[{self.identifier_short}] Deleted index '{index_id}'.")
+        else:
+            print(f"[{self.identifier_short}] Index file not found for '{index_id}'.")
+
+    def list_indices(self) -> Iterable[str]:
+        return sorted(list(self.indices))
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Return list of doc IDs in index. Loads the index if not present in memory."""
+        if index_id not in self.indices and not self._get_index_filepath(index_id).exists():
+            raise FileNotFoundError(f"Index '{index_id}' not found.")
+        # load index data if empty; another loaded index is read aside and kept loaded (caches included)
+        if not self.index_data:
+            self._load_index_from_file(index_id)
+        elif self._loaded_id != index_id:
+            return self._read_doc_ids(index_id)
+        # docs is a dict of doc_id -> content
+        return sorted(list(self.index_data.get("docs", {}).keys()))
+
+
+class SelfIndexRanked(SelfIndex):
+    """
+    Extends SelfIndex to support ranking based on simple word counts (x=2).
+    - Index structure: {term: {doc_id: {'count': N, 'pos': [...]}}}
+    - Query returns ranked list of (doc_id, score)
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_ranked"):
+        # Explicitly set info to WORDCOUNT for this version
+        super().__init__(core, 'WORDCOUNT', dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        # Note: self.index_data structure will change in create_index
+
+    # --- Override create_index ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Builds inverted index storing word counts and positions.
+        """
+        print(f"[{self.identifier_short}] Creating ranked index (x=2): {index_id}")
+
+        # New structure: {term: {doc_id: {'count': N, 'pos': [...]}}}
+        inverted_index: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        docs: Dict[str, str] = {}
+        doc_count = 0
+
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+
+            tokens = self.preprocess_fn(content)
+            docs[doc_id] = content
+            doc_count += 1
+            
+            # Use defaultdict to simplify count/position tracking
+            term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+            for pos, term in enumerate(tokens):
+                term_positions_in_doc[term].append(pos)
+                
+            # Update the main inverted index
+            for term, positions in term_positions_in_doc.items():
+                inverted_index[term][doc_id] = {
+                    'count': len(positions),
+                    'pos': positions
+                }
+
+        # Store the new structure
+        self.index_data = {
+            "inverted_index": dict(inverted_index), # Convert back from defaultdict
+            "docs": docs,
+            "doc_count": doc_count,
+            "terms_count": len(inverted_index),
+        }
+
+        # Persistence and registry are the same as parent class
+        self._save_index_to_file(index_id)
+        self.indices.add(index_id)
+        self._save_registry()
+
+        print(f"[{self.identifier_short}] Ranked index '{index_id}' created: {doc_count} docs, {len(inverted_index)} terms.")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
+
+    # --- Override update_index helper ---
+    def _add_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, content: str) -> Any:
+        """x=2 postings: {doc_id: {'count': N, 'pos': [...]}}; the raw text is stored."""
+        term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+        for pos, term in enumerate(self.preprocess_fn(content)):
+            term_positions_in_doc[term].append(pos)
+        for term, positions in term_positions_in_doc.items():
+            inverted_index.setdefault(term, {})[doc_id] = {'count': len(positions), 'pos': positions}
+        return content
+
+    # --- Override query evaluation helpers ---
+
+    def _get_term_postings_with_counts(self, term: str) -> Dict[str, int]:
+        """Returns {doc_id: count} for a single term."""
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+        inverted_index = self.index_data["inverted_index"]
+        # postings = {'doc1': {'count': 2, 'pos': [1,5]}, 'doc2': {'count': 1, 'pos': [3]}}
+        postings = inverted_index.get(term, {})
+        # Return {'doc1': 2, 'doc2': 1}
+        return {doc_id: data['count'] for doc_id, data in postings.items()}
+
+    def _get_phrase_postings_with_counts(self, term: str) -> Dict[str, int]:
+        """
+        Returns {doc_id: phrase_count} for a phrase.
+        Phrase count = number of times the phrase appears.
+        """
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+        inverted_index = self.index_data["inverted_index"]
+        
+        phrase_tokens = term.split(" ")
+        # Need full positional data: {term: {doc_id: {'count': N, 'pos': [...]}}}
+        
+        # Check if all terms exist and get candidate docs (starting from the rarest word)
+        all_term_postings: List[Dict[str, Dict[str, Any]]] = []
+        for t in phrase_tokens:
+            postings = inverted_index.get(t)
+            if not postings: return {} # Phrase term not found
+            all_term_postings.append(postings)
+        candidate_docs = set(min(all_term_postings, key=len))
+        for postings in all_term_postings:
+            candidate_docs = {doc for doc in candidate_docs if doc in postings}
+            if not candidate_docs: return {} # No common docs
+
+        # Check positional adjacency and count occurrences (merge of the sorted position lists)
+        doc_phrase_counts = {}
+        for doc in candidate_docs:
+            count = phrase_count([postings[doc]['pos'] for postings in all_term_postings])
+            if count:
+                doc_phrase_counts[doc] = count
+        return doc_phrase_counts
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """
+        Evaluates a single term or phrase, returning {doc_id: score}.
+        Score for x=2 is simply the term/phrase count.
+        """
+        if " " in operand: # It's a phrase
+            postings = self._get_phrase_postings_with_counts(operand)
+        else: # It's a single term
+            postings = self._get_term_postings_with_counts(operand)
+        
+        # Convert counts to float scores for consistency
+        return {doc_id: float(count) for doc_id, count in postings.items()}
+
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Dict[str, float]:
+        """
+        Evaluate RPN, returning ranked results {doc_id: score}.
+        Simple scoring: AND/OR sum the operand scores, a NOT operand adds 1.0.
+        """
+        return execute(self._plan(rpn_tokens), self._eval_operand_to_scored_docs, self._universe, scored=True)
+
+    @staticmethod
+    def _rank(result_scores: Dict[str, float], top_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        {doc_id: score} -> [(doc_id, score)] by score descending.
+        top_k: heap selection of the k best; nlargest keeps the same order for ties.
+        """
+        with span("rank"):
+            count("candidates", len(result_scores))
+            if top_k is None:
+                return sorted(result_scores.items(), key=lambda item: item[1], reverse=True)
+            return heapq.nlargest(top_k, result_scores.items(), key=lambda item: item[1])
+
+    # --- Override query ---
+    @traced_query
+    def query(self, query: str, explain: bool = False) -> str:
+        """
+        Perform boolean query, returning ranked results based on word counts.
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying (ranked x=2): %s", self.identifier_short, query)
+
+        plan = None
+        try:
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            # Evaluate to get {doc_id: score}, sorted by score (descending)
+            ranked_results = self._cached_results(rpn, lambda: self._rank(self._evaluate_rpn(rpn)))
+
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        # Format output to include scores
+        out = {
+            "query": query,
+            # Return list of [doc_id, score] pairs
+            "results": ranked_results, 
+            "count": len(ranked_results),
+        }
+        if explain: out["plan"] = plan
+        return dumps(out)
+
+
+class SelfIndexTFIDF(SelfIndexRanked):
+    """
+    Extends SelfIndexRanked to support TF-IDF ranking (x=3).
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_tfidf"):
+        # Correct Way: Call the grandparent (SelfIndex) directly, setting the correct info
+        # We skip SelfIndexRanked's __init__ because it forces 'WORDCOUNT'
+        SelfIndex.__init__(self, core, 'TFIDF', dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        # self.index_data will now also contain 'df' and 'N'
+
+    # --- Override create_index ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]],
+                     workers: int = 1, chunk_size: int = 1000) -> None:
+        """
+        Builds inverted index storing TF, Positional data, DF,
+        AND stores original and clean text in 'docs'.
+
+        workers > 1: documents are sent in chunks of `chunk_size` to a process pool,
+        each worker inverts its chunk (partial postings + local DF), and the partial
+        indexes are merged in input order, giving exactly the serial result.
+        preprocess_fn must then be picklable (a module-level function, not a lambda).
+        """
+        print(f"[{self.identifier_short}] Creating TF-IDF index (x=3): {index_id}" +
+              (f" with {workers} workers" if workers > 1 else ""))
+
+        if workers > 1:
+            with multiprocessing.Pool(workers, initializer=_init_index_worker, initargs=(self.preprocess_fn,)) as pool:
+                partials = pool.imap(_invert_chunk, _chunked(files, chunk_size))
+                inverted_index, docs, doc_freq, doc_count = _merge_partial_indexes(partials)
+        else:
+            inverted_index, docs, doc_freq, doc_count = self._invert_documents(files, self.preprocess_fn)
+
+        self.index_data = {
+            "inverted_index": dict(inverted_index),
+            "docs": docs, # Now contains original and clean text
+            "doc_count": doc_count,
+            "terms_count": len(inverted_index),
+            "doc_freq": dict(doc_freq)
+        }
+
+        self._save_index_to_file(index_id)
+        self.indices.add(index_id)
+        self._save_registry()
+
+        print(f"[{self.identifier_short}] TF-IDF index '{index_id}' created: {doc_count} docs, {len(inverted_index)} terms.")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
+
+    @staticmethod
+    def _invert_documents(files: Iterable[Tuple[str, str]], preprocess_fn):
+        """
+        Inverts (doc_id, content) pairs.
+        Returns (inverted_index, docs, doc_freq, doc_count); used by the serial build
+        and by every worker of the parallel build.
+        """
+        inverted_index: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        # --- FIX: Store both original and clean text ---
+        docs: Dict[str, Dict[str, str]] = {} # Now {doc_id: {'original':..., 'clean':...}}
+        # --- END FIX ---
+        doc_count = 0
+        doc_freq: Dict[str, int] = defaultdict(int)
+
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+
+            tokens = preprocess_fn(content)
+            # --- FIX: Store clean text ---
+            clean_text_string = " ".join(tokens)
+            docs[doc_id] = {'original': content, 'clean': clean_text_string}
+            # --- END FIX ---
+            doc_count += 1
+
+            term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+            doc_unique_terms = set()
+            for pos, term in enumerate(tokens):
+                term_positions_in_doc[term].append(pos)
+                doc_unique_terms.add(term)
+
+            for term, positions in term_positions_in_doc.items():
+                inverted_index[term][doc_id] = {'count': len(positions), 'pos': positions}
+
+            for term in doc_unique_terms:
+                doc_freq[term] += 1
+
+        return dict(inverted_index), docs, dict(doc_freq), doc_count
+
+    # --- Override update_index helpers: x=3 docs and doc_freq ---
+    def _add_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, content: str) -> Any:
+        """x=2 postings plus doc_freq; stores {'original': content, 'clean': analyzed text}."""
+        tokens = self.preprocess_fn(content)
+        term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+        for pos, term in enumerate(tokens):
+            term_positions_in_doc[term].append(pos)
+        doc_freq = self.index_data.setdefault("doc_freq", {})
+        for term, positions in term_positions_in_doc.items():
+            inverted_index.setdefault(term, {})[doc_id] = {'count': len(positions), 'pos': positions}
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+        return {'original': content, 'clean': " ".join(tokens)}
+
+    def _remove_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, doc: Any) -> None:
+        doc_freq = self.index_data.setdefault("doc_freq", {})
+        text = doc['clean'].split() if isinstance(doc, dict) else self.preprocess_fn(doc)
+        for term in set(text):
+            if doc_id in inverted_index.get(term, ()):
+                if doc_freq.get(term, 0) > 1:
+                    doc_freq[term] -= 1
+                else:
+                    doc_freq.pop(term, None)
+        super()._remove_doc_postings(inverted_index, doc_id, doc)
+
+    # --- Doc store (doc_store.py): texts in {index_id}.docs[.N], only the table in the pickle ---
+    def _doc_store_path(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.docs"
+
+    def _save_index_to_file(self, index_id: str):
+        docs = self.index_data.get("docs")
+        path = self._doc_store_path(index_id)
+        if isinstance(docs, DocStore) and docs.base_path == path:
+            docs.flush() # appends the docs added since the load (or compacts to a new generation)
+        elif docs is not None: # freshly built dict, or an index pickled with its texts
+            # A new generation, so the pickle on disk keeps a valid file until it is replaced
+            generation = max(generation_files(path), default=-1) + 1
+            self.index_data["docs"] = DocStore.write(path, docs.items(), generation=generation)
+        super()._save_index_to_file(index_id)
+        docs = self.index_data.get("docs")
+        if isinstance(docs, DocStore):
+            # The saved table no longer points at the older generations
+            for generation, file in generation_files(path).items():
+                if generation != docs.generation:
+                    file.unlink(missing_ok=True)
+
+    def _load_index_from_file(self, index_id: str):
+        super()._load_index_from_file(index_id)
+        docs = self.index_data.get("docs")
+        if isinstance(docs, DocStore):
+            docs.open(self._doc_store_path(index_id))
+
+    def delete_index(self, index_id: str) -> None:
+        super().delete_index(index_id)
+        for file in generation_files(self._doc_store_path(index_id)).values():
+            file.unlink(missing_ok=True)
+
+    def documents(self, doc_ids: Iterable[str]) -> Dict[str, Any]:
+        """Stored docs of the given ids (unknown ids skipped), read from the doc store on demand."""
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+        docs = self.index_data["docs"]
+        if isinstance(docs, DocStore):
+            return docs.get_many(doc_ids)
+        return {doc_id: docs[doc_id] for doc_id in doc_ids if doc_id in docs}
+
+    def _snippets(self, rpn: List[str], doc_ids: List[str], width: int = 200) -> Dict[str, str]:
+        """
+        {doc_id: ~width characters of the original text around the first occurrence of a
+        non-negated query word}; only the given (top k) docs are read.
+        """
+        with span("snippets"):
+            words = {word for i, token in enumerate(rpn) if token not in ("AND", "OR", "NOT", "(", ")")
+                     and (i + 1 == len(rpn) or rpn[i + 1] != "NOT") for word in token.split(" ")}
+            # Prefix match: query words are analyzed (possibly stemmed) forms
+            pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(words, key=len, reverse=True))) + ")",
+                                 re.IGNORECASE) if words else None
+            snippets = {}
+            for doc_id, doc in self.documents(doc_ids).items():
+                text = doc['original'] if isinstance(doc, dict) else doc
+                match = pattern.search(text) if pattern else None
+                start = max(0, match.start() - width // 3) if match else 0
+                if start: start = text.find(" ", start) + 1 or start
+                snippet = text[start:start + width]
+                if start + width < len(text): snippet = snippet.rsplit(" ", 1)[0] + " …"
+                snippets[doc_id] = ("… " if start else "") + snippet
+            count("docs_hydrated", len(snippets))
+            return snippets
+
+    # --- TF-IDF Specific Helpers ---
+    def _calculate_idf(self, term: str) -> float:
+        """Calculates Inverse Document Frequency for a term."""
+        # Ensure index_data is loaded if needed (though query should load it)
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+        N = self.index_data.get('doc_count', 0)
+        df = self.index_data.get('doc_freq', {}).get(term, 0)
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df) # Basic IDF
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates a single term or phrase, returning {doc_id: tfidf_score}."""
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+        inverted_index = self.index_data["inverted_index"]
+        final_scores = defaultdict(float)
+
+        if " " not in operand: # Single term
+            term = operand
+            idf = self._calculate_idf(term)
+            if idf == 0: return {} # Term not in index (or df=N)
+            postings = inverted_index.get(term, {})
+            for doc_id, data in postings.items():
+                tf = data['count']
+                final_scores[doc_id] = tf * idf # TF-IDF score
+
+        else: # Phrase
+            phrase_tokens = operand.split(" ")
+            # Use parent's method to find matching docs & phrase counts
+            phrase_doc_counts = self._get_phrase_postings_with_counts(operand)
+            matching_docs = set(phrase_doc_counts.keys())
+            if not matching_docs: return {}
+
+            # Calculate sum of TF-IDF for individual terms in matching docs
+            term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+            for doc_id in matching_docs:
+                doc_score = 0.0
+                for term in phrase_tokens:
+                    # Need to check if term exists and doc exists for that term
+                    postings = inverted_index.get(term)
+                    if postings and doc_id in postings:
+                        tf = postings[doc_id]['count']
+                        idf = term_idfs[term]
+                        doc_score += tf * idf
+                final_scores[doc_id] = doc_score
+
+        return dict(final_scores)
+
+    # Note: We inherit _evaluate_rpn, _rank and query from SelfIndexRanked.
+    # The scoring logic within _evaluate_rpn (summing scores) is a valid,
+    # if simple, way to combine TF-IDF scores for boolean operators.
+    
+    # --- Override query method JUST to fix the log message and take top_k ---
+    @traced_query
+    def query(self, query: str, top_k: Optional[int] = None, explain: bool = False, snippets: bool = False) -> str:
+        """
+        Perform boolean query, returning ranked results based on TF-IDF scores.
+        (Identical to parent, but updates the log message for x=3)
+        top_k: return only the k best results (heap selection instead of a full sort).
+        snippets: add {doc_id: text snippet} for the returned results (their texts only are read).
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        # --- THE FIX ---
+        query_log.info("[%s] Querying (TF-IDF x=3): %s", self.identifier_short, query)
+        # --- END FIX ---
+
+        plan, rpn = None, []
+        try:
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            ranked_results = self._cached_results(rpn, lambda: self._rank(self._evaluate_rpn(rpn), top_k), top_k)
+
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        # Format output to include scores
+        out = {
+            "query": query,
+            "results": ranked_results,
+            "count": len(ranked_results),
+        }
+        if explain: out["plan"] = plan
+        if snippets: out["snippets"] = self._snippets(rpn, [doc_id for doc_id, _ in ranked_results])
+        return dumps(out)
+
+
+# ----------------------
+# Parallel build helpers (module level so worker processes can import them)
+# ----------------------
+_WORKER_PREPROCESS_FN = None
+
+
+def _init_index_worker(preprocess_fn):
+    global _WORKER_PREPROCESS_FN
+    _WORKER_PREPROCESS_FN = preprocess_fn
+
+
+def _invert_chunk(chunk: List[Tuple[str, str]]):
+    """Worker: partial TF-IDF index for one chunk of documents."""
+    return SelfIndexTFIDF._invert_documents(chunk, _WORKER_PREPROCESS_FN)
+
+
+def _chunked(files: Iterable[Tuple[str, str]], size: int) -> Iterable[List[Tuple[str, str]]]:
+    chunk = []
+    for item in files:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _merge_partial_indexes(partials):
+    """
+    Merge partial (inverted_index, docs, doc_freq, doc_count) results in input order.
+    Chunks are contiguous slices of the stream, so updating in order reproduces the
+    serial dict contents and insertion order (terms in first-occurrence order,
+    postings in doc order), duplicate doc_ids included.
+    """
+    inverted_index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    docs: Dict[str, Dict[str, str]] = {}
+    doc_freq: Dict[str, int] = defaultdict(int)
+    doc_count = 0
+    for part_index, part_docs, part_df, part_count in partials:
+        for term, postings in part_index.items():
+            merged = inverted_index.get(term)
+            if merged is None:
+                inverted_index[term] = postings
+            else:
+                merged.update(postings)
+        docs.update(part_docs)
+        for term, df in part_df.items():
+            doc_freq[term] += df
+        doc_count += part_count
+    return inverted_index, docs, doc_freq, doc_count
@@ -0,0 +1,383 @@
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import zlib
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Tuple, Dict, Any, List, Optional, Callable
+
+from compact_index import SelfIndexCompact
+from index_base import Optimizations
+from query_trace import count, dumps, query_log, span, traced_query
+from self_index import SelfIndexTFIDF
+from topk import disjunctive_terms
+
+# ----------------------
+# Document-partitioned sharded index
+# ----------------------
+# {index_id}.pkl         coordinator: shard count, global doc count and df, docs per shard
+# {index_id}.shards/007/ shard 7: a compact TF-IDF index (index id "shard") of the docs
+#                        with crc32(doc_id) % num_shards == 7
+# Each shard is loaded in its own worker process (a one-process pool, so the tasks of a
+# shard run in submission order: a query sees every update submitted before it).
+# A query is parsed here, then scattered: every shard gets the RPN and the global idf of
+# the query words, so a doc scores exactly as in the unsharded index (tf * log(N / df),
+# N and df over all shards), and returns its local top k, best first. The gather merges
+# these lists with a heap and keeps the k best. Equal scores may come out in another
+# order than in the unsharded index (ties are not ordered by doc).
+# update_index only goes to the shards owning the removed/added docs; each returns the df
+# changes of the terms of those docs, which are applied to the global df.
+
+SHARD_ID = "shard"
+
+
+def shard_of(doc_id: str, num_shards: int) -> int:
+    """Shard owning doc_id (stable across processes and runs, unlike hash())."""
+    return zlib.crc32(doc_id.encode("utf-8")) % num_shards
+
+
+class ShardIndex(SelfIndexCompact):
+    """One shard: a compact TF-IDF index scored with the idf given by the coordinator."""
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_shard"):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        self.global_idf: Optional[Dict[str, float]] = None # set for the duration of search()
+
+    def _calculate_idf(self, term: str) -> float:
+        if self.global_idf is not None:
+            return self.global_idf.get(term, 0.0)
+        return super()._calculate_idf(term)
+
+    def search(self, rpn: List[str], idf: Dict[str, float], top_k: Optional[int]) -> List[Tuple[str, float]]:
+        """[(doc_id, score)] best first for the planned RPN, with idf {word: global idf}."""
+        self.global_idf = idf
+        try:
+            terms = None
+            if top_k is not None and self.optim in (Optimizations.Thresholding, Optimizations.EarlyStopping):
+                terms = disjunctive_terms(rpn)
+            if terms is not None:
+                return self._top_k_disjunctive(terms, top_k)
+            return self._rank(self._evaluate_rpn(rpn), top_k)
+        finally:
+            self.global_idf = None
+
+    def doc_freqs(self) -> Dict[str, int]:
+        postings = self._postings()
+        return {term: postings.doc_freq(term) for term in postings.terms}
+
+
+# ----------------------
+# Shard operations: fn(shard, *args), run in the shard's worker process or in this one
+# ----------------------
+def _shard_create(shard: ShardIndex, docs: List[Tuple[str, str]]) -> Tuple[int, Dict[str, int]]:
+    shard.create_index(SHARD_ID, docs)
+    return shard.index_data["doc_count"], shard.doc_freqs()
+
+
+def _shard_load(shard: ShardIndex) -> int:
+    shard.load_index(SHARD_ID)
+    return shard.index_data["doc_count"]
+
+
+def _shard_search(shard: ShardIndex, rpn: List[str], idf: Dict[str, float],
+                  top_k: Optional[int]) -> List[Tuple[str, float]]:
+    return shard.search(rpn, idf, top_k)
+
+
+def _shard_update(shard: ShardIndex, remove_ids: List[str],
+                  add_files: List[Tuple[str, str]]) -> Tuple[int, Dict[str, int]]:
+    """Apply the update; returns (doc count, {term: df change}) over the terms of the docs involved."""
+    old_postings = shard._postings()
+    terms = {term for doc in shard.documents(remove_ids + [doc_id for doc_id, _ in add_files]).values()
+             for term in doc['clean'].split()}
+    shard.update_index(SHARD_ID, [(doc_id, "") for doc_id in remove_ids], add_files)
+    postings = shard._postings()
+    terms.update(term for doc in shard.documents([doc_id for doc_id, _ in add_files]).values()
+                 for term in doc['clean'].split())
+    changes = {term: postings.doc_freq(term) - old_postings.doc_freq(term) for term in terms}
+    return shard.index_data["doc_count"], {term: change for term, change in changes.items() if change}
+
+
+def _shard_documents(shard: ShardIndex, doc_ids: List[str]) -> Dict[str, Any]:
+    return shard.documents(doc_ids)
+
+
+def _shard_doc_ids(shard: ShardIndex) -> List[str]:
+    return list(shard.list_indexed_files(SHARD_ID))
+
+
+def _shard_footprint(shard: ShardIndex) -> int:
+    return shard.memory_footprint()
+
+
+_WORKER_SHARD: Dict[str, ShardIndex] = {}
+
+
+def _init_shard_worker(shard_args: tuple) -> None:
+    # The coordinator reports progress; N workers' create/load lines would only interleave
+    sys.stdout = open(os.devnull, "w")
+    _WORKER_SHARD["shard"] = ShardIndex(*shard_args)
+
+
+def _on_worker_shard(fn: Callable, *args):
+    return fn(_WORKER_SHARD["shard"], *args)
+
+
+class SelfIndexSharded(SelfIndexTFIDF):
+    """
+    TF-IDF index (x=3) split into num_shards document partitions, queried in parallel
+    (see above). Results equal those of SelfIndexCompact/SelfIndexTFIDF on the same docs.
+    processes=False keeps the shards in this process and queries them one after the
+    other (preprocess_fn need not be picklable then, but queries are serialized).
+    optim Thresholding/EarlyStopping: each shard prunes its top k with WAND/MaxScore.
+    close() stops the shard processes.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_sharded", num_shards: int = 4, processes: bool = True):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards # for create_index; a loaded index keeps its own count
+        self.processes = processes
+        self.concurrent_queries = processes
+        self._shard_options = (dstore, qproc, compr, optim)
+        self._shards: List[Any] = [] # one-process pools, or ShardIndex objects (processes=False)
+        self._shards_for: Optional[str] = None
+
+    # ----------------------
+    # Shards
+    # ----------------------
+    def _shard_dir(self, index_id: str, shard: Optional[int] = None) -> Path:
+        path = self.storage_path / f"{index_id}.shards"
+        return path if shard is None else path / f"{shard:03d}"
+
+    def _shard_args(self, index_id: str, shard: int) -> tuple:
+        dstore, qproc, compr, optim = self._shard_options
+        return ("SelfIndex", "TFIDF", dstore, qproc, compr, optim, self.preprocess_fn,
+                str(self._shard_dir(index_id, shard)))
+
+    def _start_shards(self, index_id: str, num_shards: int) -> None:
+        if self._shards_for == index_id and len(self._shards) == num_shards:
+            return
+        self.close()
+        for i in range(num_shards):
+            if self.processes:
+                self._shards.append(ProcessPoolExecutor(1, initializer=_init_shard_worker,
+                                                        initargs=(self._shard_args(index_id, i),)))
+            else:
+                self._shards.append(ShardIndex(*self._shard_args(index_id, i)))
+        self._shards_for = index_id
+
+    def _submit(self, shard: int, fn: Callable, *args) -> Future:
+        """fn(shard index, *args) on the given shard."""
+        if self.processes:
+            return self._shards[shard].submit(_on_worker_shard, fn, *args)
+        future: Future = Future()
+        try:
+            future.set_result(fn(self._shards[shard], *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _on_all_shards(self, fn: Callable, *args) -> List[Any]:
+        futures = [self._submit(i, fn, *args) for i in range(len(self._shards))]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        """Stop the shard processes (the next load/create/update starts new ones)."""
+        for shard in self._shards:
+            if isinstance(shard, ProcessPoolExecutor):
+                shard.shutdown(wait=True)
+        self._shards = []
+        self._shards_for = None
+
+    # ----------------------
+    # Persistence: the coordinator pickle, shards loaded alongside
+    # ----------------------
+    def _load_index_from_file(self, index_id: str):
+        super()._load_index_from_file(index_id)
+        if self._shards_for != index_id: # shards already loaded saw every change made through this instance
+            self._start_shards(index_id, self.index_data["num_shards"])
+            self._on_all_shards(_shard_load)
+
+    def _read_coordinator(self, index_id: str) -> Dict[str, Any]:
+        with open(self._get_index_filepath(index_id), "rb") as f:
+            return pickle.load(f)
+
+    def memory_footprint(self) -> int:
+        """Coordinator plus every loaded shard (in its process or this one)."""
+        return super().memory_footprint() + (sum(self._on_all_shards(_shard_footprint)) if self._shards else 0)
+
+    # ----------------------
+    # Global statistics
+    # ----------------------
+    def _vocabulary(self) -> Optional[Iterable[str]]:
+        return self.index_data.get("doc_freq")
+
+    def _doc_freq(self, term: str) -> int:
+        return self.index_data["doc_freq"].get(term, 0)
+
+    def _query_idf(self, rpn: List[str]) -> Dict[str, float]:
+        """{word: global idf} for every word of the RPN's terms and phrases."""
+        words = {word for tok in rpn if tok not in ("AND", "OR", "NOT") for word in tok.split(" ")}
+        return {word: self._calculate_idf(word) for word in words}
+
+    # ----------------------
+    # Abstract method implementations
+    # ----------------------
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """Route the docs to num_shards shards and build them in parallel."""
+        num_shards = self.num_shards
+        print(f"[{self.identifier_short}] Creating sharded TF-IDF index: {index_id} ({num_shards} shards)")
+
+        partitions: List[List[Tuple[str, str]]] = [[] for _ in range(num_shards)]
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            partitions[shard_of(doc_id, num_shards)].append((doc_id, content))
+
+        self.close() # a previous index under this id may be loaded
+        shutil.rmtree(self._shard_dir(index_id), ignore_errors=True)
+        self._start_shards(index_id, num_shards)
+        futures = [self._submit(i, _shard_create, partitions[i]) for i in range(num_shards)]
+        del partitions
+        built = [future.result() for future in futures]
+
+        doc_freq: Dict[str, int] = defaultdict(int)
+        for _, shard_df in built:
+            for term, df in shard_df.items():
+                doc_freq[term] += df
+        shard_doc_counts = [doc_count for doc_count, _ in built]
+        self.index_data = {
+            "num_shards": num_shards,
+            "shard_doc_counts": shard_doc_counts,
+            "doc_count": sum(shard_doc_counts),
+            "terms_count": len(doc_freq),
+            "doc_freq": dict(doc_freq),
+        }
+
+        self._save_index_to_file(index_id)
+        self.indices.add(index_id)
+        self._save_registry()
+
+        print(f"[{self.identifier_short}] Sharded index '{index_id}' created: {self.index_data['doc_count']} docs "
+              f"({', '.join(map(str, shard_doc_counts))} per shard), {len(doc_freq)} terms.")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """Remove then add docs, on the shards owning them only; global df follows."""
+        print(f"[{self.identifier_short}] Updating index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        self._load_index_from_file(index_id)
+        num_shards = self.index_data["num_shards"]
+        removals: List[List[str]] = [[] for _ in range(num_shards)]
+        additions: List[List[Tuple[str, str]]] = [[] for _ in range(num_shards)]
+        for doc_id, _ in remove_files or []:
+            removals[shard_of(str(doc_id), num_shards)].append(str(doc_id))
+        for doc_id, content in add_files or []:
+            additions[shard_of(str(doc_id), num_shards)].append((str(doc_id), content))
+        futures = {i: self._submit(i, _shard_update, removals[i], additions[i])
+                   for i in range(num_shards) if removals[i] or additions[i]}
+
+        # Record the shards that did update even if another failed, then raise
+        doc_freq = self.index_data["doc_freq"]
+        error = None
+        for i, future in futures.items():
+            try:
+                doc_count, df_changes = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            self.index_data["shard_doc_counts"][i] = doc_count
+            for term, change in df_changes.items():
+                df = doc_freq.get(term, 0) + change
+                if df: doc_freq[term] = df
+                else: doc_freq.pop(term, None)
+        self.index_data["doc_count"] = sum(self.index_data["shard_doc_counts"])
+        self.index_data["terms_count"] = len(doc_freq)
+        self._save_index_to_file(index_id)
+        if error is not None:
+            raise error
+        print(f"[{self.identifier_short}] Update complete. docs={self.index_data['doc_count']}, terms={self.index_data['terms_count']} "
+              f"({len(futures)} of {num_shards} shards updated)")
+
+    def delete_index(self, index_id: str) -> None:
+        if self._shards_for == index_id:
+            self.close()
+        shutil.rmtree(self._shard_dir(index_id), ignore_errors=True)
+        super().delete_index(index_id)
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Doc ids of every shard, sorted; shards of an index that is not loaded are read in this process."""
+        if index_id not in self.indices and not self._get_index_filepath(index_id).exists():
+            raise FileNotFoundError(f"Index '{index_id}' not found.")
+        if self._shards_for == index_id:
+            per_shard = self._on_all_shards(_shard_doc_ids)
+        else:
+            num_shards = self._read_coordinator(index_id)["num_shards"]
+            per_shard = [ShardIndex(*self._shard_args(index_id, i)).list_indexed_files(SHARD_ID)
+                         for i in range(num_shards)]
+        return list(heapq.merge(*per_shard))
+
+    def documents(self, doc_ids: Iterable[str]) -> Dict[str, Any]:
+        """Stored docs of the given ids (unknown ids skipped), fetched from their shards."""
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+        doc_ids = list(doc_ids)
+        by_shard: Dict[int, List[str]] = defaultdict(list)
+        for doc_id in doc_ids:
+            by_shard[shard_of(doc_id, self.index_data["num_shards"])].append(doc_id)
+        found: Dict[str, Any] = {}
+        for future in [self._submit(i, _shard_documents, ids) for i, ids in by_shard.items()]:
+            found.update(future.result())
+        return {doc_id: found[doc_id] for doc_id in doc_ids if doc_id in found}
+
+    # ----------------------
+    # Scatter-gather query
+    # ----------------------
+    def _scatter_gather(self, rpn: List[str], top_k: Optional[int]) -> List[Tuple[str, float]]:
+        with span("scatter"):
+            count("shards", len(self._shards))
+            per_shard = self._on_all_shards(_shard_search, rpn, self._query_idf(rpn), top_k)
+        with span("gather"):
+            count("candidates", sum(map(len, per_shard)))
+            merged = heapq.merge(*per_shard, key=lambda item: item[1], reverse=True)
+            return list(merged if top_k is None else islice(merged, top_k))
+
+    @traced_query
+    def query(self, query: str, top_k: Optional[int] = None, explain: bool = False, snippets: bool = False) -> str:
+        """
+        TF-IDF query over every shard: parsed once here, evaluated by the shards in
+        parallel, their top k merged. Same output as SelfIndexTFIDF.query.
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying (TF-IDF x=3, %d shards): %s", self.identifier_short, len(self._shards), query)
+
+        plan, rpn = None, []
+        try:
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            ranked_results = self._cached_results(rpn, lambda: self._scatter_gather(rpn, top_k), top_k)
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = {
+            "query": query,
+            "results": ranked_results,
+            "count": len(ranked_results),
+        }
+        if explain: out["plan"] = plan
+        if snippets: out["snippets"] = self._snippets(rpn, [doc_id for doc_id, _ in ranked_results])
+        return dumps(out)
@@ -0,0 +1,253 @@
+import bisect
+import math
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from phrase_match import phrase_count
+from query_trace import query_log
+from self_index import SelfIndexTFIDF
+
+# ----------------------
+# Skip pointers over sorted postings (i=1)
+# ----------------------
+# Moved from es.ipynb so the benchmark suite (bench/variants.py) can import it.
+# Each term entry: {'doc_ids': sorted doc ids, 'data': {doc_id: {'count', 'pos'}},
+# 'skips': {i: i + sqrt(df)}}. _intersect_with_skips merges two lists with them;
+# _evaluate_rpn still intersects score dicts (see its docstring).
+# block_postings.py (per-block skip headers) is the skip structure the compact indexes use.
+
+
+def _skip_pointers(num_postings: int) -> Dict[int, int]:
+    """{from index: to index} every sqrt(num_postings) postings (none for short lists)."""
+    skip_distance = int(math.sqrt(num_postings))
+    if skip_distance <= 1: # Only add skips if beneficial
+        return {}
+    return {idx: idx + skip_distance for idx in range(0, num_postings - skip_distance, skip_distance)}
+
+
+class SelfIndexSkipping(SelfIndexTFIDF):
+    """
+    Extends SelfIndexTFIDF to add skip pointers for faster AND queries (i=1).
+    - Postings lists are sorted by doc_id.
+    - Skip pointers are added during index creation (and kept up to date by update_index).
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_skipping"):
+        # Explicitly set optim to Skipping
+        super().__init__(core, 'TFIDF', dstore, qproc, compr, 'Skipping', preprocess_fn, storage_path)
+        # Index data structure will be modified to include skips and sorted postings
+
+    # --- Override create_index ---
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Builds TF-IDF index and adds skip pointers to sorted postings lists.
+        New structure for inverted_index entry for a term:
+        {
+            'doc_ids': [doc_id1, doc_id2, ...], # SORTED list of doc IDs
+            'data': {doc_id1: {'count': N, 'pos': [...]}, ...}, # Original data map
+            'skips': {from_index: skip_to_index, ...} # Skip pointers (dict for sparse mapping)
+        }
+        """
+        print(f"[{self.identifier_short}] Creating index with skip pointers (i=1): {index_id}")
+
+        # 1. Build the initial index using parent's logic (in memory)
+        # This populates self.index_data with inverted_index, docs, doc_count, terms_count, doc_freq
+        super().create_index(index_id, files)
+
+        # 2. Modify the inverted_index structure to add sorted lists and skips
+        print(f"[{self.identifier_short}] Sorting postings and adding skip pointers...")
+        inverted_index_new = {}
+        for term, postings_data in self.index_data["inverted_index"].items():
+            sorted_doc_ids = sorted(postings_data.keys())
+            inverted_index_new[term] = {
+                'doc_ids': sorted_doc_ids,
+                'data': postings_data, # Keep the original data map accessible by doc_id
+                'skips': _skip_pointers(len(sorted_doc_ids)),
+            }
+
+        # Replace the old index structure with the new one
+        self.index_data["inverted_index"] = inverted_index_new
+
+        # 3. Re-save the modified index_data
+        self._save_index_to_file(index_id)
+        print(f"[{self.identifier_short}] Index with skip pointers saved to {self._get_index_filepath(index_id)}")
+        # Registry was already updated by parent create_index call
+
+    # --- Override update_index helpers: the parent's on the 'data' maps, then doc_ids/skips ---
+    def _add_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, content: str) -> Any:
+        added: Dict[str, Any] = {}
+        doc = super()._add_doc_postings(added, doc_id, content)
+        for term, postings in added.items():
+            entry = inverted_index.setdefault(term, {'doc_ids': [], 'data': {}, 'skips': {}})
+            entry['data'].update(postings)
+            bisect.insort(entry['doc_ids'], doc_id)
+            entry['skips'] = _skip_pointers(len(entry['doc_ids']))
+        return doc
+
+    def _remove_doc_postings(self, inverted_index: Dict[str, Any], doc_id: str, doc: Any) -> None:
+        terms = set(doc['clean'].split() if isinstance(doc, dict) else self.preprocess_fn(doc))
+        entries = {term: inverted_index[term] for term in terms if doc_id in inverted_index.get(term, {}).get('data', ())}
+        # Parent removal (doc_freq included) on the shared 'data' maps
+        super()._remove_doc_postings({term: entry['data'] for term, entry in entries.items()}, doc_id, doc)
+        for term, entry in entries.items():
+            if not entry['data']:
+                del inverted_index[term]
+                continue
+            doc_ids = entry['doc_ids']
+            del doc_ids[bisect.bisect_left(doc_ids, doc_id)]
+            entry['skips'] = _skip_pointers(len(doc_ids))
+
+    # --- Helper for AND intersection with skips ---
+    def _get_term_posting_list(self, term: str) -> Optional[Dict[str, Any]]:
+        """Helper to retrieve the full posting list structure for a term."""
+        if not self.index_data: return None
+        return self.index_data.get("inverted_index", {}).get(term)
+
+    def _intersect_with_skips(self, term1: str, term2: str) -> Set[str]:
+        """Performs intersection of postings lists using skip pointers."""
+        results = set()
+        p1_list_data = self._get_term_posting_list(term1)
+        p2_list_data = self._get_term_posting_list(term2)
+
+        # If either term doesn't exist or has no postings, intersection is empty
+        if not p1_list_data or not p2_list_data or not p1_list_data['doc_ids'] or not p2_list_data['doc_ids']:
+            return results
+
+        p1_docs = p1_list_data['doc_ids']
+        p2_docs = p2_list_data['doc_ids']
+        p1_skips = p1_list_data.get('skips', {})
+        p2_skips = p2_list_data.get('skips', {})
+        idx1, idx2 = 0, 0
+        len1, len2 = len(p1_docs), len(p2_docs)
+
+        while idx1 < len1 and idx2 < len2:
+            doc1 = p1_docs[idx1]
+            doc2 = p2_docs[idx2]
+
+            if doc1 == doc2:
+                results.add(doc1)
+                idx1 += 1
+                idx2 += 1
+            elif doc1 < doc2:
+                # Try to skip ahead in p1
+                skip_to_idx1 = p1_skips.get(idx1)
+                # Check if skip exists AND if skipping lands before or at doc2
+                if skip_to_idx1 is not None and p1_docs[skip_to_idx1] <= doc2:
+                    idx1 = skip_to_idx1
+                else: # No beneficial skip, just advance normally
+                    idx1 += 1
+            else: # doc1 > doc2
+                # Try to skip ahead in p2
+                skip_to_idx2 = p2_skips.get(idx2)
+                # Check if skip exists AND if skipping lands before or at doc1
+                if skip_to_idx2 is not None and p2_docs[skip_to_idx2] <= doc1:
+                    idx2 = skip_to_idx2
+                else: # No beneficial skip, just advance normally
+                    idx2 += 1
+        return results
+
+    # query method is inherited from SelfIndexTFIDF - it calls the overridden _evaluate_rpn
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """
+        Evaluates term/phrase for the skipping index structure, returning {doc_id: tfidf_score}.
+        Ensures it always returns a dict.
+        """
+        if not self.index_data: raise RuntimeError("Index not loaded.")
+
+        inverted_index = self.index_data.get("inverted_index", {})
+        final_scores = defaultdict(float)
+
+        if " " not in operand: # Single term
+            term = operand
+            idf = self._calculate_idf(term)
+            if idf == 0: return {} # Term not in index or df=N
+
+            term_index_data = inverted_index.get(term)
+            if not term_index_data: return {} # Term not found
+
+            for doc_id, data in term_index_data['data'].items():
+                final_scores[doc_id] = data['count'] * idf
+
+        else: # Phrase
+            phrase_tokens = operand.split(" ")
+
+            # 1. Find candidate docs (containing all terms, starting from the rarest word)
+            all_term_postings = []
+            for term in phrase_tokens:
+                term_index_data = inverted_index.get(term)
+                if not term_index_data or not term_index_data['data']: return {}
+                all_term_postings.append(term_index_data['data'])
+            candidate_docs = set(min(all_term_postings, key=len))
+            for postings in all_term_postings:
+                candidate_docs = {doc for doc in candidate_docs if doc in postings}
+                if not candidate_docs: return {}
+
+            # 2. Check positional adjacency (merge of the sorted position lists, see phrase_match)
+            matched_docs = [doc for doc in candidate_docs
+                            if phrase_count([postings[doc]['pos'] for postings in all_term_postings])]
+
+            # 3. Calculate scores for matched docs
+            term_idfs = {term: self._calculate_idf(term) for term in phrase_tokens}
+            for doc_id in matched_docs:
+                final_scores[doc_id] = sum(postings[doc_id]['count'] * term_idfs[term]
+                                           for term, postings in zip(phrase_tokens, all_term_postings))
+
+        return dict(final_scores)
+
+    # --- Override _evaluate_rpn ---
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Dict[str, float]:
+        """
+        Evaluate RPN, returning a {doc_id: score} dict.
+        AND/OR sum the operand scores, NOT operands score 1.0. AND intersects the score
+        dicts: operands are already evaluated, so the skip pointers (which need the term
+        names, see _intersect_with_skips) are not used here.
+        """
+        stack: List[Any] = [] # Stack holds sets (from NOT) or dicts (scores)
+
+        for tok in rpn_tokens:
+            try: # Wrap operations in try/except for safety
+                if tok == "NOT":
+                    if not stack: raise ValueError("NOT needs operand")
+                    op = stack.pop()
+                    op_docs = set(op.keys()) if isinstance(op, dict) else set(op or {}) # Handle None/empty set
+
+                    # Get universe safely
+                    universe = set(self.index_data.get("docs", {}).keys())
+                    stack.append(universe - op_docs) # Push the set
+
+                elif tok in ("AND", "OR"):
+                    if len(stack) < 2: raise ValueError(f"{tok} needs two operands")
+                    b = stack.pop()
+                    a = stack.pop()
+
+                    # Safely convert operands to score dictionaries (sets get score 1.0)
+                    a_scores = a if isinstance(a, dict) else {doc_id: 1.0 for doc_id in (a or set())}
+                    b_scores = b if isinstance(b, dict) else {doc_id: 1.0 for doc_id in (b or set())}
+
+                    result_scores = defaultdict(float)
+                    if tok == "AND":
+                        docs = set(a_scores.keys()) & set(b_scores.keys())
+                    else: # OR
+                        docs = set(a_scores.keys()) | set(b_scores.keys())
+                    for doc_id in docs:
+                        result_scores[doc_id] = a_scores.get(doc_id, 0.0) + b_scores.get(doc_id, 0.0)
+                    stack.append(dict(result_scores))
+
+                else: # Operand (term or phrase)
+                    stack.append(self._eval_operand_to_scored_docs(tok))
+
+            except Exception as e:
+                query_log.warning("[%s] Error during RPN evaluation step '%s': %s", self.identifier_short, tok, e)
+                stack.append({}) # Push an empty dict to allow evaluation to continue
+
+        # Final result handling
+        if not stack: return {}
+        if len(stack) != 1:
+            query_log.warning("[%s] Malformed RPN evaluation, final stack size: %d", self.identifier_short, len(stack))
+        final_result = stack[0]
+
+        # Ensure final result is always a dict {doc: score}
+        if isinstance(final_result, set):
+            return {doc_id: 1.0 for doc_id in final_result} # Convert final set from NOT
+
+        return final_result if isinstance(final_result, dict) else {}
@@ -0,0 +1,315 @@
+import heapq
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from pathlib import Path
+from typing import Iterable, Tuple, Dict, Any, List, Iterator, Optional
+
+from segment_store import SelfIndexSegment, write_segment_sections
+
+# Run file entry: term byte length, number of postings, number of positions,
+# followed by term utf-8, doc ids (I), tfs (I), positions (I)
+RUN_ENTRY = struct.Struct("<III")
+# Doc id run entry: doc id byte length, followed by the utf-8 doc id
+ID_ENTRY = struct.Struct("<I")
+
+# Rough per-object overheads used for the RAM estimate (CPython, 64-bit)
+TERM_OVERHEAD_BYTES = 3 * 64 + 100   # three small arrays + dict slot / tuple
+POSTING_BYTES = 2 * 4                # doc id + tf
+POSITION_BYTES = 4
+DOC_ID_BYTES = 8                     # list slot (plus the str itself)
+
+
+class _ArraySpool:
+    """Append-only typed array backed by a temp file, buffered in memory."""
+
+    FLUSH_ITEMS = 1 << 16
+
+    def __init__(self, path: Path, typecode: str):
+        self.path = path
+        self._f = open(path, "wb")
+        self._buf = array(typecode)
+
+    def append(self, value: int) -> None:
+        self._buf.append(value)
+        if len(self._buf) >= self.FLUSH_ITEMS:
+            self._flush()
+
+    def extend(self, values) -> None:
+        self._buf.extend(values)
+        if len(self._buf) >= self.FLUSH_ITEMS:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._buf.tofile(self._f)
+        del self._buf[:]
+
+    def close(self) -> Path:
+        self._flush()
+        self._f.close()
+        return self.path
+
+
+class _StringSpool:
+    """Strings spooled to disk as a utf-8 blob file plus an offsets file (segment layout)."""
+
+    def __init__(self, work_dir: Path, prefix: str):
+        self.blob_path = work_dir / f"{prefix}_blob.bin"
+        self._blob = open(self.blob_path, "wb")
+        self.offsets = _ArraySpool(work_dir / f"{prefix}_str_offsets.bin", "Q")
+        self.offsets.append(0)
+        self._total = 0
+
+    def append(self, s: str) -> None:
+        b = (s or "").encode("utf-8")
+        self._blob.write(b)
+        self._total += len(b)
+        self.offsets.append(self._total)
+
+    def close(self) -> Tuple[Path, Path]:
+        self._blob.close()
+        return self.blob_path, self.offsets.close()
+
+
+def _read_run(path: Path, run_no: int) -> Iterator[Tuple[str, int, array, array, array]]:
+    """Stream (term, run_no, doc_ids, tfs, positions) entries of one sorted run."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RUN_ENTRY.size)
+            if not header:
+                return
+            term_len, n_postings, n_positions = RUN_ENTRY.unpack(header)
+            term = f.read(term_len).decode("utf-8")
+            docs, tfs, positions = array("I"), array("I"), array("I")
+            docs.frombytes(f.read(n_postings * docs.itemsize))
+            tfs.frombytes(f.read(n_postings * tfs.itemsize))
+            positions.frombytes(f.read(n_positions * positions.itemsize))
+            yield term, run_no, docs, tfs, positions
+
+
+def _read_id_run(path: Path) -> Iterator[str]:
+    """Stream the sorted doc ids of one run."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(ID_ENTRY.size)
+            if not header:
+                return
+            yield f.read(ID_ENTRY.unpack(header)[0]).decode("utf-8")
+
+
+class SPIMIBuilder:
+    """
+    Single-pass in-memory indexing (SPIMI) with an external k-way merge.
+    - (doc_id, content) pairs are consumed as a stream; doc texts go straight to disk
+    - postings accumulate per term until the estimated RAM use reaches ram_budget_mb,
+      then the block is written as a term-sorted run file and memory is released
+    - runs are k-way merged (heapq.merge) into one segment file (see segment_store);
+      the merged term_offsets table is the doc-frequency table (df = slice length)
+    Doc ids are assigned in stream order, so a term's postings from run i all precede
+    those from run i+1 and the merge only concatenates them.
+    Each run also writes its sorted doc ids; duplicates are found by merging these, so
+    no set of every doc id is kept (a duplicate is reported once the stream is consumed).
+    """
+
+    def __init__(self, preprocess_fn, ram_budget_mb: float = 256):
+        if ram_budget_mb <= 0:
+            raise ValueError("ram_budget_mb must be positive")
+        self.preprocess_fn = preprocess_fn
+        self.ram_budget_bytes = int(ram_budget_mb * 1024 * 1024)
+
+        self._block: Dict[str, Tuple[array, array, array]] = {}
+        self._block_doc_ids: List[str] = []
+        self._block_bytes = 0
+        self._runs: List[Path] = []
+        self._id_runs: List[Path] = []
+        self.stats: Dict[str, Any] = {}
+
+    # ----------------------
+    # Inversion
+    # ----------------------
+    def _add_document(self, docnum: int, tokens: List[str]) -> None:
+        term_positions: Dict[str, List[int]] = {}
+        for pos, term in enumerate(tokens):
+            term_positions.setdefault(term, []).append(pos)
+
+        for term, positions in term_positions.items():
+            entry = self._block.get(term)
+            if entry is None:
+                entry = self._block[term] = (array("I"), array("I"), array("I"))
+                self._block_bytes += sys.getsizeof(term) + TERM_OVERHEAD_BYTES
+            docs, tfs, pos = entry
+            docs.append(docnum)
+            tfs.append(len(positions))
+            pos.extend(positions)
+            self._block_bytes += POSTING_BYTES + POSITION_BYTES * len(positions)
+
+    def _flush_run(self, work_dir: Path) -> None:
+        """Write the in-memory block as a term-sorted run (and its doc ids sorted) and clear it."""
+        if self._block:
+            path = work_dir / f"run_{len(self._runs):05d}.bin"
+            with open(path, "wb") as f:
+                for term in sorted(self._block):
+                    docs, tfs, pos = self._block[term]
+                    term_bytes = term.encode("utf-8")
+                    f.write(RUN_ENTRY.pack(len(term_bytes), len(docs), len(pos)))
+                    f.write(term_bytes)
+                    f.write(docs)
+                    f.write(tfs)
+                    f.write(pos)
+            self._runs.append(path)
+        if self._block_doc_ids:
+            path = work_dir / f"ids_{len(self._id_runs):05d}.bin"
+            with open(path, "wb") as f:
+                for doc_id in sorted(self._block_doc_ids):
+                    doc_id_bytes = doc_id.encode("utf-8")
+                    f.write(ID_ENTRY.pack(len(doc_id_bytes)))
+                    f.write(doc_id_bytes)
+            self._id_runs.append(path)
+        self._block = {}
+        self._block_doc_ids = []
+        self._block_bytes = 0
+
+    # ----------------------
+    # Merge
+    # ----------------------
+    def _check_doc_ids(self) -> None:
+        """K-way merge the doc id runs: equal neighbours are duplicate doc ids."""
+        previous: Optional[str] = None
+        for doc_id in heapq.merge(*(_read_id_run(path) for path in self._id_runs)):
+            if doc_id == previous:
+                raise ValueError(f"Duplicate doc_id '{doc_id}'")
+            previous = doc_id
+
+    def _merge_runs(self, work_dir: Path) -> Tuple[int, Dict[str, Path]]:
+        """K-way merge all runs into spooled postings sections. Returns (term_count, sections)."""
+        terms = _StringSpool(work_dir, "term")
+        term_offsets = _ArraySpool(work_dir / "term_offsets.bin", "Q")
+        post_docs = _ArraySpool(work_dir / "post_docs.bin", "I")
+        post_tfs = _ArraySpool(work_dir / "post_tfs.bin", "I")
+        pos_offsets = _ArraySpool(work_dir / "pos_offsets.bin", "Q")
+        positions = _ArraySpool(work_dir / "positions.bin", "I")
+        term_offsets.append(0)
+        pos_offsets.append(0)
+
+        streams = [_read_run(path, run_no) for run_no, path in enumerate(self._runs)]
+        current: Optional[str] = None
+        term_count = n_postings = n_positions = 0
+        for term, _, docs, tfs, pos in heapq.merge(*streams, key=lambda e: (e[0], e[1])):
+            if term != current:
+                if current is not None:
+                    term_offsets.append(n_postings)
+                terms.append(term)
+                current = term
+                term_count += 1
+            post_docs.extend(docs)
+            post_tfs.extend(tfs)
+            positions.extend(pos)
+            for tf in tfs:
+                n_positions += tf
+                pos_offsets.append(n_positions)
+            n_postings += len(docs)
+        if current is not None:
+            term_offsets.append(n_postings)
+
+        term_blob, term_str_offsets = terms.close()
+        sections = {
+            "term_blob": term_blob,
+            "term_str_offsets": term_str_offsets,
+            "term_offsets": term_offsets.close(),
+            "post_docs": post_docs.close(),
+            "post_tfs": post_tfs.close(),
+            "pos_offsets": pos_offsets.close(),
+            "positions": positions.close(),
+        }
+        self.stats["postings"] = n_postings
+        return term_count, sections
+
+    # ----------------------
+    # Entry point
+    # ----------------------
+    def build(self, files: Iterable[Tuple[str, str]], out_path: Path, work_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """
+        Index the (doc_id, content) stream into a segment file at out_path.
+        Temporary runs live in a scratch directory under work_dir (default: next to out_path).
+        Returns build statistics.
+        """
+        out_path = Path(out_path)
+        scratch = Path(tempfile.mkdtemp(prefix="spimi_", dir=work_dir or out_path.parent))
+        start = time.perf_counter()
+        try:
+            doc_ids = _StringSpool(scratch, "docid")
+            originals = _StringSpool(scratch, "original")
+            cleans = _StringSpool(scratch, "clean")
+            doc_count = 0
+
+            for doc_id, content in files:
+                if doc_id is None: raise ValueError("doc_id cannot be None")
+                if not isinstance(doc_id, str): doc_id = str(doc_id)
+                self._block_doc_ids.append(doc_id)
+                self._block_bytes += sys.getsizeof(doc_id) + DOC_ID_BYTES
+
+                tokens = self.preprocess_fn(content)
+                doc_ids.append(doc_id)
+                originals.append(content)
+                cleans.append(" ".join(tokens))
+                self._add_document(doc_count, tokens)
+                doc_count += 1
+
+                if self._block_bytes >= self.ram_budget_bytes:
+                    self._flush_run(scratch)
+            self._flush_run(scratch)
+            self._check_doc_ids()
+            invert_seconds = time.perf_counter() - start
+
+            term_count, sections = self._merge_runs(scratch)
+            sections["docid_blob"], sections["docid_offsets"] = doc_ids.close()
+            sections["original_blob"], sections["original_offsets"] = originals.close()
+            sections["clean_blob"], sections["clean_offsets"] = cleans.close()
+            write_segment_sections(out_path, doc_count, term_count, sections)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        total_seconds = time.perf_counter() - start
+        self.stats.update({
+            "docs": doc_count,
+            "terms": term_count,
+            "runs": len(self._runs),
+            "invert_seconds": invert_seconds,
+            "total_seconds": total_seconds,
+            "docs_per_sec": doc_count / invert_seconds if invert_seconds > 0 else 0.0,
+        })
+        self._runs = []
+        self._id_runs = []
+        return self.stats
+
+
+class SelfIndexSPIMI(SelfIndexSegment):
+    """
+    Segment-backed TF-IDF index whose create_index streams the corpus through
+    SPIMIBuilder, so peak memory is bounded by ram_budget_mb instead of corpus size.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_spimi", ram_budget_mb: float = 256):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        self.ram_budget_mb = ram_budget_mb
+
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """Streams (doc_id, content) pairs into a segment via sorted runs + k-way merge."""
+        print(f"[{self.identifier_short}] Creating SPIMI index: {index_id} (RAM budget {self.ram_budget_mb} MB)")
+
+        builder = SPIMIBuilder(self.preprocess_fn, ram_budget_mb=self.ram_budget_mb)
+        stats = builder.build(files, self._get_index_filepath(index_id), work_dir=self.storage_path)
+        self._next_word_path(index_id).unlink(missing_ok=True) # no next-word index for SPIMI builds
+
+        self.indices.add(index_id)
+        self._save_registry()
+        # Mapping the finished segment is cheap; keeps create_index leaving the index loaded
+        self._load_index_from_file(index_id)
+
+        print(f"[{self.identifier_short}] SPIMI index '{index_id}' created: {stats['docs']} docs, {stats['terms']} terms, "
+              f"{stats['runs']} runs, {stats['docs_per_sec']:.0f} docs/sec.")
+        print(f"[{self.identifier_short}] Saved to {self._get_index_filepath(index_id)}")
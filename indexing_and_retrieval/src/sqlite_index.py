@@ -0,0 +1,955 @@
+import sqlite3
+import json
+import math
+import queue
+import threading
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple, Dict, List, Optional, Set
+from collections import defaultdict
+
+from footprint import approx_sizeof
+from self_index import SelfIndexTFIDF
+from phrase_match import phrase_count
+from query_trace import count, dumps, query_log, traced_query
+from packed_postings import PostingsBuilder, TermBlob, drop_docs, pack_postings, phrase_scores, unpack_postings
+
+
+class SelfIndexSQLite(SelfIndexTFIDF):
+    """
+    Implements the index using SQLite as the datastore (y=2).
+    Inherits TF-IDF logic (x=3) but overrides storage and querying.
+    """
+    concurrent_queries = False # One connection, used by one thread at a time
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_sqlite"):
+        # We specify DB1 for the datastore type
+        # Keep TFIDF info for now, as we inherit scoring logic
+        super().__init__(core, 'TFIDF', 'DB1', qproc, compr, optim, preprocess_fn, storage_path)
+        self.db_path = self.storage_path / f"{self.identifier_short}_index.db"
+        self.conn = None # Will hold the database connection
+
+        # Ensure directory exists, handle registry
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.index_registry_file = self.storage_path / "index_registry.json"
+        self._load_registry() # Loads self.indices set
+
+    def _connect_db(self, index_id: str):
+        """Establish connection to the SQLite database file."""
+        db_file = self.storage_path / f"{index_id}.db"
+        # print(f"Connecting to SQLite DB: {db_file}")
+        # Not bound to the opening thread: a query server may load on one thread and query on another
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        # Use Row factory for dict-like access, though not strictly needed here
+        # self.conn.row_factory = sqlite3.Row
+
+    def _is_connected(self) -> bool:
+        return self.conn is not None
+
+    def _close_db(self):
+        """Close the database connection."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _create_schema(self):
+        """Create necessary tables if they don't exist."""
+        if not self.conn: raise RuntimeError("Database not connected.")
+        cursor = self.conn.cursor()
+        # Schema Design
+        # terms: Stores unique terms and their IDF (calculated later or stored)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS terms (
+                term_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                term_text TEXT UNIQUE NOT NULL,
+                df INTEGER DEFAULT 0 -- Document Frequency
+                -- idf REAL -- Could store pre-calculated IDF here
+            )
+        ''')
+        # documents: Stores document info
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                content TEXT -- Store original content if needed, or just ID
+                -- N INTEGER -- Store total doc count (N) here? Or in a separate metadata table
+            )
+        ''')
+        # postings: The core inverted index
+        # Storing positions as JSON text for simplicity in this version
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS postings (
+                term_id INTEGER NOT NULL,
+                doc_id TEXT NOT NULL,
+                term_frequency INTEGER NOT NULL, -- TF (count)
+                positions TEXT, -- JSON list of positions, e.g., '[1, 5, 12]'
+                FOREIGN KEY (term_id) REFERENCES terms (term_id),
+                FOREIGN KEY (doc_id) REFERENCES documents (doc_id),
+                PRIMARY KEY (term_id, doc_id)
+            )
+        ''')
+        # Forward index (doc -> postings): lets update_index remove a document
+        # without scanning the postings of every term
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id)")
+        # Metadata table (optional but good practice)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    # Override create_index
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]]) -> None:
+        """Builds and stores the index in an SQLite database."""
+        print(f"[{self.identifier_short}] Creating SQLite index (y=2): {index_id}")
+        self._connect_db(index_id)
+        self._create_schema()
+        cursor = self.conn.cursor()
+
+        # Use dictionaries for faster lookups during indexing
+        term_to_id: Dict[str, int] = {}
+        processed_docs = 0
+        all_postings_data = [] # List to store data for bulk insert
+
+        print(f"[{self.identifier_short}] Processing documents...")
+        for doc_id, content in files:
+            # (Input validation...)
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            processed_docs += 1
+
+            # Insert document (just ID for now)
+            cursor.execute("INSERT OR IGNORE INTO documents (doc_id) VALUES (?)", (doc_id,))
+
+            tokens = self.preprocess_fn(content)
+            term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+            doc_unique_terms = set()
+            for pos, term in enumerate(tokens):
+                term_positions_in_doc[term].append(pos)
+                doc_unique_terms.add(term)
+
+            # Prepare postings data for this doc
+            for term, positions in term_positions_in_doc.items():
+                # Get or insert term and get its ID
+                if term not in term_to_id:
+                    cursor.execute("INSERT OR IGNORE INTO terms (term_text) VALUES (?)", (term,))
+                    cursor.execute("SELECT term_id FROM terms WHERE term_text = ?", (term,))
+                    term_id = cursor.fetchone()[0]
+                    term_to_id[term] = term_id
+                else:
+                    term_id = term_to_id[term]
+
+                tf = len(positions)
+                positions_json = json.dumps(positions)
+                all_postings_data.append((term_id, doc_id, tf, positions_json))
+
+            # Update DF counts for unique terms in this doc
+            for term in doc_unique_terms:
+                term_id = term_to_id[term] # We know the term exists now
+                cursor.execute("UPDATE terms SET df = df + 1 WHERE term_id = ?", (term_id,))
+
+            if processed_docs % 1000 == 0: # Progress indicator
+                print(f"[{self.identifier_short}] Processed {processed_docs} documents...")
+
+
+        print(f"[{self.identifier_short}] Inserting postings (bulk)...")
+        # Bulk insert postings for efficiency
+        cursor.executemany("INSERT INTO postings (term_id, doc_id, term_frequency, positions) VALUES (?, ?, ?, ?)", all_postings_data)
+
+        # Store metadata (like total doc count N); exact counts, since update_index only adjusts them
+        doc_count = cursor.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", ('doc_count', str(doc_count)))
+        term_count = cursor.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", ('term_count', str(term_count)))
+
+        self.conn.commit()
+        self._invalidate_query_cache()
+        print(f"[{self.identifier_short}] SQLite index '{index_id}' created: {processed_docs} docs, {term_count} terms.")
+
+        # Update registry and close DB
+        self.indices.add(index_id)
+        self._save_registry()
+        self._close_db()
+
+    # Override load_index
+    def load_index(self, serialized_index_dump: str) -> None:
+        """Establishes connection to the SQLite index file."""
+        index_id = serialized_index_dump
+        db_file = self.storage_path / f"{index_id}.db"
+        if index_id not in self.indices and not db_file.exists():
+            raise FileNotFoundError(f"Index '{index_id}' not registered and DB file not found: {db_file}")
+
+        print(f"[{self.identifier_short}] Connecting to SQLite index '{index_id}'...")
+        # Close any existing connection first
+        self._close_db()
+        # Connect to the specified index DB
+        self._connect_db(index_id)
+
+        # Verify connection and maybe load metadata
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'doc_count'")
+            doc_count = cursor.fetchone()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'term_count'")
+            term_count = cursor.fetchone()
+            if doc_count and term_count:
+                print(f"[{self.identifier_short}] Connected to index: docs={doc_count[0]}, terms={term_count[0]}")
+            else:
+                print(f"[{self.identifier_short}] Connected to index (metadata not found).")
+        except Exception as e:
+            print(f"[{self.identifier_short}] Warning: Error reading metadata from DB. {e}")
+            # Don't keep connection if DB seems broken
+            self._close_db()
+            raise RuntimeError(f"Failed to connect or verify index '{index_id}'.") from e
+
+        # NOTE: We are NOT loading the inverted index into memory here.
+        # Query methods will access the DB directly.
+        # Clear any in-memory data from parent classes
+        self.index_data = {}
+        self._invalidate_query_cache()
+
+
+    # Override query-related methods
+    # These now need to query the SQLite DB instead of self.index_data
+
+    def _get_term_id(self, term: str) -> int | None:
+        """Gets the term_id from the DB for a given term string."""
+        if not self.conn: raise RuntimeError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT term_id FROM terms WHERE term_text = ?", (term,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def _get_doc_count_N(self) -> int:
+        """Gets total document count (N) from metadata."""
+        if not self.conn: raise RuntimeError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT value FROM metadata WHERE key = 'doc_count'")
+        result = cursor.fetchone()
+        return int(result[0]) if result else 0
+
+    @staticmethod
+    def _read_counts(cursor: sqlite3.Cursor) -> Tuple[int, int]:
+        """(doc_count, term_count) from metadata; counted once for DBs written without them."""
+        counts = dict(cursor.execute("SELECT key, value FROM metadata WHERE key IN ('doc_count', 'term_count')"))
+        if 'doc_count' not in counts:
+            counts['doc_count'] = cursor.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        if 'term_count' not in counts:
+            counts['term_count'] = cursor.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        return int(counts['doc_count']), int(counts['term_count'])
+
+    def _get_term_df(self, term_id: int) -> int:
+        """Gets Document Frequency (DF) for a term_id."""
+        if not self.conn: raise RuntimeError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT df FROM terms WHERE term_id = ?", (term_id,))
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+    def _calculate_idf(self, term: str) -> float:
+        """Calculates IDF by querying the database."""
+        # Override to use DB lookups for N and DF
+        term_id = self._get_term_id(term)
+        if term_id is None: return 0.0
+
+        N = self._get_doc_count_N()
+        df = self._get_term_df(term_id)
+
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates term/phrase, returning {doc_id: tfidf_score} by querying DB."""
+        if not self.conn: raise RuntimeError("Database not connected.")
+        cursor = self.conn.cursor()
+        final_scores = defaultdict(float)
+
+        if " " not in operand: # Single term
+            term = operand
+            term_id = self._get_term_id(term)
+            if term_id is None: return {}
+
+            idf = self._calculate_idf(term) # Uses DB lookups
+            if idf == 0: return {}
+
+            # Query postings for this term_id
+            cursor.execute("""
+                SELECT doc_id, term_frequency FROM postings
+                WHERE term_id = ?
+            """, (term_id,))
+            for doc_id, tf in cursor.fetchall():
+                final_scores[doc_id] = tf * idf
+
+        else: # Phrase -> Needs positions
+            phrase_tokens = operand.split(" ")
+            term_ids = [(t, self._get_term_id(t)) for t in phrase_tokens]
+
+            # Check if all terms exist
+            if any(tid is None for _, tid in term_ids): return {}
+
+            # Phrase matching using SQL and Python
+            # 1. Find candidate docs (containing all terms) using SQL intersection
+            base_query = "SELECT doc_id FROM postings WHERE term_id = ?"
+            candidate_sets = []
+            for _, term_id in term_ids:
+                cursor.execute(base_query, (term_id,))
+                candidate_sets.append({row[0] for row in cursor.fetchall()})
+
+            if not candidate_sets: return {}
+            candidate_docs = set.intersection(*candidate_sets)
+            if not candidate_docs: return {}
+
+            # 2. Fetch positions for candidate docs and check adjacency in Python
+            doc_positions: Dict[str, Dict[str, List[int]]] = defaultdict(dict) # {doc: {term: [pos]}}
+
+            # Fetch relevant positions efficiently
+            placeholders = ','.join('?' * len(candidate_docs))
+            tid_placeholders = ','.join('?' * len(term_ids))
+            params = [tid for _, tid in term_ids] + list(candidate_docs)
+            cursor.execute(f"""
+                SELECT p.doc_id, t.term_text, p.positions
+                FROM postings p JOIN terms t ON p.term_id = t.term_id
+                WHERE p.term_id IN ({tid_placeholders}) AND p.doc_id IN ({placeholders})
+            """, params)
+
+            for doc_id, term_text, positions_json in cursor.fetchall():
+                doc_positions[doc_id][term_text] = json.loads(positions_json)
+
+            # 3. Perform positional check (same logic as before)
+            matched_docs = set()
+            for doc in candidate_docs:
+                pos_lists = [doc_positions[doc].get(t, []) for t in phrase_tokens]
+                if any(not pl for pl in pos_lists): continue # Should not happen if candidates are correct
+                if phrase_count(pos_lists, first_only=True): matched_docs.add(doc)
+
+            # 4. Calculate scores for matched docs (sum TF-IDF of individual terms)
+            term_idfs = {term: self._calculate_idf(term) for term, _ in term_ids}
+            for doc_id in matched_docs:
+                doc_score = 0.0
+                for term, term_id in term_ids:
+                    # Fetch TF for this specific doc/term
+                    cursor.execute("SELECT term_frequency FROM postings WHERE term_id = ? AND doc_id = ?", (term_id, doc_id))
+                    tf_result = cursor.fetchone()
+                    if tf_result:
+                        tf = tf_result[0]
+                        idf = term_idfs[term]
+                        doc_score += tf * idf
+                final_scores[doc_id] = doc_score
+
+        return dict(final_scores)
+
+    # Other methods
+    # Need to override methods that assume self.index_data is the full index
+
+    def delete_index(self, index_id: str) -> None:
+        """Delete SQLite index file and remove from registry."""
+        db_file = self.storage_path / f"{index_id}.db"
+        if db_file.exists():
+            # Ensure connection is closed before deleting
+            if self.conn and self.conn.execute("PRAGMA database_list;").fetchone()[1] == str(db_file):
+                self._close_db()
+            db_file.unlink()
+            self.indices.discard(index_id)
+            self._save_registry()
+            print(f"[{self.identifier_short}] Deleted SQLite index '{index_id}'.")
+        else:
+            print(f"[{self.identifier_short}] Index file not found for '{index_id}'.")
+        # Clear any potentially loaded (stale) connection info
+        self.conn = None
+        self._invalidate_query_cache()
+
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Return list of doc IDs from the documents table."""
+        # Ensure connection is established for the correct index
+        self._connect_db(index_id)
+        if not self.conn: raise RuntimeError("Failed to connect to DB for listing files.")
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT doc_id FROM documents ORDER BY doc_id")
+        doc_ids = [row[0] for row in cursor.fetchall()]
+        # Don't close connection here, query might need it immediately after
+        # self._close_db()
+        return doc_ids
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Incremental update inside one transaction; cost is proportional to the changed
+        documents, not to the vocabulary or the index size.
+        - removed (and re-added) docs: their postings are found through the doc_id index,
+          df of exactly those terms is decremented, then the rows are deleted
+        - added docs: postings inserted, df incremented per unique term
+        - terms of the batch left with df = 0 are dropped; doc_count/term_count metadata
+          adjusted by the rows deleted and inserted (no table scans)
+        The updated index stays connected, so queries can follow directly.
+        """
+        print(f"[{self.identifier_short}] Updating SQLite index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        self._close_db()
+        self._connect_db(index_id)
+        self._create_schema() # Adds the doc_id index to DBs built before it existed
+        cursor = self.conn.cursor()
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids.update(additions)
+
+        try:
+            doc_count, term_count = self._read_counts(cursor)
+            # ---------- removals ----------
+            removed = 0
+            touched_terms: Set[int] = set()
+            for doc_id in remove_ids:
+                cursor.execute("SELECT term_id FROM postings WHERE doc_id = ?", (doc_id,))
+                touched_terms.update(row[0] for row in cursor.fetchall())
+                cursor.execute("""
+                    UPDATE terms SET df = df - 1
+                    WHERE term_id IN (SELECT term_id FROM postings WHERE doc_id = ?)
+                """, (doc_id,))
+                cursor.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                cursor.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                removed += cursor.rowcount
+            cursor.executemany("DELETE FROM terms WHERE term_id = ? AND df <= 0", ((t,) for t in touched_terms))
+            term_count -= max(cursor.rowcount, 0)
+
+            # ---------- additions ----------
+            postings_data = []
+            for doc_id, content in additions.items():
+                cursor.execute("INSERT INTO documents (doc_id) VALUES (?)", (doc_id,))
+
+                tokens = self.preprocess_fn(content)
+                term_positions_in_doc: Dict[str, List[int]] = defaultdict(list)
+                for pos, term in enumerate(tokens):
+                    term_positions_in_doc[term].append(pos)
+
+                for term, positions in term_positions_in_doc.items():
+                    cursor.execute("INSERT OR IGNORE INTO terms (term_text) VALUES (?)", (term,))
+                    term_count += cursor.rowcount
+                    cursor.execute("UPDATE terms SET df = df + 1 WHERE term_text = ?", (term,))
+                    term_id = self._get_term_id(term)
+                    postings_data.append((term_id, doc_id, len(positions), json.dumps(positions)))
+            cursor.executemany("INSERT INTO postings (term_id, doc_id, term_frequency, positions) VALUES (?, ?, ?, ?)",
+                               postings_data)
+
+            # ---------- metadata ----------
+            doc_count += len(additions) - removed
+            cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", ('doc_count', str(doc_count)))
+            cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", ('term_count', str(term_count)))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self.index_data = {}
+        self._invalidate_query_cache()
+        print(f"[{self.identifier_short}] Update complete: -{removed} / +{len(additions)} docs. "
+              f"docs={doc_count}, terms={term_count}")
+
+    # Need __del__ to ensure DB connection is closed when object is destroyed
+    def __del__(self):
+        self._close_db()
+
+
+    # Planner hooks: df and the NOT universe come from the DB
+    # (the planner only materializes the universe for a NOT outside an AND)
+    def _doc_freq(self, term: str) -> int:
+        term_id = self._get_term_id(term)
+        return self._get_term_df(term_id) if term_id is not None else 0
+
+    def _universe_size(self) -> int:
+        return self._get_doc_count_N()
+
+    def _universe(self) -> Set[str]:
+        if not self.conn: raise RuntimeError("Database not connected for NOT operation.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT doc_id FROM documents")
+        return {row[0] for row in cursor.fetchall()}
+
+
+    # Override query
+    # We need to copy this from SelfIndexTFIDF and change the check.
+    @traced_query
+    def query(self, query: str, explain: bool = False) -> str:
+        """
+        Perform boolean query using the SQLite database.
+        Returns ranked results based on TF-IDF scores.
+        """
+        # Check the DB connection instead of self.index_data
+        if not self._is_connected():
+            # Try to auto-connect if an index_id was previously loaded?
+            # For simplicity, let's just raise the error for now.
+            # You might need to pass the current index_id to query if you
+            # want it to auto-connect.
+            raise RuntimeError("Database not connected. Call load_index(index_id) first.")
+        # END FIX
+
+        query_log.info("[%s] Querying SQLite (TF-IDF x=3, DB y=2): %s", self.identifier_short, query)
+
+        plan = None
+        try:
+            # These parent methods should be okay as they don't access index data directly
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            # This now calls the overridden _evaluate_rpn which uses the DB
+            ranked_results = self._cached_results(rpn, lambda: self._rank(self._evaluate_rpn(rpn)))
+
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = {
+            "query": query,
+            "results": ranked_results,
+            "count": len(ranked_results),
+        }
+        if explain: out["plan"] = plan
+        return dumps(out)
+
+
+# ----------------------
+# Binary postings + bulk loader
+# ----------------------
+# One row per (term, chunk) holds n postings packed by packed_postings.pack_postings.
+# docs are internal doc_nums, ascending within a row and across the chunks of a term.
+# create_index writes one chunk per batch of documents; update_index rewrites only the
+# rows of the terms a removed doc contains and appends added docs as a new chunk.
+
+
+class SQLiteReaderPool:
+    """
+    Read-only connections to one index file, each used by one thread at a time.
+    Connections are opened lazily up to `size`; past that, callers wait for a free one.
+    WAL mode lets these readers run next to a writer.
+    """
+
+    def __init__(self, db_file: Path, size: int = 4, mmap_bytes: int = 256 * 1024 * 1024):
+        self.db_file = db_file
+        self.size = size
+        self.mmap_bytes = mmap_bytes
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if len(self._opened) < self.size:
+                    conn = self._open()
+                    self._opened.append(conn)
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened = []
+            self._idle = queue.LifoQueue()
+
+
+class SelfIndexSQLiteBlob(SelfIndexSQLite):
+    """
+    SQLite datastore (y=2) with binary postings and a bulk loader.
+    - create_index assigns term ids in memory and writes one packed row per term per
+      batch of `batch_docs` documents, in large WAL transactions; df is written once
+    - a term (df and all its chunks) is read with one statement; phrases are matched
+      on the decoded positions, with no per-document lookups
+    - queries go through a SQLiteReaderPool, so several threads can query one index file
+    Same results and scores as SelfIndexSQLite.
+    """
+    concurrent_queries = True
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn,
+                 storage_path="./my_index_storage_sqlite_blob", pool_size: int = 4):
+        super().__init__(core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path)
+        self.pool_size = pool_size
+        self.pool: Optional[SQLiteReaderPool] = None
+        self.doc_ids: Dict[int, str] = {} # doc_num -> doc_id of the loaded index
+        self._local = threading.local() # .batch: blobs fetched by batch_scope on this thread
+
+    def _db_file(self, index_id: str) -> Path:
+        return self.storage_path / f"{index_id}.db"
+
+    def _connect_db(self, index_id: str):
+        """Writer connection, tuned for bulk writes; WAL so pooled readers are not blocked."""
+        self.conn = sqlite3.connect(self._db_file(index_id))
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.conn.execute("PRAGMA cache_size = -262144") # 256 MB
+
+    def _is_connected(self) -> bool:
+        return self.pool is not None
+
+    def memory_footprint(self) -> int:
+        """Postings stay in the DB file: only the doc_num -> doc_id map is resident."""
+        return approx_sizeof(self.doc_ids)
+
+    def _close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def _create_schema(self):
+        if not self.conn: raise RuntimeError("Database not connected.")
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS terms (
+                term_id INTEGER PRIMARY KEY, -- assigned by the loader
+                term_text TEXT UNIQUE NOT NULL,
+                df INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term_id INTEGER NOT NULL,
+                chunk INTEGER NOT NULL,
+                n INTEGER NOT NULL, -- postings in this row
+                data BLOB NOT NULL, -- uint32 docs | tfs | positions
+                PRIMARY KEY (term_id, chunk)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_num INTEGER PRIMARY KEY,
+                doc_id TEXT UNIQUE NOT NULL,
+                term_ids BLOB NOT NULL -- forward index (uint32 term ids) for update_index
+            );
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        self.conn.commit()
+
+    def _term_positions(self, tokens: List[str], term_to_id: Dict[str, int]) -> Dict[int, List[int]]:
+        """{term_id: positions} of one analyzed document; unseen terms get the next id."""
+        term_positions: Dict[int, List[int]] = defaultdict(list)
+        for pos, term in enumerate(tokens):
+            term_id = term_to_id.get(term)
+            if term_id is None:
+                term_id = term_to_id[term] = self._next_term_id
+                self._next_term_id += 1
+            term_positions[term_id].append(pos)
+        return term_positions
+
+    @staticmethod
+    def _lookup_term_ids(cursor: sqlite3.Cursor, terms: List[str], max_vars: int = 500) -> Dict[str, int]:
+        """{term: term_id} of the known terms among terms, one statement per max_vars terms."""
+        term_to_id: Dict[str, int] = {}
+        for i in range(0, len(terms), max_vars):
+            part = terms[i:i + max_vars]
+            term_to_id.update(cursor.execute(
+                f"SELECT term_text, term_id FROM terms WHERE term_text IN ({','.join('?' * len(part))})", part))
+        return term_to_id
+
+    @staticmethod
+    def _chunk_rows(builder: PostingsBuilder, chunk: int) -> Iterator[Tuple[int, int, int, bytes]]:
+        for term_id, (docs, tfs, positions) in builder.items():
+            yield term_id, chunk, len(docs), pack_postings(docs, tfs, positions)
+
+    def _flush_chunk(self, builder: PostingsBuilder, chunk: int, documents: List[Tuple[int, str, bytes]]) -> None:
+        self.conn.executemany("INSERT INTO postings (term_id, chunk, n, data) VALUES (?, ?, ?, ?)",
+                              self._chunk_rows(builder, chunk))
+        self.conn.executemany("INSERT INTO documents (doc_num, doc_id, term_ids) VALUES (?, ?, ?)", documents)
+        self.conn.commit()
+
+    def _write_metadata(self, doc_count: int, term_count: int, next_chunk: int) -> None:
+        self.conn.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                              [('doc_count', str(doc_count)), ('term_count', str(term_count)),
+                               ('next_chunk', str(next_chunk))])
+
+    def create_index(self, index_id: str, files: Iterable[Tuple[str, str]], batch_docs: int = 50_000) -> None:
+        """Bulk-builds the index; an existing index with the same id is replaced."""
+        print(f"[{self.identifier_short}] Creating SQLite blob index (y=2): {index_id}")
+        self._close_pool()
+        self._close_db()
+        db_file = self._db_file(index_id)
+        for path in (db_file, Path(f"{db_file}-wal"), Path(f"{db_file}-shm")):
+            if path.exists(): path.unlink()
+        self._connect_db(index_id)
+        self.conn.execute("PRAGMA synchronous = OFF") # a crash mid-build leaves nothing worth keeping
+        self._create_schema()
+
+        term_to_id: Dict[str, int] = {}
+        self._next_term_id = 1
+        df: Dict[int, int] = defaultdict(int)
+        seen: Set[str] = set()
+        builder, documents, chunk = PostingsBuilder(), [], 0
+        for doc_id, content in files:
+            if doc_id is None: raise ValueError("doc_id cannot be None")
+            if not isinstance(doc_id, str): doc_id = str(doc_id)
+            if doc_id in seen: raise ValueError(f"Duplicate doc_id: {doc_id}")
+            seen.add(doc_id)
+
+            doc_num = len(seen) - 1
+            term_positions = self._term_positions(self.preprocess_fn(content), term_to_id)
+            builder.add(doc_num, term_positions)
+            for term_id in term_positions: df[term_id] += 1
+            documents.append((doc_num, doc_id, array('I', term_positions).tobytes()))
+
+            if builder.num_docs >= batch_docs:
+                self._flush_chunk(builder, chunk, documents)
+                builder, documents, chunk = PostingsBuilder(), [], chunk + 1
+                print(f"[{self.identifier_short}] Processed {len(seen)} documents...")
+        if builder.num_docs:
+            self._flush_chunk(builder, chunk, documents)
+            chunk += 1
+
+        # df once, at the end
+        self.conn.executemany("INSERT INTO terms (term_id, term_text, df) VALUES (?, ?, ?)",
+                              ((term_id, term, df[term_id]) for term, term_id in term_to_id.items()))
+        self._write_metadata(len(seen), len(term_to_id), chunk)
+        self.conn.commit()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._close_db()
+
+        self._invalidate_query_cache()
+        print(f"[{self.identifier_short}] SQLite blob index '{index_id}' created: {len(seen)} docs, {len(term_to_id)} terms.")
+        self.indices.add(index_id)
+        self._save_registry()
+
+    def load_index(self, serialized_index_dump: str) -> None:
+        """Opens the reader pool and caches the doc_num -> doc_id map (N = its size)."""
+        index_id = serialized_index_dump
+        db_file = self._db_file(index_id)
+        if not db_file.exists():
+            raise FileNotFoundError(f"Index '{index_id}' DB file not found: {db_file}")
+
+        print(f"[{self.identifier_short}] Connecting to SQLite blob index '{index_id}'...")
+        self._close_db()
+        self._close_pool()
+        self.pool = SQLiteReaderPool(db_file, size=self.pool_size)
+        try:
+            with self.pool.connection() as conn:
+                self.doc_ids = dict(conn.execute("SELECT doc_num, doc_id FROM documents"))
+                term_count = conn.execute("SELECT value FROM metadata WHERE key = 'term_count'").fetchone()
+        except sqlite3.Error as e:
+            self._close_pool()
+            raise RuntimeError(f"Failed to connect or verify index '{index_id}'.") from e
+        print(f"[{self.identifier_short}] Connected to index: docs={len(self.doc_ids)}, "
+              f"terms={term_count[0] if term_count else '?'}")
+        self.index_data = {}
+        self._invalidate_query_cache()
+
+    # --- Reads (pooled, safe to call from several threads) ---
+    @staticmethod
+    def _term_blob(rows: List[Tuple[int, int, bytes]]) -> TermBlob:
+        """(df, n, data) rows of one term, in chunk order -> TermBlob."""
+        if len(rows) == 1:
+            return TermBlob(rows[0][0], *unpack_postings(rows[0][1], rows[0][2]))
+        docs, tfs, positions = array('I'), array('I'), array('I')
+        for _, n, data in rows:
+            chunk_docs, chunk_tfs, chunk_positions = unpack_postings(n, data)
+            docs.extend(chunk_docs); tfs.extend(chunk_tfs); positions.extend(chunk_positions)
+        return TermBlob(rows[0][0], docs, tfs, positions)
+
+    def _fetch_term(self, term: str) -> Optional[TermBlob]:
+        """df and every chunk of a term in one statement, None if the term is unknown."""
+        batch = getattr(self._local, "batch", None)
+        if batch is not None and term in batch:
+            return batch[term]
+        if self.pool is None: raise RuntimeError("Database not connected.")
+        count("round_trips")
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT t.df, p.n, p.data FROM terms t JOIN postings p ON p.term_id = t.term_id
+                WHERE t.term_text = ? ORDER BY p.chunk
+            """, (term,)).fetchall()
+        return self._term_blob(rows) if rows else None
+
+    def _fetch_terms(self, terms: List[str], max_vars: int = 500) -> Dict[str, Optional[TermBlob]]:
+        """Several terms with one statement per max_vars terms."""
+        if self.pool is None: raise RuntimeError("Database not connected.")
+        rows_by_term: Dict[str, list] = defaultdict(list)
+        with self.pool.connection() as conn:
+            for i in range(0, len(terms), max_vars):
+                part = terms[i:i + max_vars]
+                count("round_trips")
+                for term, df, n, data in conn.execute(f"""
+                    SELECT t.term_text, t.df, p.n, p.data FROM terms t JOIN postings p ON p.term_id = t.term_id
+                    WHERE t.term_text IN ({','.join('?' * len(part))}) ORDER BY t.term_text, p.chunk
+                """, part):
+                    rows_by_term[term].append((df, n, data))
+        return {term: self._term_blob(rows_by_term[term]) if term in rows_by_term else None for term in terms}
+
+    @contextmanager
+    def batch_scope(self, queries: List[str]):
+        """The postings of every word of the batch are read up front, in one statement."""
+        self._local.batch = self._fetch_terms(self._query_words(queries))
+        try:
+            yield
+        finally:
+            self._local.batch = None
+
+    def _idf(self, df: int) -> float:
+        N = len(self.doc_ids)
+        if N == 0 or df == 0: return 0.0
+        return math.log(N / df)
+
+    def _doc_freq(self, term: str) -> int:
+        batch = getattr(self._local, "batch", None)
+        if batch is not None and term in batch:
+            return batch[term].df if batch[term] is not None else 0
+        if self.pool is None: raise RuntimeError("Database not connected.")
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT df FROM terms WHERE term_text = ?", (term,)).fetchone()
+        return row[0] if row else 0
+
+    def _calculate_idf(self, term: str) -> float:
+        return self._idf(self._doc_freq(term))
+
+    def _universe_size(self) -> int:
+        return len(self.doc_ids)
+
+    def _universe(self) -> Set[str]:
+        return set(self.doc_ids.values())
+
+    def _eval_operand_to_scored_docs(self, operand: str) -> Dict[str, float]:
+        """Evaluates term/phrase, returning {doc_id: tfidf_score} from the decoded blobs."""
+        doc_ids = self.doc_ids
+        if " " not in operand: # Single term
+            blob = self._fetch_term(operand)
+            if blob is None: return {}
+            idf = self._idf(blob.df)
+            if idf == 0: return {}
+            return {doc_ids[d]: tf * idf for d, tf in zip(blob.docs, blob.tfs)}
+
+        # Phrase: matched on the decoded positions
+        phrase_tokens = operand.split(" ")
+        blobs = {}
+        for term in phrase_tokens:
+            if term not in blobs:
+                blobs[term] = self._fetch_term(term)
+                if blobs[term] is None: return {}
+        idfs = {term: self._idf(blob.df) for term, blob in blobs.items()}
+        return {doc_ids[d]: score for d, score in phrase_scores(blobs, phrase_tokens, idfs).items()}
+
+    def list_indexed_files(self, index_id: str) -> Iterable[str]:
+        """Return list of doc IDs from the documents table."""
+        with sqlite3.connect(self._db_file(index_id)) as conn:
+            return [row[0] for row in conn.execute("SELECT doc_id FROM documents ORDER BY doc_id")]
+
+    def update_index(self, index_id: str,
+                     remove_files: Iterable[Tuple[str, str]],
+                     add_files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Incremental update inside one transaction.
+        - removed (and re-added) docs: their term ids come from the forward index, only the
+          rows of those terms are rewritten without them
+        - added docs: packed as one new chunk with fresh doc_nums
+        - df deltas applied once per term; terms left with df = 0 are dropped
+        - only the batch's terms are looked up, and doc_count/term_count metadata is
+          adjusted by the rows deleted and inserted (no table scans)
+        The index is reloaded afterwards, so queries can follow directly.
+        """
+        print(f"[{self.identifier_short}] Updating SQLite blob index '{index_id}'...")
+        if index_id not in self.indices:
+            raise FileNotFoundError(f"Index '{index_id}' is not present. Create it first.")
+
+        self._close_db()
+        self._connect_db(index_id)
+        cursor = self.conn.cursor()
+
+        remove_ids = {str(doc_id) for doc_id, _ in remove_files} if remove_files else set()
+        # Last content wins if a doc_id is added twice; re-added docs replace the old version
+        additions = {str(doc_id): content for doc_id, content in (add_files or [])}
+        remove_ids.update(additions)
+
+        try:
+            doc_count, term_count = self._read_counts(cursor)
+            df_delta: Dict[int, int] = defaultdict(int)
+            # ---------- removals ----------
+            removed_docs: Set[int] = set()
+            for doc_id in remove_ids:
+                row = cursor.execute("SELECT doc_num, term_ids FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row is None: continue
+                removed_docs.add(row[0])
+                term_ids = array('I')
+                term_ids.frombytes(row[1])
+                for term_id in term_ids: df_delta[term_id] -= 1
+            cursor.executemany("DELETE FROM documents WHERE doc_num = ?", ((d,) for d in removed_docs))
+
+            for term_id in list(df_delta):
+                rows = cursor.execute("SELECT chunk, n, data FROM postings WHERE term_id = ?", (term_id,)).fetchall()
+                for chunk, n, data in rows:
+                    kept = drop_docs(*unpack_postings(n, data), removed_docs)
+                    if len(kept[0]) == n: continue
+                    if not kept[0]:
+                        cursor.execute("DELETE FROM postings WHERE term_id = ? AND chunk = ?", (term_id, chunk))
+                    else:
+                        cursor.execute("UPDATE postings SET n = ?, data = ? WHERE term_id = ? AND chunk = ?",
+                                       (len(kept[0]), pack_postings(*kept), term_id, chunk))
+
+            # ---------- additions ----------
+            if additions:
+                analyzed = {doc_id: self.preprocess_fn(content) for doc_id, content in additions.items()}
+                term_to_id = self._lookup_term_ids(cursor, sorted({t for tokens in analyzed.values() for t in tokens}))
+                self._next_term_id = (cursor.execute("SELECT MAX(term_id) FROM terms").fetchone()[0] or 0) + 1
+                known_terms = set(term_to_id.values())
+                doc_num = (cursor.execute("SELECT MAX(doc_num) FROM documents").fetchone()[0] or -1) + 1
+                builder, documents = PostingsBuilder(), []
+                for doc_id, tokens in analyzed.items():
+                    term_positions = self._term_positions(tokens, term_to_id)
+                    builder.add(doc_num, term_positions)
+                    for term_id in term_positions: df_delta[term_id] += 1
+                    documents.append((doc_num, doc_id, array('I', term_positions).tobytes()))
+                    doc_num += 1
+                chunk = int(cursor.execute("SELECT value FROM metadata WHERE key = 'next_chunk'").fetchone()[0])
+                cursor.executemany("INSERT INTO postings (term_id, chunk, n, data) VALUES (?, ?, ?, ?)",
+                                   self._chunk_rows(builder, chunk))
+                cursor.executemany("INSERT INTO documents (doc_num, doc_id, term_ids) VALUES (?, ?, ?)", documents)
+                new_terms = [(term_id, term) for term, term_id in term_to_id.items() if term_id not in known_terms]
+                cursor.executemany("INSERT INTO terms (term_id, term_text, df) VALUES (?, ?, 0)", new_terms)
+                term_count += len(new_terms)
+                cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('next_chunk', ?)", (str(chunk + 1),))
+
+            # ---------- df, metadata ----------
+            cursor.executemany("UPDATE terms SET df = df + ? WHERE term_id = ?",
+                               ((delta, term_id) for term_id, delta in df_delta.items() if delta))
+            cursor.executemany("DELETE FROM terms WHERE term_id = ? AND df <= 0",
+                               ((term_id,) for term_id, delta in df_delta.items() if delta < 0))
+            term_count -= max(cursor.rowcount, 0)
+            doc_count += len(additions) - len(removed_docs)
+            cursor.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                               [('doc_count', str(doc_count)), ('term_count', str(term_count))])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self._close_db()
+
+        print(f"[{self.identifier_short}] Update complete: -{len(removed_docs)} / +{len(additions)} docs. "
+              f"docs={doc_count}, terms={term_count}")
+        self.load_index(index_id)
+
+    def delete_index(self, index_id: str) -> None:
+        """Delete the index file (and its WAL files) and remove it from the registry."""
+        self._close_pool()
+        self._close_db()
+        self.doc_ids = {}
+        db_file = self._db_file(index_id)
+        super().delete_index(index_id)
+        for path in (Path(f"{db_file}-wal"), Path(f"{db_file}-shm")):
+            if path.exists(): path.unlink()
+
+    def __del__(self):
+        self._close_pool()
+        self._close_db()
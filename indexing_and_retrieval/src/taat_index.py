@@ -0,0 +1,166 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compact_index import SelfIndexCompact
+from query_planner import EMPTY, NOT, OR, TERM, PlanNode
+from query_trace import dumps, query_log, traced_query
+
+# ----------------------
+# Vectorized term-at-a-time evaluation
+# ----------------------
+# Every plan node (query_planner) evaluates to a dense pair indexed by internal doc id:
+#   mask:   bool[N], the docs the node matches
+#   scores: float64[N], their scores, 0.0 everywhere else
+# A term scatters tf * idf of its postings slice into a fresh vector, AND/OR/NOT are
+# mask operations plus whole-vector additions, done in query order. Adding 0.0 for the
+# docs an operand does not contain is exact, so every score is bit-identical to the
+# dict engine (SelfIndexRanked._evaluate_rpn); float64 rather than float32 for that
+# reason, float32 rounding would reorder near-tied documents.
+
+Dense = Tuple[np.ndarray, np.ndarray]
+
+
+class SelfIndexTaaT(SelfIndexCompact):
+    """
+    Implements Term-at-a-time (TaaT) query processing (q=Tn) with NumPy over the
+    CompactPostings arrays (zero-copy views of post_docs/post_tfs).
+    Same results and TF-IDF scores as SelfIndexCompact; top_k selects with argpartition.
+    """
+
+    def __init__(self, core, info, dstore, qproc, compr, optim, preprocess_fn, storage_path="./my_index_storage_taat"):
+        # Explicitly set query processor to TaaT
+        SelfIndexCompact.__init__(self, core, info, dstore, 'TERMatat', compr, optim, preprocess_fn, storage_path)
+        self._arrays = None
+
+    def _np_postings(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(post_docs, post_tfs) as NumPy views, rebuilt when another index gets loaded."""
+        postings = self._postings()
+        if self._arrays is None or self._arrays[0] is not postings:
+            self._arrays = (postings, np.asarray(postings.post_docs), np.asarray(postings.post_tfs))
+        return self._arrays[1], self._arrays[2]
+
+    def _empty(self) -> Dense:
+        n = len(self._postings().doc_ids)
+        return np.zeros(n, dtype=bool), np.zeros(n)
+
+    # --- Operands ---
+    def _dense_term(self, term: str) -> Dense:
+        mask, scores = self._empty()
+        rng = self._postings().term_range(term)
+        idf = self._calculate_idf(term)
+        if not rng or idf == 0: return mask, scores # Same as the dict engine: df = N scores nothing
+        post_docs, post_tfs = self._np_postings()
+        docs = post_docs[rng[0]:rng[1]]
+        mask[docs] = True
+        scores[docs] = post_tfs[rng[0]:rng[1]] * idf
+        return mask, scores
+
+    def _dense_phrase(self, phrase_tokens: List[str]) -> Dense:
+        mask, scores = self._empty()
+        postings = self._postings()
+        matches = self._phrase_matches(phrase_tokens)
+        if not matches: return mask, scores
+        post_docs, post_tfs = self._np_postings()
+        docs = np.fromiter(matches, dtype=np.int64, count=len(matches))
+        # Sum of tf * idf of the phrase words, in phrase order; every match holds every word
+        doc_scores = np.zeros(len(docs))
+        for term in phrase_tokens:
+            start, end = postings.term_range(term)
+            found = start + np.searchsorted(post_docs[start:end], docs)
+            doc_scores += post_tfs[found] * self._calculate_idf(term)
+        mask[docs] = True
+        scores[docs] = doc_scores
+        return mask, scores
+
+    # --- Plan execution ---
+    def _dense(self, node: PlanNode, fetched: Dict[str, Dense]) -> Dense:
+        if node.op == TERM:
+            # Repeated operands are computed once per query (and never modified in place)
+            if node.operand not in fetched:
+                parts = node.operand.split(" ")
+                fetched[node.operand] = self._dense_term(parts[0]) if len(parts) == 1 else self._dense_phrase(parts)
+            return fetched[node.operand]
+        if node.op == EMPTY:
+            return self._empty()
+
+        if node.op == NOT:
+            mask = ~self._dense(node.children[0], fetched)[0]
+            return mask, mask.astype(np.float64)
+
+        if node.op == OR:
+            mask, scores = self._empty()
+            for child in node.children:
+                child_mask, child_scores = self._dense(child, fetched)
+                mask |= child_mask
+                scores += child_scores
+            return mask, scores
+
+        # AND: rarest operands first, stop as soon as nothing is left
+        mask = None
+        results: Dict[int, np.ndarray] = {}
+        for child in node.exec_order:
+            if child.op == NOT:
+                child_mask = ~self._dense(child.children[0], fetched)[0]
+            else:
+                child_mask, results[id(child)] = self._dense(child, fetched)
+            mask = child_mask.copy() if mask is None else np.logical_and(mask, child_mask, out=mask)
+            if not mask.any():
+                return self._empty()
+        # Scores in query order, a NOT operand adds 1.0
+        scores = np.zeros(len(mask))
+        for child in node.children:
+            scores += results[id(child)] if child.op != NOT else 1.0
+        scores[~mask] = 0.0
+        return mask, scores
+
+    def _evaluate_dense(self, rpn_tokens: List[str]) -> Optional[Dense]:
+        plan = self._plan(rpn_tokens)
+        return self._dense(plan, {}) if plan is not None else None
+
+    def _evaluate_rpn(self, rpn_tokens: List[str]) -> Dict[str, float]:
+        """Same contract as the dict engine: {doc_id: score}."""
+        dense = self._evaluate_dense(rpn_tokens)
+        if dense is None: return {}
+        mask, scores = dense
+        doc_ids = self._postings().doc_ids
+        docs = np.flatnonzero(mask)
+        return {doc_ids[d]: s for d, s in zip(docs.tolist(), scores[docs].tolist())}
+
+    def _run(self, rpn_tokens: List[str], top_k: Optional[int]) -> List[Tuple[str, float]]:
+        """Ranked [(doc_id, score)]: argpartition for the top k, ties by internal doc id."""
+        dense = self._evaluate_dense(rpn_tokens)
+        if dense is None or (top_k is not None and top_k <= 0): return []
+        mask, scores = dense
+        docs = np.flatnonzero(mask)
+        if top_k is not None and top_k < len(docs):
+            docs = docs[np.argpartition(-scores[docs], top_k - 1)[:top_k]]
+        docs = docs[np.lexsort((docs, -scores[docs]))]
+        doc_ids = self._postings().doc_ids
+        return [(doc_ids[d], s) for d, s in zip(docs.tolist(), scores[docs].tolist())]
+
+    @traced_query
+    def query(self, query: str, top_k: Optional[int] = None, explain: bool = False, snippets: bool = False) -> str:
+        """
+        Perform boolean query using vectorized Term-at-a-time (TaaT) processing.
+        Returns ranked results based on TF-IDF scores; top_k keeps only the k best.
+        snippets: add text snippets of the returned results (see SelfIndexTFIDF._snippets).
+        """
+        if not self.index_data:
+            raise RuntimeError("Index not loaded. Call load_index(index_id) first.")
+
+        query_log.info("[%s] Querying TaaT (TF-IDF x=3, q=T, NumPy): %s", self.identifier_short, query)
+
+        plan, rpn = None, []
+        try:
+            rpn = self._parse_query(query)
+            if explain: plan = self._explain_rpn(rpn)
+            ranked_results = self._cached_results(rpn, lambda: self._run(rpn, top_k), top_k)
+        except Exception as e:
+            query_log.warning("[%s] Query parse/eval error: %s. Returning empty results.", self.identifier_short, e)
+            ranked_results = []
+
+        out = {"query": query, "results": ranked_results, "count": len(ranked_results)}
+        if explain: out["plan"] = plan
+        if snippets: out["snippets"] = self._snippets(rpn, [doc_id for doc_id, _ in ranked_results])
+        return dumps(out)
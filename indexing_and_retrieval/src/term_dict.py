@@ -0,0 +1,235 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# ----------------------
+# Sorted term dictionary with prefix, wildcard and fuzzy expansion
+# ----------------------
+# The vocabulary sorted and front-coded: blocks of BLOCK terms, the first one stored in
+# full, the others as (bytes shared with the previous term, rest). Only the block's
+# first terms are Python strings, so a lookup is a bisect over them plus the decoding
+# of one block: O(log V).
+# - prefix "heal*": the contiguous ordinal range [lower_bound(p), lower_bound(p + max))
+# - wildcards ("*" any run, "?" one char): candidates from the literal prefix range, or
+#   from the bigram index when the pattern starts with a wildcard, then a regex check
+# - fuzzy "helth~2": the bigram index again ("$helth$" -> $h he el lt th h$). An edit
+#   changes at most 3 bigrams (2 for a substitution/insertion/deletion, 3 for an adjacent
+#   transposition: "helth" -> "hetlh" loses el lt th), so a term within d edits shares at
+#   least |grams(word)| - 3d of the word's distinct bigrams; candidates that do (and whose
+#   length is within d) are checked with a bounded Damerau-Levenshtein (adjacent
+#   transpositions count one edit).
+# The bigram index is CSR: sorted grams, offsets, ascending term ordinals.
+
+BLOCK = 16
+MAX_CHAR = "\U0010ffff"
+
+# Query words expanded against the vocabulary (SelfIndex._tokenize_query): wildcards
+# "heal*", "h?alth" and fuzzy "helth~", "helth~2"
+EXPANSION_RE = re.compile(r'[^\s"()~]*[*?][^\s"()~]*|[^\s"()*?~]+~[0-2]?')
+EXPANSION_CHARS = re.compile(r"[*?~]")
+
+
+def _varint(n: int, out: bytearray) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(buf, i: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def _grams(term: str) -> List[str]:
+    padded = f"${term}$"
+    return [padded[i:i + 2] for i in range(len(padded) - 1)]
+
+
+def edit_distance(a: str, b: str, max_edits: int) -> int:
+    """Optimal string alignment distance of a and b, or max_edits + 1 once it exceeds max_edits."""
+    if abs(len(a) - len(b)) > max_edits:
+        return max_edits + 1
+    prev2: Optional[List[int]] = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_edits:
+            return max_edits + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= max_edits else max_edits + 1
+
+
+def auto_edits(word: str) -> int:
+    """Edits allowed for "word~" (Elasticsearch AUTO): 0 up to 2 chars, 1 up to 5, else 2."""
+    return 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+
+
+class TermDictionary:
+    """Front-coded sorted vocabulary with a bigram index (see above)."""
+
+    def __init__(self, terms: Iterable[str]):
+        terms = sorted(set(terms))
+        self.size = len(terms)
+        self.first_terms: List[str] = terms[::BLOCK]
+        self.block_offsets = array("Q")
+        blob = bytearray()
+        prev = b""
+        for i, term in enumerate(terms):
+            encoded = term.encode("utf-8")
+            if i % BLOCK == 0:
+                self.block_offsets.append(len(blob))
+                shared = 0
+            else:
+                shared = 0
+                limit = min(len(prev), len(encoded))
+                while shared < limit and prev[shared] == encoded[shared]:
+                    shared += 1
+                _varint(shared, blob)
+            _varint(len(encoded) - shared, blob)
+            blob += encoded[shared:]
+            prev = encoded
+        self.block_offsets.append(len(blob))
+        self.blob = bytes(blob)
+        self.lengths = array("H", (min(len(term), 0xFFFF) for term in terms)) # chars, fuzzy length filter
+
+        by_gram: Dict[str, array] = {}
+        for ordinal, term in enumerate(terms):
+            for gram in set(_grams(term)):
+                ordinals = by_gram.get(gram)
+                if ordinals is None:
+                    ordinals = by_gram[gram] = array("I")
+                ordinals.append(ordinal)
+        self.grams: List[str] = sorted(by_gram)
+        self.gram_offsets = array("Q", [0])
+        self.gram_terms = array("I")
+        for gram in self.grams:
+            self.gram_terms.extend(by_gram[gram])
+            self.gram_offsets.append(len(self.gram_terms))
+
+    def __len__(self) -> int:
+        return self.size
+
+    # ----------------------
+    # Sorted access
+    # ----------------------
+    def _block(self, b: int) -> List[str]:
+        blob, i, end = self.blob, self.block_offsets[b], self.block_offsets[b + 1]
+        out: List[str] = []
+        prev = b""
+        while i < end:
+            shared = 0
+            if out:
+                shared, i = _read_varint(blob, i)
+            length, i = _read_varint(blob, i)
+            prev = prev[:shared] + blob[i:i + length]
+            i += length
+            out.append(prev.decode("utf-8"))
+        return out
+
+    def term(self, ordinal: int) -> str:
+        return self._block(ordinal // BLOCK)[ordinal % BLOCK]
+
+    def lower_bound(self, key: str) -> int:
+        """Ordinal of the first term >= key (len(self) if none)."""
+        b = max(0, bisect_right(self.first_terms, key) - 1)
+        if b >= len(self.first_terms):
+            return self.size
+        return b * BLOCK + bisect_left(self._block(b), key)
+
+    def __contains__(self, term: str) -> bool:
+        i = self.lower_bound(term)
+        return i < self.size and self.term(i) == term
+
+    def terms(self, lo: int = 0, hi: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """(ordinal, term) for lo <= ordinal < hi, in order."""
+        hi = self.size if hi is None else min(hi, self.size)
+        for b in range(lo // BLOCK, (hi + BLOCK - 1) // BLOCK):
+            for k, term in enumerate(self._block(b)):
+                ordinal = b * BLOCK + k
+                if lo <= ordinal < hi:
+                    yield ordinal, term
+
+    def _terms_at(self, ordinals: Iterable[int]) -> Iterator[Tuple[int, str]]:
+        """Terms of ascending ordinals, each block decoded once."""
+        cached_b, block = -1, []
+        for ordinal in ordinals:
+            b = ordinal // BLOCK
+            if b != cached_b:
+                cached_b, block = b, self._block(b)
+            yield ordinal, block[ordinal % BLOCK]
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        return self.lower_bound(prefix), self.lower_bound(prefix + MAX_CHAR)
+
+    def prefix(self, prefix: str) -> List[str]:
+        lo, hi = self.prefix_range(prefix)
+        return [term for _, term in self.terms(lo, hi)]
+
+    # ----------------------
+    # Bigram index
+    # ----------------------
+    def _gram_terms(self, gram: str) -> array:
+        i = bisect_left(self.grams, gram)
+        if i == len(self.grams) or self.grams[i] != gram:
+            return array("I")
+        return self.gram_terms[self.gram_offsets[i]:self.gram_offsets[i + 1]]
+
+    def wildcard(self, pattern: str) -> List[str]:
+        """Terms matching pattern ("*": any run of chars, "?": one char), in sorted order."""
+        regex = re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern) + r"\Z",
+                           re.DOTALL)
+        literal = re.split(r"[*?]", pattern, maxsplit=1)[0]
+        if literal:
+            candidates = self.terms(*self.prefix_range(literal))
+        else:
+            fragments = re.split(r"[*?]+", f"${pattern}$")
+            grams = {gram for fragment in fragments if len(fragment) >= 2
+                     for gram in (fragment[i:i + 2] for i in range(len(fragment) - 1))}
+            if grams:
+                lists = sorted((self._gram_terms(gram) for gram in grams), key=len)
+                ordinals = set(lists[0])
+                for more in lists[1:]:
+                    if not ordinals: break
+                    ordinals.intersection_update(more)
+                candidates = self._terms_at(sorted(ordinals))
+            else: # "*", "?*"...: every term is a candidate
+                candidates = self.terms()
+        return [term for _, term in candidates if regex.match(term)]
+
+    def fuzzy(self, word: str, max_edits: int) -> List[Tuple[str, int]]:
+        """(term, edits) for the terms within max_edits of word, closest first, then sorted."""
+        if max_edits <= 0:
+            return [(word, 0)] if word in self else []
+        grams = set(_grams(word))
+        need = len(grams) - 3 * max_edits
+        if need > 0:
+            shared = np.zeros(self.size, dtype=np.int32)
+            for gram in grams:
+                shared[np.frombuffer(self._gram_terms(gram), dtype=np.uint32)] += 1
+            lengths = np.frombuffer(self.lengths, dtype=np.uint16).astype(np.int32)
+            keep = (shared >= need) & (np.abs(lengths - len(word)) <= max_edits)
+            candidates = self._terms_at(np.flatnonzero(keep).tolist())
+        else: # too short for the bigram filter
+            candidates = self.terms()
+        matches = []
+        for _, term in candidates:
+            edits = edit_distance(word, term, max_edits)
+            if edits <= max_edits:
+                matches.append((term, edits))
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches
@@ -0,0 +1,189 @@
+import re
+from functools import lru_cache, partial
+from typing import Iterable, Dict, Any, List, Tuple, Optional
+
+from nltk.stem import PorterStemmer
+from nltk.tokenize import sent_tokenize, NLTKWordTokenizer
+
+# Characters the Treebank "final period" rule lets follow a sentence-final '.'
+# (e.g. `said." )`); chunks made only of these never contain words.
+_CLOSING_CHARS = "])}>\"'»”’"
+
+# Treebank (MacIntyre) contractions that split an all-letter word
+_CONTRACTIONS = {
+    "cannot": ("can", "not"),
+    "gimme": ("gim", "me"),
+    "gonna": ("gon", "na"),
+    "gotta": ("got", "ta"),
+    "lemme": ("lem", "me"),
+    "wanna": ("wan", "na"),
+}
+
+# Sentence-ending characters for Punkt; text without them is a single sentence
+_SENT_END_CHARS = (".", "?", "!")
+
+_CHUNK_RE = re.compile(r"\S+")
+_OTHER_WHITESPACE_RE = re.compile(r"[^\S ]")
+
+
+class Analyzer:
+    """
+    Drop-in, memoized replacement for preprocess_text:
+    lowercase -> word_tokenize -> keep isalpha() -> drop stopwords -> Porter stem.
+
+    Output is identical to preprocess_text. Instead of running the Treebank regex
+    cascade over every sentence, each sentence is split on whitespace and every chunk
+    is analyzed once and cached:
+    - all-letter chunks (the vast majority) are their own token, except a few
+      Treebank contractions ("cannot" -> "can not")
+    - other chunks go through NLTKWordTokenizer between dummy neighbours joined by the
+      same kind of separator, which gives the same tokens as inside the sentence (the
+      Treebank rules only look across whitespace at the separator itself)
+    - the last chunk of a sentence is analyzed separately, since the Treebank
+      final-period rule only applies there ("said." vs "said . ")
+    Sentences still come from the same Punkt model word_tokenize uses. A single-pass
+    regex tokenizer cannot replace it: "word." is one token (dropped by isalpha) where
+    Punkt reads an abbreviation, and "word" "." at a sentence end, so the sentence
+    boundaries change the terms and preprocess_text parity (gold_standard.json) needs them.
+
+    Usage:
+        analyzer = Analyzer(STOP_WORDS, STEMMER)
+        analyzer("Some text")            # == preprocess_text("Some text")
+        analyzer.analyze_many(texts)     # batch, for ingestion
+        analyzer.stats()                 # cache hit rates
+    """
+
+    def __init__(self, stop_words: Optional[Iterable[str]] = None, stemmer=None, language: str = "english",
+                 stem_cache_size: int = 200_000, chunk_cache_size: int = 500_000):
+        if stop_words is None:
+            from nltk.corpus import stopwords
+            stop_words = stopwords.words(language)
+        self.stop_words = frozenset(stop_words)
+        self.stemmer = stemmer if stemmer is not None else PorterStemmer()
+        self.language = language
+        self.stem_cache_size = stem_cache_size
+        self.chunk_cache_size = chunk_cache_size
+        self._word_tokenizer = NLTKWordTokenizer()
+        self._init_caches()
+
+    def _init_caches(self):
+        self._sent_tokenize = partial(sent_tokenize, language=self.language)
+        self.stem = lru_cache(maxsize=self.stem_cache_size)(self.stemmer.stem)
+        self._chunk_terms = lru_cache(maxsize=self.chunk_cache_size)(self._analyze_chunk)
+
+    # lru_cache wrappers are not picklable; rebuild them (empty) on unpickle,
+    # so an Analyzer can be passed to worker processes as preprocess_fn
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_sent_tokenize", "stem", "_chunk_terms"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+    # ----------------------
+    # Chunk analysis (cached)
+    # ----------------------
+    def _filter_and_stem(self, tokens: Iterable[str]) -> Tuple[str, ...]:
+        stop_words, stem = self.stop_words, self.stem
+        return tuple(stem(t) for t in tokens if t.isalpha() and t not in stop_words)
+
+    def _analyze_chunk(self, chunk: str, before: str, after: str) -> Tuple[str, ...]:
+        """
+        Terms contributed by one whitespace chunk.
+        before/after describe its neighbours: "" = sentence boundary, " " = a space,
+        "\n" = any other whitespace (a few Treebank rules only match a literal space).
+        after == "" means `chunk` is the sentence tail and gets the final-period rule.
+        """
+        if chunk.isalpha():
+            return self._filter_and_stem(_CONTRACTIONS.get(chunk, (chunk,)))
+        text = chunk
+        if before:
+            text = "_" + before + text
+        if after:
+            text = text + after + "_"
+        tokens = self._word_tokenizer.tokenize(text)
+        if before:
+            tokens = tokens[1:]
+        if after:
+            tokens = tokens[:-1]
+        return self._filter_and_stem(tokens)
+
+    @staticmethod
+    def _separator(ch: str) -> str:
+        return ch if ch in ("", " ") else "\n"
+
+    def _sentence_chunks(self, sent: str):
+        """Yield (chunk, before, after) cache keys for one sentence."""
+        if not _OTHER_WHITESPACE_RE.search(sent):
+            # Fast path: spaces only, so every separator is " "
+            lead = " " if sent.startswith(" ") else ""
+            chunks = sent.split()
+            if not chunks:
+                return
+            last = len(chunks) - 1
+            # Last chunk that isn't only closing quotes/brackets gets the final-period rule
+            while last > 0 and not chunks[last].strip(_CLOSING_CHARS):
+                last -= 1
+            for i in range(last):
+                yield chunks[i], (lead if i == 0 else " "), " "
+            tail = chunks[last] if last == len(chunks) - 1 else sent[sent.rindex(chunks[last]):]
+            yield tail, (lead if last == 0 else " "), ""
+            return
+
+        spans = [m.span() for m in _CHUNK_RE.finditer(sent)]
+        if not spans:
+            return
+        last = len(spans) - 1
+        while last > 0 and not sent[spans[last][0]:spans[last][1]].strip(_CLOSING_CHARS):
+            last -= 1
+        sep = self._separator
+        for i in range(last):
+            start, end = spans[i]
+            yield sent[start:end], sep(sent[start - 1:start]), sep(sent[end:end + 1])
+        start = spans[last][0]
+        # Keep the original separators of the tail (the final-period rule is whitespace-sensitive)
+        yield sent[start:], sep(sent[start - 1:start]), ""
+
+    # ----------------------
+    # Public API
+    # ----------------------
+    def analyze(self, text: str) -> List[str]:
+        """Same result as preprocess_text(text)."""
+        text = text.lower()
+        if any(c in text for c in _SENT_END_CHARS):
+            sentences = self._sent_tokenize(text)
+        else:
+            sentences = (text,)
+
+        chunk_terms = self._chunk_terms
+        out: List[str] = []
+        for sent in sentences:
+            for key in self._sentence_chunks(sent):
+                out.extend(chunk_terms(*key))
+        return out
+
+    __call__ = analyze
+
+    def analyze_many(self, texts: Iterable[str]) -> List[List[str]]:
+        """Batch analyze (e.g. a DataFrame column during ingestion)."""
+        analyze = self.analyze
+        return [analyze(text) for text in texts]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counts and hit rates of the stem and chunk caches."""
+        out: Dict[str, Any] = {}
+        for name, cached in (("stem", self.stem), ("chunk", self._chunk_terms)):
+            info = cached.cache_info()
+            lookups = info.hits + info.misses
+            out[f"{name}_hits"] = info.hits
+            out[f"{name}_misses"] = info.misses
+            out[f"{name}_hit_rate"] = info.hits / lookups if lookups else 0.0
+            out[f"{name}_cache_size"] = info.currsize
+        return out
+
+    def clear_caches(self) -> None:
+        self.stem.cache_clear()
+        self._chunk_terms.cache_clear()
@@ -0,0 +1,323 @@
+import bisect
+import heapq
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING: # compact_index imports this module
+    from block_postings import BlockPostings
+    from compact_index import CompactPostings
+
+# ----------------------
+# Exact top-k retrieval for disjunctive TF-IDF queries ("a OR b OR c")
+# ----------------------
+# score(d) = sum over query terms t in d of weight_t * tf(t, d), weight_t = idf(t) x
+# (times t occurs in the query), which is what _evaluate_rpn computes for OR.
+# Both strategies below walk doc id sorted postings and use the per-term upper bound
+# weight_t * max_tf(t) to skip documents that cannot beat the current k-th score:
+# - WAND (Optimizations.Thresholding): cursors sorted by current doc; the pivot is the
+#   first cursor at which the summed upper bounds exceed the threshold, and every
+#   cursor before it jumps (binary search) straight to the pivot doc
+# - MaxScore (Optimizations.EarlyStopping): terms sorted by upper bound; the low ones
+#   whose bounds together cannot beat the threshold are "non-essential" and are only
+#   probed for candidates found in the essential lists, stopping as soon as the rest
+#   cannot lift the candidate above the threshold
+# - Block-max WAND (BlockPostings): WAND whose pivot is also checked against the max
+#   tf of the block each list would have to read it from (block headers, no decoding);
+#   if those block bounds cannot beat the threshold, every list up to the pivot jumps
+#   past the nearest block end at once
+# Results are exact. Ties are broken by index order (segment, internal doc id).
+
+
+class TopKHeap:
+    """Min-heap of the best k (score, doc) seen so far; threshold = k-th best score."""
+
+    def __init__(self, k: int):
+        if k <= 0:
+            raise ValueError("top_k must be positive")
+        self.k = k
+        self._heap: List[Tuple[float, int, str]] = []
+
+    @property
+    def threshold(self) -> float:
+        """A document must score strictly above this to enter (0.0 until the heap is full)."""
+        return self._heap[0][0] if len(self._heap) >= self.k else 0.0
+
+    def offer(self, score: float, order: int, doc_id: str) -> None:
+        # Among equal scores the later document (larger order) sits on top and goes first
+        entry = (score, -order, doc_id)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def results(self) -> List[Tuple[str, float]]:
+        """[(doc_id, score)] best first."""
+        return [(doc_id, score) for score, _, doc_id in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
+
+
+def disjunctive_terms(rpn_tokens: List[str]) -> Optional[Counter]:
+    """
+    {term: occurrences} if the RPN is a single term or an OR of single terms
+    (the queries top-k pruning applies to), else None.
+    """
+    operands = [tok for tok in rpn_tokens if tok not in ("AND", "OR", "NOT")]
+    operators = [tok for tok in rpn_tokens if tok in ("AND", "OR", "NOT")]
+    if not operands or any(op != "OR" for op in operators) or len(operators) != len(operands) - 1:
+        return None
+    if any(" " in tok for tok in operands): # phrases
+        return None
+    return Counter(operands)
+
+
+class _Cursor:
+    __slots__ = ("pos", "end", "weight", "upper", "term")
+
+    def __init__(self, start: int, end: int, weight: float, upper: float, term: str):
+        self.pos = start
+        self.end = end
+        self.weight = weight
+        self.upper = upper
+        self.term = term
+
+
+def _cursors(postings: "CompactPostings", weights: Dict[str, float]) -> List[_Cursor]:
+    out = []
+    for term, weight in weights.items():
+        rng = postings.term_range(term)
+        if rng and weight > 0 and rng[0] < rng[1]:
+            out.append(_Cursor(rng[0], rng[1], weight, weight * postings.max_tf(term), term))
+    return out
+
+
+def single_term_top_k(postings: "CompactPostings", term: str, weight: float, heap: TopKHeap,
+                      is_deleted: Optional[Callable[[int], bool]] = None, order_base: int = 0) -> None:
+    """One term: the best docs are simply the largest tfs (heapq.nlargest, no per-doc Python work)."""
+    rng = postings.term_range(term)
+    if not rng or weight <= 0:
+        return
+    post_docs, post_tfs, doc_ids = postings.post_docs, postings.post_tfs, postings.doc_ids
+    candidates = range(rng[0], rng[1])
+    if is_deleted is not None:
+        candidates = [p for p in candidates if not is_deleted(post_docs[p])]
+    # nlargest is stable, so equal tfs keep doc order
+    for p in heapq.nlargest(heap.k, candidates, key=post_tfs.__getitem__):
+        d = post_docs[p]
+        heap.offer(weight * post_tfs[p], order_base + d, doc_ids[d])
+
+
+def wand_top_k(postings: "CompactPostings", weights: Dict[str, float], heap: TopKHeap,
+               is_deleted: Optional[Callable[[int], bool]] = None, order_base: int = 0) -> int:
+    """WAND over one CompactPostings. Returns the number of fully scored documents."""
+    post_docs, post_tfs, doc_ids = postings.post_docs, postings.post_tfs, postings.doc_ids
+    cursors = _cursors(postings, weights)
+    scored = 0
+    while cursors:
+        cursors.sort(key=lambda c: post_docs[c.pos])
+        threshold = heap.threshold
+
+        # Pivot: first cursor where the summed upper bounds can beat the threshold
+        acc = 0.0
+        pivot = -1
+        for i, c in enumerate(cursors):
+            acc += c.upper
+            if acc > threshold:
+                pivot = i
+                break
+        if pivot < 0:
+            break
+        pivot_doc = post_docs[cursors[pivot].pos]
+
+        if post_docs[cursors[0].pos] == pivot_doc:
+            # Every cursor up to the pivot is on pivot_doc: score it fully
+            score = 0.0
+            for c in cursors:
+                if post_docs[c.pos] != pivot_doc:
+                    break
+                score += c.weight * post_tfs[c.pos]
+                c.pos += 1
+            if is_deleted is None or not is_deleted(pivot_doc):
+                heap.offer(score, order_base + pivot_doc, doc_ids[pivot_doc])
+                scored += 1
+        else:
+            # Docs before pivot_doc appear only in cursors[:pivot] and cannot beat the threshold
+            for c in cursors[:pivot]:
+                c.pos = bisect.bisect_left(post_docs, pivot_doc, c.pos, c.end)
+        cursors = [c for c in cursors if c.pos < c.end]
+    return scored
+
+
+def maxscore_top_k(postings: "CompactPostings", weights: Dict[str, float], heap: TopKHeap,
+                   is_deleted: Optional[Callable[[int], bool]] = None, order_base: int = 0) -> int:
+    """MaxScore over one CompactPostings. Returns the number of fully scored documents."""
+    post_docs, post_tfs, doc_ids = postings.post_docs, postings.post_tfs, postings.doc_ids
+    cursors = sorted(_cursors(postings, weights), key=lambda c: c.upper)
+    # prefix[i] = summed upper bounds of cursors[0..i]
+    prefix = []
+    acc = 0.0
+    for c in cursors:
+        acc += c.upper
+        prefix.append(acc)
+
+    scored = 0
+    first_essential = 0
+    while True:
+        threshold = heap.threshold
+        while first_essential < len(cursors) and prefix[first_essential] <= threshold:
+            first_essential += 1
+        essential = [c for c in cursors[first_essential:] if c.pos < c.end]
+        if not essential:
+            break
+
+        doc = min(post_docs[c.pos] for c in essential)
+        score = 0.0
+        for c in essential:
+            if post_docs[c.pos] == doc:
+                score += c.weight * post_tfs[c.pos]
+                c.pos += 1
+
+        # Probe non-essential lists, highest bound first, while they can still matter
+        for i in range(first_essential - 1, -1, -1):
+            if score + prefix[i] <= threshold:
+                break
+            c = cursors[i]
+            c.pos = bisect.bisect_left(post_docs, doc, c.pos, c.end)
+            if c.pos < c.end and post_docs[c.pos] == doc:
+                score += c.weight * post_tfs[c.pos]
+                c.pos += 1
+
+        if score > threshold and (is_deleted is None or not is_deleted(doc)):
+            heap.offer(score, order_base + doc, doc_ids[doc])
+            scored += 1
+    return scored
+
+
+# Past-the-end doc id of an exhausted block cursor
+_END = 1 << 32
+
+
+class _BlockCursor:
+    """Cursor over one term of a BlockPostings, decoding one block at a time."""
+    __slots__ = ("postings", "b0", "end", "lasts", "block", "docs", "tfs", "i", "doc", "weight", "upper", "order",
+                 "shallow_last", "shallow_bound")
+
+    def __init__(self, postings: "BlockPostings", b0: int, b1: int, weight: float, upper: float, order: int):
+        self.postings = postings
+        self.order = order # query order, the order scores are summed in
+        self.b0 = b0
+        self.end = b1
+        self.lasts = postings.blk_last[b0:b1].tolist()
+        self.weight = weight
+        self.upper = upper
+        self.shallow_last = -1 # last doc of the block bound_at() last looked at
+        self.shallow_bound = 0.0
+        self._load(b0)
+
+    def _load(self, block: int) -> None:
+        self.block = block
+        if block == self.end:
+            self.doc = _END
+            return
+        self.docs = self.postings.block_docs(block).tolist()
+        self.tfs = None # decoded on first score
+        self.i = 0
+        self.doc = self.docs[0]
+
+    def tf(self) -> int:
+        if self.tfs is None:
+            self.tfs = self.postings.block_tfs(self.block).tolist()
+        return self.tfs[self.i]
+
+    def next(self) -> None:
+        self.i += 1
+        if self.i < len(self.docs):
+            self.doc = self.docs[self.i]
+        else:
+            self._load(self.block + 1)
+
+    def shallow(self, target: int) -> int:
+        """Block that would hold target (headers only), self.end if past the term."""
+        return self.b0 + bisect.bisect_left(self.lasts, target, self.block - self.b0)
+
+    def bound_at(self, target: int) -> float:
+        """
+        weight * max tf of the block that would hold target; shallow_last is its last doc.
+        Cached until target passes that block (pivot docs never decrease).
+        """
+        if target > self.shallow_last:
+            block = self.shallow(target)
+            if block < self.end:
+                self.shallow_last = self.lasts[block - self.b0]
+                self.shallow_bound = self.weight * int(self.postings.blk_max_tf[block])
+            else:
+                self.shallow_last = _END
+                self.shallow_bound = 0.0
+        return self.shallow_bound
+
+    def advance(self, target: int) -> None:
+        """Move to the first posting with doc >= target, skipping whole blocks undecoded."""
+        if self.doc >= target:
+            return
+        block = self.shallow(target)
+        if block != self.block:
+            self._load(block)
+            if self.doc >= target:
+                return
+        self.i = bisect.bisect_left(self.docs, target, self.i)
+        self.doc = self.docs[self.i]
+
+
+def block_max_wand_top_k(postings: "BlockPostings", weights: Dict[str, float], heap: TopKHeap,
+                         is_deleted: Optional[Callable[[int], bool]] = None, order_base: int = 0) -> int:
+    """Block-max WAND over one BlockPostings. Returns the number of fully scored documents."""
+    doc_ids = postings.doc_ids
+    cursors = []
+    for order, (term, weight) in enumerate(weights.items()):
+        rng = postings.block_range(term)
+        if rng and weight > 0 and rng[0] < rng[1]:
+            cursors.append(_BlockCursor(postings, rng[0], rng[1], weight, weight * postings.max_tf(term), order))
+    scored = 0
+    while cursors:
+        cursors.sort(key=lambda c: c.doc)
+        threshold = heap.threshold
+
+        acc = 0.0
+        pivot = -1
+        for i, c in enumerate(cursors):
+            acc += c.upper
+            if acc > threshold:
+                pivot = i
+                break
+        if pivot < 0:
+            break
+        pivot_doc = cursors[pivot].doc
+        # Every list already on pivot_doc contributes to it
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+            pivot += 1
+
+        # Block bound of pivot_doc: lists after the pivot start at or past boundary
+        bound = 0.0
+        boundary = cursors[pivot + 1].doc if pivot + 1 < len(cursors) else _END
+        for c in cursors[:pivot + 1]:
+            bound += c.bound_at(pivot_doc)
+            if c.shallow_last < boundary:
+                boundary = c.shallow_last + 1
+
+        if bound <= threshold:
+            # No doc in [pivot_doc, boundary) can beat the threshold
+            for c in cursors[:pivot + 1]:
+                c.advance(boundary)
+        elif cursors[0].doc == pivot_doc:
+            score = 0.0
+            for c in sorted(cursors[:pivot + 1], key=lambda c: c.order):
+                score += c.weight * c.tf()
+                c.next()
+            if is_deleted is None or not is_deleted(pivot_doc):
+                heap.offer(score, order_base + pivot_doc, doc_ids[pivot_doc])
+                scored += 1
+        else:
+            for c in cursors:
+                if c.doc >= pivot_doc:
+                    break
+                c.advance(pivot_doc)
+        cursors = [c for c in cursors if c.doc < _END]
+    return scored